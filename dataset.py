@@ -0,0 +1,71 @@
+import mmap
+import os
+
+import bson
+from bson.raw_bson import RawBSONDocument
+
+def datasetPath(datasetDir, documentProvider, testIdx):
+    """
+    Dataset Path
+
+    :param datasetDir:
+    :param documentProvider:
+    :param testIdx:
+    :return: the path of the file holding the documents of testIdx rendered by documentProvider
+    """
+    return os.path.join(datasetDir, documentProvider.__class__.__name__.lower(), testIdx + ".bson")
+
+def prepareDataset(datasetDir, documentProvider, testIdxs, numDocs, chunkSize=1000):
+    """
+    Prepare Dataset
+
+    Renders the documents 0 to numDocs - 1 of every testIdx once into a file of concatenated BSON
+    documents. Every BSON document starts with its own int32 length, so the file can be split
+    into documents without parsing them.
+
+    :param datasetDir:
+    :param documentProvider: the source of the content of the documents
+    :param testIdxs:
+    :param numDocs: number of documents per testIdx
+    :param chunkSize: number of documents created per createDocuments call
+    :return:
+    """
+    for testIdx in testIdxs:
+        path = datasetPath(datasetDir, documentProvider, testIdx)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with open(path + ".tmp", "wb") as f:
+            for start in range(0, numDocs, chunkSize):
+                for doc in documentProvider.createDocuments(testIdx, start, min(chunkSize, numDocs - start)):
+                    f.write(doc.raw if isinstance(doc, RawBSONDocument) else bson.encode(doc))
+        os.replace(path + ".tmp", path)
+
+class MappedDataset():
+    """
+    Mapped Dataset
+
+    A file written by prepareDataset, memory-mapped read only. Every document is exposed as a
+    RawBSONDocument over a slice of the mapping, so inserting them sends the mapped bytes without
+    creating or encoding any document.
+    """
+    def __init__(self, path):
+        self.path = path
+        with open(path, "rb") as f:
+            self.map = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        view = memoryview(self.map)
+        self.docs = []
+        offset = 0
+        while offset < len(view):
+            length = int.from_bytes(view[offset:offset + 4], "little")
+            self.docs.append(RawBSONDocument(view[offset:offset + length]))
+            offset += length
+    def __len__(self):
+        return len(self.docs)
+    def getDocuments(self, start, count):
+        """
+        Get Documents
+
+        :param start:
+        :param count:
+        :return: the RawBSONDocuments start to start + count - 1
+        """
+        return self.docs[start:start + count]
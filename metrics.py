@@ -0,0 +1,463 @@
+import collections
+import multiprocessing
+import time
+
+from scipy import stats
+
+class LatencyHistogram():
+    """
+    Latency Histogram
+
+    A compact, mergeable histogram of operation latencies with HDR-style log-linear buckets.
+
+    Latencies are recorded in microseconds. Values below 2^SUB_BUCKET_BITS get their own bucket,
+    larger values share a bucket with values of the same magnitude so the relative error of any
+    percentile stays below 2^-(SUB_BUCKET_BITS - 1). Buckets are stored sparsely and their number
+    is bounded, so the memory footprint does not depend on how many operations are recorded.
+    """
+    SUB_BUCKET_BITS     = 8
+    SUB_BUCKET_COUNT    = 1 << SUB_BUCKET_BITS
+    SUB_BUCKET_HALF     = SUB_BUCKET_COUNT >> 1
+
+    def __init__(self):
+        self.counts = {}
+        self.count  = 0
+        self.total  = 0
+        self.min    = None
+        self.max    = None
+    def _bucketIndex(self, micros):
+        if micros < self.SUB_BUCKET_COUNT:
+            return micros
+        shift = micros.bit_length() - self.SUB_BUCKET_BITS
+        return self.SUB_BUCKET_COUNT + (shift - 1) * self.SUB_BUCKET_HALF + (micros >> shift) - self.SUB_BUCKET_HALF
+    def _bucketValue(self, index):
+        """
+        Bucket Value
+
+        :param index:
+        :return: the highest latency in microseconds that falls into the bucket
+        """
+        if index < self.SUB_BUCKET_COUNT:
+            return index
+        shift = int((index - self.SUB_BUCKET_COUNT) / self.SUB_BUCKET_HALF) + 1
+        subBucket = (index - self.SUB_BUCKET_COUNT) % self.SUB_BUCKET_HALF + self.SUB_BUCKET_HALF
+        return ((subBucket + 1) << shift) - 1
+    def record(self, seconds, count=1):
+        """
+        Record
+
+        :param seconds: latency of one operation
+        :param count: number of operations that took this long
+        :return:
+        """
+        micros = max(int(seconds * 1000000), 0)
+        index = self._bucketIndex(micros)
+        self.counts[index] = self.counts.get(index, 0) + count
+        self.count += count
+        self.total += micros * count
+        if self.min is None or micros < self.min:
+            self.min = micros
+        if self.max is None or micros > self.max:
+            self.max = micros
+    def merge(self, other):
+        """
+        Merge
+
+        Adds the recordings of another histogram, e.g. one returned by a worker process
+
+        :param other:
+        :return:
+        """
+        for index, count in other.counts.items():
+            self.counts[index] = self.counts.get(index, 0) + count
+        self.count += other.count
+        self.total += other.total
+        if other.min is not None and (self.min is None or other.min < self.min):
+            self.min = other.min
+        if other.max is not None and (self.max is None or other.max > self.max):
+            self.max = other.max
+    def percentile(self, percent):
+        """
+        Percentile
+
+        :param percent: between 0 and 100
+        :return: the latency in seconds at or below which percent of the operations completed
+        """
+        if self.count == 0:
+            return 0.0
+        rank = max(int(round(self.count * percent / 100.0)), 1)
+        seen = 0
+        for index in sorted(self.counts):
+            seen += self.counts[index]
+            if seen >= rank:
+                return min(self._bucketValue(index), self.max) / 1000000.0
+        return self.max / 1000000.0
+    def mean(self):
+        """
+        Mean
+
+        :return: the mean latency in seconds
+        """
+        if self.count == 0:
+            return 0.0
+        return self.total / self.count / 1000000.0
+    def summary(self):
+        """
+        Summary
+
+        :return: a one line description of the latency distribution in milliseconds
+        """
+        if self.count == 0:
+            return "no operations recorded"
+        return "mean={:.3f} p50={:.3f} p90={:.3f} p99={:.3f} p99.9={:.3f} max={:.3f}".format(
+            self.mean() * 1000, self.percentile(50) * 1000, self.percentile(90) * 1000,
+            self.percentile(99) * 1000, self.percentile(99.9) * 1000, self.max / 1000.0)
+
+class RunningStats():
+    """
+    Running Stats
+
+    Constant-memory aggregator of a stream of values that reports the same figures as
+    scipy.stats.describe (sample variance, biased skewness and Fisher kurtosis) using the
+    online update of the central moments.
+    """
+    def __init__(self):
+        self.count  = 0
+        self.total  = 0.0
+        self.mean   = 0.0
+        self.m2     = 0.0
+        self.m3     = 0.0
+        self.m4     = 0.0
+        self.min    = None
+        self.max    = None
+    def record(self, value):
+        """
+        Record
+
+        :param value:
+        :return:
+        """
+        n1 = self.count
+        self.count += 1
+        n = self.count
+        delta = value - self.mean
+        deltaN = delta / n
+        deltaN2 = deltaN * deltaN
+        term1 = delta * deltaN * n1
+        self.mean += deltaN
+        self.m4 += term1 * deltaN2 * (n*n - 3*n + 3) + 6 * deltaN2 * self.m2 - 4 * deltaN * self.m3
+        self.m3 += term1 * deltaN * (n - 2) - 3 * deltaN * self.m2
+        self.m2 += term1
+        self.total += value
+        if self.min is None or value < self.min:
+            self.min = value
+        if self.max is None or value > self.max:
+            self.max = value
+    def merge(self, other):
+        """
+        Merge
+
+        Combines the moments of another RunningStats, e.g. one returned by a worker process
+
+        :param other:
+        :return:
+        """
+        if other.count == 0:
+            return
+        if self.count == 0:
+            self.__dict__.update(other.__dict__)
+            return
+        na, nb = self.count, other.count
+        n = na + nb
+        delta = other.mean - self.mean
+        m2a, m3a = self.m2, self.m3
+        self.m4 += other.m4 + delta**4 * na * nb * (na*na - na*nb + nb*nb) / n**3 \
+            + 6 * delta**2 * (na*na * other.m2 + nb*nb * m2a) / n**2 + 4 * delta * (na * other.m3 - nb * m3a) / n
+        self.m3 += other.m3 + delta**3 * na * nb * (na - nb) / n**2 + 3 * delta * (na * other.m2 - nb * m2a) / n
+        self.m2 += other.m2 + delta**2 * na * nb / n
+        self.mean += delta * nb / n
+        self.count = n
+        self.total += other.total
+        self.min = min(self.min, other.min)
+        self.max = max(self.max, other.max)
+    def variance(self):
+        return self.m2 / (self.count - 1) if self.count > 1 else 0.0
+    def skewness(self):
+        return (self.count ** 0.5) * self.m3 / self.m2 ** 1.5 if self.m2 > 0 else 0.0
+    def kurtosis(self):
+        return self.count * self.m4 / (self.m2 * self.m2) - 3.0 if self.m2 > 0 else 0.0
+    def asDict(self):
+        """
+        As Dict
+
+        :return: the count, mean, sample variance, min and max, enough to test the difference of two means
+        """
+        return {"count": self.count, "mean": self.mean, "variance": self.variance(), "min": self.min, "max": self.max}
+    def describe(self):
+        """
+        Describe
+
+        :return: a one line description in the format of scipy.stats.describe
+        """
+        return "DescribeResult(nobs={}, minmax=({}, {}), mean={}, variance={}, skewness={}, kurtosis={})".format(
+            self.count, self.min, self.max, self.mean, self.variance(), self.skewness(), self.kurtosis())
+
+class ConvergenceDetector():
+    """
+    Convergence Detector
+
+    Decides when a test has run enough trials. The first warmupTrials values are discarded, then
+    values keep being discarded until the means of the last two windows of window values agree
+    within steadyTolerance. From then on values are measured until the confidence interval of
+    their mean is within targetRelativeError of the mean, or until timeBudget seconds have passed
+    since start().
+
+    The window is at most warmupTrials long, so 0 warm-up trials measures from the first value.
+    Given the trial limit of the test, the warm-up is shortened to leave at least half of the
+    trials to be measured.
+    """
+    WARMUP      = "warm-up"
+    MEASURING   = "measuring"
+    CONVERGED   = "converged"
+    OUT_OF_TIME = "time budget exhausted"
+
+    def __init__(self, targetRelativeError=0.02, confidence=0.95, warmupTrials=5, window=10, steadyTolerance=0.1, minTrials=10, timeBudget=None):
+        self.targetRelativeError    = targetRelativeError
+        self.confidence             = confidence
+        self.warmupTrials           = warmupTrials
+        self.window                 = window
+        self.steadyTolerance        = steadyTolerance
+        self.minTrials              = max(minTrials, 2)
+        self.timeBudget             = timeBudget
+        self.start()
+    def start(self, maxTrials=None):
+        """
+        Start
+
+        Resets the detector and starts the time budget
+
+        :param maxTrials: the number of trials the test runs at most, or None if unlimited
+        :return:
+        """
+        self.numWarmupTrials = self.warmupTrials
+        self.steadyWindow   = min(self.window, self.warmupTrials)
+        if maxTrials is not None:
+            self.numWarmupTrials = min(self.numWarmupTrials, int(maxTrials / 2))
+            self.steadyWindow = min(self.steadyWindow, int(maxTrials / 4))
+        self.startTime      = time.time()
+        self.phase          = self.WARMUP
+        self.numDiscarded   = 0
+        self.recent         = collections.deque(maxlen=2 * self.steadyWindow)
+        self.measured       = RunningStats()
+    def observe(self, value):
+        """
+        Observe
+
+        :param value: the metric of a finished trial
+        :return: True if the trial belongs to the measured steady state
+        """
+        measure = False
+        if self.phase == self.WARMUP and self.numDiscarded >= self.numWarmupTrials and self._isSteady():
+            self.phase = self.MEASURING
+        if self.phase == self.WARMUP:
+            self.numDiscarded += 1
+            self.recent.append(value)
+        elif self.phase == self.MEASURING:
+            self.measured.record(value)
+            measure = True
+            if self.measured.count >= self.minTrials and self.relativeError() <= self.targetRelativeError:
+                self.phase = self.CONVERGED
+        if not self.isDone() and self.timeBudget is not None and time.time() - self.startTime >= self.timeBudget:
+            self.phase = self.OUT_OF_TIME
+        return measure
+    def _isSteady(self):
+        if self.steadyWindow == 0:
+            return True
+        if len(self.recent) < self.recent.maxlen:
+            return False
+        values = list(self.recent)
+        previousMean = sum(values[:self.steadyWindow]) / self.steadyWindow
+        lastMean = sum(values[self.steadyWindow:]) / self.steadyWindow
+        return previousMean > 0 and abs(lastMean - previousMean) / previousMean <= self.steadyTolerance
+    def isDone(self):
+        return self.phase in (self.CONVERGED, self.OUT_OF_TIME)
+    def isConverged(self):
+        return self.phase == self.CONVERGED
+    def relativeError(self):
+        """
+        Relative Error
+
+        :return: the half width of the confidence interval of the measured mean relative to the mean
+        """
+        if self.measured.count < 2 or self.measured.mean == 0:
+            return float("inf")
+        halfWidth = stats.t.ppf((1 + self.confidence) / 2, self.measured.count - 1) * (self.measured.variance() / self.measured.count) ** 0.5
+        return halfWidth / abs(self.measured.mean)
+    def report(self):
+        """
+        Report
+
+        :return: a one line description of how many trials were needed
+        """
+        status = self.phase if self.isDone() else "trial limit reached while " + self.phase
+        return "{}: discarded {} warm-up trials, measured {} trials, relative error {:.4f} at {:.0f}% confidence (target {}) in {:.1f}s".format(
+            status, self.numDiscarded, self.measured.count, self.relativeError(), self.confidence * 100,
+            self.targetRelativeError, time.time() - self.startTime)
+
+class PhaseTimer():
+    """
+    Phase Timer
+
+    Accumulates the time spent in each phase of a trial: creating documents (generate), encoding
+    them to BSON (encode), waiting for the server (send) and handling errors (errors). Timers of
+    workers and trials are merged by adding them up, so with several workers the total is worker
+    time rather than wall clock time.
+    """
+    PHASES = ("generate", "encode", "send", "errors")
+
+    def __init__(self):
+        self.seconds = {}
+    def add(self, phase, seconds):
+        """
+        Add
+
+        :param phase:
+        :param seconds: time spent in the phase
+        :return:
+        """
+        self.seconds[phase] = self.seconds.get(phase, 0.0) + seconds
+    def merge(self, other):
+        """
+        Merge
+
+        Adds the phase times of another timer, e.g. one returned by a worker process
+
+        :param other:
+        :return:
+        """
+        for phase, seconds in other.seconds.items():
+            self.add(phase, seconds)
+    def total(self):
+        return sum(self.seconds.values())
+    def summary(self):
+        """
+        Summary
+
+        :return: a one line description of the time and share of every phase
+        """
+        total = self.total()
+        if total == 0:
+            return "no phases recorded"
+        phases = [phase for phase in self.PHASES if phase in self.seconds] + sorted(phase for phase in self.seconds if phase not in self.PHASES)
+        return " ".join("{}={:.3f}s ({:.1f}%)".format(phase, self.seconds[phase], self.seconds[phase] / total * 100) for phase in phases)
+
+class LiveLatencyHistogram(LatencyHistogram):
+    """
+    Live Latency Histogram
+
+    A LatencyHistogram with coarser buckets, about 12% wide, whose NUM_BUCKETS indices cover
+    latencies of up to 2^43 microseconds, so every bucket fits in a fixed size array
+    """
+    SUB_BUCKET_BITS     = 4
+    SUB_BUCKET_COUNT    = 1 << SUB_BUCKET_BITS
+    SUB_BUCKET_HALF     = SUB_BUCKET_COUNT >> 1
+    NUM_BUCKETS         = SUB_BUCKET_COUNT + 40 * SUB_BUCKET_HALF
+
+class LiveCounters():
+    """
+    Live Counters
+
+    Operation, document and latency counters in shared memory that the workers of a test update
+    while it runs, so a reporter can follow its progress from another process. Every worker owns a
+    slot and is the only one writing to it, so no lock is taken. A reader may see a slot in the
+    middle of an update, which only moves a count to the next read.
+
+    Counters only grow. The progress over an interval is the difference of two snapshots.
+    """
+    OPS         = 0
+    DOCS        = 1
+    LATENCY     = 2
+    BUCKETS     = 3
+
+    def __init__(self, numSlots):
+        self.numSlots   = numSlots
+        self.width      = self.BUCKETS + LiveLatencyHistogram.NUM_BUCKETS
+        self.values     = multiprocessing.RawArray("d", numSlots * self.width)
+    def slot(self, slot):
+        """
+        Slot
+
+        :param slot: the index of the worker, below numSlots
+        :return: the LiveCounterSlot the worker records its operations in
+        """
+        return LiveCounterSlot(self, slot)
+    def snapshot(self):
+        """
+        Snapshot
+
+        :return: the sum of the counters of all slots
+        """
+        totals = [0.0] * self.width
+        for slot in range(self.numSlots):
+            offset = slot * self.width
+            totals = [total + value for total, value in zip(totals, self.values[offset:offset + self.width])]
+        return totals
+    def interval(self, previous, current, seconds):
+        """
+        Interval
+
+        :param previous: an earlier snapshot
+        :param current: a later snapshot
+        :param seconds: time between the snapshots
+        :return: a dict of the throughput and latency percentiles (in seconds) of the operations between the snapshots
+        """
+        latencies = LiveLatencyHistogram()
+        for index in range(LiveLatencyHistogram.NUM_BUCKETS):
+            count = int(current[self.BUCKETS + index] - previous[self.BUCKETS + index])
+            if count > 0:
+                latencies.counts[index] = count
+                latencies.max = latencies._bucketValue(index)
+        latencies.count = int(current[self.OPS] - previous[self.OPS])
+        latencies.total = current[self.LATENCY] - previous[self.LATENCY]
+        return {
+            "opsPerSec"     : latencies.count / seconds if seconds > 0 else 0,
+            "docsPerSec"    : (current[self.DOCS] - previous[self.DOCS]) / seconds if seconds > 0 else 0,
+            "mean"          : latencies.mean(),
+            "p50"           : latencies.percentile(50),
+            "p99"           : latencies.percentile(99),
+            "max"           : latencies.max / 1000000.0 if latencies.max is not None else 0.0
+        }
+
+class LiveCounterSlot():
+    """
+    Live Counter Slot
+
+    The slot of LiveCounters written by one worker
+    """
+    def __init__(self, counters, slot):
+        self.values         = counters.values
+        self.offset         = slot * counters.width
+        self.bucketIndex    = LiveLatencyHistogram()._bucketIndex
+    def record(self, numDocs, seconds):
+        """
+        Record
+
+        :param numDocs: documents written or read by the operation
+        :param seconds: latency of the operation
+        :return:
+        """
+        micros = max(int(seconds * 1000000), 0)
+        offset = self.offset
+        self.values[offset + LiveCounters.OPS] += 1
+        self.values[offset + LiveCounters.DOCS] += numDocs
+        self.values[offset + LiveCounters.LATENCY] += micros
+        self.values[offset + LiveCounters.BUCKETS + min(self.bucketIndex(micros), LiveLatencyHistogram.NUM_BUCKETS - 1)] += 1
+
+class NullCounterSlot():
+    """
+    Null Counter Slot
+
+    Stands in for a LiveCounterSlot when live reporting is off
+    """
+    def record(self, numDocs, seconds):
+        pass
@@ -0,0 +1,341 @@
+import json
+import re
+import statistics
+import threading
+import time
+
+import pymongo
+
+class ServerStatusSampler(threading.Thread):
+    """
+    Server Status Sampler
+
+    A background thread that polls serverStatus, and replSetGetStatus on replica sets, every
+    interval seconds while a test runs. Counters are stored as per-second rates over the interval
+    and gauges as sampled, next to client points with the throughput and latency of the test.
+    The client points are read from liveCounters, the LiveCounters of the test, one for every
+    interval in which operations completed, so even a single long trial can be correlated.
+
+    The sampler uses its own single-connection client so it neither takes connections from the
+    pool of the test nor shows up in its connection counts.
+    """
+    RATE    = "rate"
+    GAUGE   = "gauge"
+
+    SERVER_METRICS = (
+        ("insertsPerSec",       ("opcounters", "insert"),                                           RATE),
+        ("queriesPerSec",       ("opcounters", "query"),                                            RATE),
+        ("updatesPerSec",       ("opcounters", "update"),                                           RATE),
+        ("deletesPerSec",       ("opcounters", "delete"),                                           RATE),
+        ("getmoresPerSec",      ("opcounters", "getmore"),                                          RATE),
+        ("commandsPerSec",      ("opcounters", "command"),                                          RATE),
+        ("appEvictionsPerSec",  ("wiredTiger", "cache", "pages evicted by application threads"),    RATE),
+        ("cacheBytes",          ("wiredTiger", "cache", "bytes currently in the cache"),            GAUGE),
+        ("cacheDirtyBytes",     ("wiredTiger", "cache", "tracked dirty bytes in the cache"),        GAUGE),
+        ("readQueue",           ("globalLock", "currentQueue", "readers"),                          GAUGE),
+        ("writeQueue",          ("globalLock", "currentQueue", "writers"),                          GAUGE),
+        ("activeReaders",       ("globalLock", "activeClients", "readers"),                         GAUGE),
+        ("activeWriters",       ("globalLock", "activeClients", "writers"),                         GAUGE),
+        ("writeTicketsOut",     ("wiredTiger", "concurrentTransactions", "write", "out"),           GAUGE),
+        ("connections",         ("connections", "current"),                                         GAUGE),
+    )
+
+    def __init__(self, connString, interval=1.0, spikeFactor=2.0):
+        super().__init__(daemon=True)
+        self.connString     = connString
+        self.interval       = interval
+        self.spikeFactor    = spikeFactor
+        self.kinds          = dict((name, kind) for name, path, kind in self.SERVER_METRICS)
+        self.serverPoints   = []
+        self.clientPoints   = []
+        self.errors         = 0
+        self.replicaSet     = True
+        self.liveCounters   = None
+        self.liveSnapshot   = None
+        self.stopEvent      = threading.Event()
+        self.client         = pymongo.MongoClient(connString, maxPoolSize=1)
+    def _getMetric(self, status, path):
+        value = status
+        for key in path:
+            if not isinstance(value, dict) or key not in value:
+                return None
+            value = value[key]
+        return value
+    def _replicationLag(self):
+        """
+        Replication Lag
+
+        :return: the seconds the slowest secondary is behind the primary, or None on a standalone
+        """
+        if not self.replicaSet:
+            return None
+        try:
+            status = self.client.admin.command("replSetGetStatus")
+        except pymongo.errors.OperationFailure:
+            # Not a replica set member, e.g. a local standalone mongod
+            self.replicaSet = False
+            return None
+        optimes = dict((member["stateStr"], member["optimeDate"]) for member in status.get("members", []) if "optimeDate" in member)
+        secondaries = [member["optimeDate"] for member in status.get("members", []) if member.get("stateStr") == "SECONDARY" and "optimeDate" in member]
+        if "PRIMARY" not in optimes or not secondaries:
+            return None
+        return max((optimes["PRIMARY"] - secondary).total_seconds() for secondary in secondaries)
+    def sample(self):
+        """
+        Sample
+
+        :return: (sample time, dict of the raw value of every server metric)
+        """
+        status = self.client.admin.command("serverStatus")
+        values = dict((name, self._getMetric(status, path)) for name, path, kind in self.SERVER_METRICS)
+        maxCacheBytes = self._getMetric(status, ("wiredTiger", "cache", "maximum bytes configured"))
+        if maxCacheBytes:
+            values["cacheFillPct"] = values["cacheBytes"] * 100.0 / maxCacheBytes if values["cacheBytes"] is not None else None
+            values["cacheDirtyPct"] = values["cacheDirtyBytes"] * 100.0 / maxCacheBytes if values["cacheDirtyBytes"] is not None else None
+        values["replLagSeconds"] = self._replicationLag()
+        return time.time(), values
+    def run(self):
+        previous = None
+        while not self.stopEvent.is_set():
+            try:
+                sampleTime, values = self.sample()
+            except pymongo.errors.PyMongoError:
+                self.errors += 1
+                previous = None
+            else:
+                if previous is not None:
+                    self.serverPoints.append(self._delta(previous, (sampleTime, values)))
+                previous = (sampleTime, values)
+            self.recordInterval()
+            self.stopEvent.wait(self.interval)
+    def recordInterval(self):
+        """
+        Record Interval
+
+        Adds a client point for the operations the live counters saw since the previous call
+
+        :return:
+        """
+        if self.liveCounters is None:
+            return
+        now = time.time()
+        snapshot = self.liveCounters.snapshot()
+        if self.liveSnapshot is not None:
+            previousTime, previousSnapshot = self.liveSnapshot
+            interval = self.liveCounters.interval(previousSnapshot, snapshot, now - previousTime)
+            # Intervals without operations, e.g. between trials, would drag the median latency down
+            if interval["opsPerSec"] > 0:
+                self.clientPoints.append({
+                    "source"        : "client",
+                    "time"          : previousTime,
+                    "endTime"       : now,
+                    "opsPerSec"     : interval["opsPerSec"],
+                    "docsPerSec"    : interval["docsPerSec"],
+                    "meanLatency"   : interval["mean"],
+                    "p99Latency"    : interval["p99"]
+                })
+        self.liveSnapshot = (now, snapshot)
+    def _delta(self, previous, current):
+        """
+        Delta
+
+        :return: a server point with the rates of the counters between two samples and the gauges of the later one
+        """
+        elapsed = current[0] - previous[0]
+        point = {"source": "server", "time": current[0]}
+        for name, value in current[1].items():
+            if value is None:
+                continue
+            if self.kinds.get(name) == self.RATE:
+                if previous[1].get(name) is not None and elapsed > 0:
+                    point[name] = (value - previous[1][name]) / elapsed
+            else:
+                point[name] = value
+        return point
+    def stop(self):
+        """
+        Stop
+
+        Stops sampling and waits for the last sample to finish
+
+        :return:
+        """
+        self.stopEvent.set()
+        if self.is_alive():
+            self.join()
+        # The last, partial interval
+        self.recordInterval()
+        self.client.close()
+    def correlate(self):
+        """
+        Correlate
+
+        Finds the client points whose mean latency is more than spikeFactor times the median of all
+        client points, and the server metrics that stood out during them: gauges that rose above
+        spikeFactor times their median and rates that fell below their median over spikeFactor.
+
+        :return: a list of (client point, list of (metric, value in the trial, median))
+        """
+        if len(self.clientPoints) < 3 or not self.serverPoints:
+            return []
+        medianLatency = statistics.median(point["meanLatency"] for point in self.clientPoints)
+        medians = {}
+        for point in self.serverPoints:
+            for name, value in point.items():
+                if name not in ("source", "time"):
+                    medians.setdefault(name, []).append(value)
+        medians = dict((name, statistics.median(values)) for name, values in medians.items())
+
+        spikes = []
+        for clientPoint in self.clientPoints:
+            if medianLatency <= 0 or clientPoint["meanLatency"] <= self.spikeFactor * medianLatency:
+                continue
+            # A server sample covers the interval before it, so take the samples up to one interval after the trial
+            window = [point for point in self.serverPoints if clientPoint["time"] <= point["time"] <= clientPoint["endTime"] + self.interval]
+            causes = []
+            for name, median in sorted(medians.items()):
+                values = [point[name] for point in window if name in point]
+                if not values:
+                    continue
+                if self.kinds.get(name) == self.RATE:
+                    if median > 0 and min(values) < median / self.spikeFactor:
+                        causes.append((name, min(values), median))
+                elif max(values) > self.spikeFactor * median and max(values) > 0:
+                    causes.append((name, max(values), median))
+            spikes.append((clientPoint, causes))
+        return spikes
+    def report(self):
+        """
+        Report
+
+        :return: lines describing the samples and the latency spikes that line up with server metrics
+        """
+        lines = ["Server samples: {} every {}s{}{}".format(len(self.serverPoints), self.interval,
+                 ", {} failed".format(self.errors) if self.errors else "", "" if self.replicaSet else ", no replica set")]
+        if not self.clientPoints:
+            return lines
+        startTime = self.clientPoints[0]["time"]
+        for clientPoint, causes in self.correlate():
+            description = ", ".join("{} {} to {:.1f} (median {:.1f})".format(name, "fell" if self.kinds.get(name) == self.RATE else "rose", value, median)
+                                    for name, value, median in causes)
+            lines.append("Latency spike at +{:.1f}s: mean {:.3f} ms{}".format(clientPoint["time"] - startTime, clientPoint["meanLatency"] * 1000,
+                         ", server: " + description if causes else ", no server metric stood out"))
+        return lines
+    def save(self, path, testName):
+        """
+        Save
+
+        Writes the server and client points, ordered by time, as JSON lines
+
+        :param path:
+        :param testName:
+        :return:
+        """
+        with open(path, "w") as f:
+            f.write(json.dumps({"source": "header", "testName": testName, "target": redactConnString(self.connString), "interval": self.interval}) + "\n")
+            for point in sorted(self.serverPoints + self.clientPoints, key=lambda point: point["time"]):
+                f.write(json.dumps(point) + "\n")
+
+class NetworkBytesMeter():
+    """
+    Network Bytes Meter
+
+    Counts the bytes the server received and sent between start and stop from the network section
+    of serverStatus, on a single-connection client of its own. These are the bytes on the wire,
+    after compression, where the server reports them (physicalBytesIn/Out) and the logical bytes
+    otherwise. The counters are server wide, so they include any other client of the server and,
+    on a replica set primary, the oplog sent to the secondaries.
+    """
+    def __init__(self, connString):
+        self.client     = pymongo.MongoClient(connString, maxPoolSize=1)
+        self.startBytes = None
+    def read(self):
+        """
+        Read
+
+        :return: (bytes received, bytes sent) by the server since it started
+        """
+        network = self.client.admin.command("serverStatus").get("network", {})
+        return (network.get("physicalBytesIn", network.get("bytesIn", 0)),
+                network.get("physicalBytesOut", network.get("bytesOut", 0)))
+    def start(self):
+        self.startBytes = self.read()
+    def stop(self):
+        """
+        Stop
+
+        :return: (bytes received, bytes sent) by the server since start
+        """
+        bytesIn, bytesOut = self.read()
+        return bytesIn - self.startBytes[0], bytesOut - self.startBytes[1]
+    def close(self):
+        self.client.close()
+
+def redactConnString(connString):
+    """
+    Redact Conn String
+
+    :param connString:
+    :return: connString without the password
+    """
+    return re.sub(r"//([^:/@]+):[^@]*@", r"//\1:***@", connString)
+
+class LiveReporter(threading.Thread):
+    """
+    Live Reporter
+
+    A background thread that reads the LiveCounters of a running test every interval seconds and
+    prints the throughput and latency of the interval, and appends it as a JSON line to
+    outputFile if one is given
+    """
+    def __init__(self, counters, testName, interval=1.0, outputFile=None, target=None):
+        super().__init__(daemon=True)
+        self.counters   = counters
+        self.testName   = testName
+        self.interval   = interval
+        self.outputFile = outputFile
+        self.target     = redactConnString(target) if target is not None else None
+        self.stopEvent  = threading.Event()
+    def run(self):
+        startTime = previousTime = time.time()
+        previous = self.counters.snapshot()
+        output = open(self.outputFile, "a") if self.outputFile is not None else None
+        try:
+            while True:
+                stopping = self.stopEvent.wait(self.interval)
+                now = time.time()
+                current = self.counters.snapshot()
+                self.report(now - startTime, self.counters.interval(previous, current, now - previousTime), output)
+                previous, previousTime = current, now
+                if stopping:
+                    break
+        finally:
+            if output is not None:
+                output.close()
+    def report(self, elapsed, interval, output):
+        """
+        Report
+
+        :param elapsed: seconds since the reporter started
+        :param interval: the interval dict of LiveCounters
+        :param output: open file for the JSON lines, or None
+        :return:
+        """
+        print("[{} {:>7.1f}s] {:>10.1f} ops/s {:>12.1f} docs/s  latency (ms): mean={:.3f} p50={:.3f} p99={:.3f} max={:.3f}".format(
+            self.testName, elapsed, interval["opsPerSec"], interval["docsPerSec"],
+            interval["mean"] * 1000, interval["p50"] * 1000, interval["p99"] * 1000, interval["max"] * 1000))
+        if output is not None:
+            point = dict(interval, testName=self.testName, target=self.target, time=time.time(), elapsed=elapsed)
+            output.write(json.dumps(point) + "\n")
+            output.flush()
+    def stop(self):
+        """
+        Stop
+
+        Reports the last, partial interval and waits for the reporter to finish
+
+        :return:
+        """
+        self.stopEvent.set()
+        if self.is_alive():
+            self.join()
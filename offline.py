@@ -0,0 +1,210 @@
+import hashlib
+import json
+import sys
+import time
+import tracemalloc
+
+import bson
+from bson.raw_bson import RawBSONDocument
+from pymongo import InsertOne
+
+from metrics import RunningStats
+
+class FakeBulkWriteSink():
+    """
+    Fake Bulk Write Sink
+
+    Stands in for a collection without a server. bulk_write encodes the requests into the body of
+    an insert command the way the driver does before sending it, then discards the message.
+    """
+    def __init__(self, collName="offline", dbName="perftest"):
+        self.header     = bson.encode({"insert": collName, "$db": dbName, "ordered": False})
+        self.numDocs    = 0
+        self.numBytes   = 0
+    def bulk_write(self, requests, ordered=False):
+        """
+        Bulk Write
+
+        :param requests: InsertOne requests
+        :param ordered:
+        :return: the number of bytes of the encoded message
+        """
+        message = bytearray(self.header)
+        for request in requests:
+            doc = request._doc
+            message += doc.raw if isinstance(doc, RawBSONDocument) else bson.encode(doc)
+        self.numDocs += len(requests)
+        self.numBytes += len(message)
+        return len(message)
+
+class ClientOverheadBenchmark():
+    """
+    Client Overhead Benchmark
+
+    Measures the client side cost of a bulk insert without a server. Every trial runs numDocs
+    documents of a DocumentProvider, batchSize at a time, through the stages
+
+        generate:   DocumentProvider.createDocuments
+        encode:     bson.encode of every document (free for RawBSONDocuments)
+        build:      an InsertOne request per document
+        sink:       FakeBulkWriteSink.bulk_write, i.e. encoding and framing as the driver does
+
+    Each stage is timed on its own. One extra trial runs under tracemalloc to count the bytes and
+    memory blocks every stage allocates per document: the peak of the memory allocated while the
+    stage runs, and the blocks still allocated when it returns. It is not part of the timings.
+    """
+    STAGES      = ("generate", "encode", "build")
+    SINK_STAGE  = "sink"
+
+    def __init__(self, documentProvider, numDocs, batchSize, numTrials, useSink=False):
+        self.documentProvider   = documentProvider
+        self.numDocs            = numDocs
+        self.batchSize          = batchSize
+        self.numTrials          = numTrials
+        self.stages             = self.STAGES + ((self.SINK_STAGE,) if useSink else ())
+        self.docsPerSec         = dict((stage, RunningStats()) for stage in self.stages)
+        self.bytesPerSec        = dict((stage, RunningStats()) for stage in self.stages)
+        self.allocBytes         = dict((stage, 0) for stage in self.stages)
+        self.allocBlocks        = dict((stage, 0) for stage in self.stages)
+        self.numBytes           = 0
+        self.digest             = None
+    def _encode(self, doc):
+        return doc.raw if isinstance(doc, RawBSONDocument) else bson.encode(doc)
+    def runTrial(self, traceAllocations=False):
+        """
+        Run Trial
+
+        :param traceAllocations: count the allocations of every stage instead of timing it
+        :return: the run time in seconds of every stage, and the encoded bytes of the documents
+        """
+        runTime = dict((stage, 0.0) for stage in self.stages)
+        numBytes = 0
+        digest = hashlib.sha1()
+        sink = FakeBulkWriteSink()
+        for start in range(0, self.numDocs, self.batchSize):
+            count = min(self.batchSize, self.numDocs - start)
+            outputs = {}
+            for stage in self.stages:
+                if traceAllocations:
+                    tracemalloc.reset_peak()
+                    memoryBefore = tracemalloc.get_traced_memory()[0]
+                    blocksBefore = sys.getallocatedblocks()
+                stageStart = time.perf_counter()
+                if stage == "generate":
+                    outputs[stage] = self.documentProvider.createDocuments("thread0", start, count)
+                elif stage == "encode":
+                    outputs[stage] = [self._encode(doc) for doc in outputs["generate"]]
+                elif stage == "build":
+                    outputs[stage] = [InsertOne(doc) for doc in outputs["generate"]]
+                else:
+                    outputs[stage] = sink.bulk_write(outputs["build"], ordered=False)
+                runTime[stage] += time.perf_counter() - stageStart
+                if traceAllocations:
+                    self.allocBytes[stage] += tracemalloc.get_traced_memory()[1] - memoryBefore
+                    self.allocBlocks[stage] += sys.getallocatedblocks() - blocksBefore
+            for encoded in outputs["encode"]:
+                numBytes += len(encoded)
+                digest.update(encoded)
+        self.digest = digest.hexdigest()
+        return runTime, numBytes
+    def run(self):
+        """
+        Run
+
+        :return:
+        """
+        for trialNum in range(self.numTrials):
+            runTime, self.numBytes = self.runTrial()
+            for stage in self.stages:
+                self.docsPerSec[stage].record(self.numDocs / runTime[stage])
+                self.bytesPerSec[stage].record(self.numBytes / runTime[stage])
+        tracemalloc.start()
+        try:
+            self.runTrial(traceAllocations=True)
+        finally:
+            tracemalloc.stop()
+    def summary(self):
+        """
+        Summary
+
+        :return: a dict of the digest of the encoded documents and of docs/s, MB/s and allocations per document of every stage
+        """
+        return {
+            "digest":   self.digest,
+            "bytesPerDoc": self.numBytes / self.numDocs,
+            "stages":   dict((stage, {
+                "docsPerSec":       self.docsPerSec[stage].mean,
+                "mbPerSec":         self.bytesPerSec[stage].mean / 1000000,
+                "allocBytesPerDoc": self.allocBytes[stage] / self.numDocs,
+                "allocBlocksPerDoc":self.allocBlocks[stage] / self.numDocs,
+            }) for stage in self.stages),
+        }
+    def printSummary(self):
+        summary = self.summary()
+        print("{:<10} {:>14} {:>10} {:>14} {:>14}".format("stage", "docs/s", "MB/s", "alloc B/doc", "blocks/doc"))
+        for stage in self.stages:
+            result = summary["stages"][stage]
+            print("{:<10} {:>14.1f} {:>10.1f} {:>14.1f} {:>14.2f}".format(stage, result["docsPerSec"], result["mbPerSec"], result["allocBytesPerDoc"], result["allocBlocksPerDoc"]))
+        print("{:.1f} bytes/doc, digest {}".format(summary["bytesPerDoc"], summary["digest"]))
+
+def compareToBaseline(results, baseline, tolerance):
+    """
+    Compare To Baseline
+
+    Regression check of the document generators: a provider regresses if it renders different
+    documents than the baseline, or if a stage is more than tolerance slower than the baseline
+
+    :param results: dict of provider name to ClientOverheadBenchmark summary
+    :param baseline: the same, as saved by an earlier run
+    :param tolerance: the allowed relative drop in docs/s
+    :return: a list of regression descriptions, empty if none
+    """
+    regressions = []
+    for providerName, summary in results.items():
+        if providerName not in baseline:
+            continue
+        expected = baseline[providerName]
+        if summary["digest"] != expected["digest"]:
+            regressions.append("{}: documents differ from the baseline (digest {} != {})".format(providerName, summary["digest"], expected["digest"]))
+        for stage, result in summary["stages"].items():
+            if stage not in expected["stages"]:
+                continue
+            expectedDocsPerSec = expected["stages"][stage]["docsPerSec"]
+            if result["docsPerSec"] < expectedDocsPerSec * (1 - tolerance):
+                regressions.append("{} {}: {:.1f} docs/s is {:.1f}% below the baseline of {:.1f} docs/s".format(
+                    providerName, stage, result["docsPerSec"], (1 - result["docsPerSec"] / expectedDocsPerSec) * 100, expectedDocsPerSec))
+    return regressions
+
+def runOfflineBenchmark(documentProviders, numDocs, batchSize, numTrials, useSink=False, outputFile=None, baselineFile=None, tolerance=0.1):
+    """
+    Run Offline Benchmark
+
+    Runs the ClientOverheadBenchmark for every document provider, optionally saving the results
+    to outputFile and checking them against the results in baselineFile
+
+    :return: 1 if a provider regressed against the baseline, else 0
+    """
+    results = {}
+    for documentProvider in documentProviders:
+        providerName = documentProvider.__class__.__name__
+        print("------------Client Overhead of {} ({} docs x {} trials)------------".format(providerName, numDocs, numTrials))
+        benchmark = ClientOverheadBenchmark(documentProvider, numDocs, batchSize, numTrials, useSink)
+        benchmark.run()
+        benchmark.printSummary()
+        results[providerName] = benchmark.summary()
+        print("\n")
+
+    if outputFile is not None:
+        with open(outputFile, "w") as f:
+            json.dump(results, f, indent=2, sort_keys=True)
+
+    if baselineFile is not None:
+        with open(baselineFile) as f:
+            baseline = json.load(f)
+        regressions = compareToBaseline(results, baseline, tolerance)
+        for regression in regressions:
+            print("REGRESSION " + regression)
+        if regressions:
+            return 1
+        print("No regressions against {}".format(baselineFile))
+    return 0
@@ -0,0 +1,195 @@
+import json
+import os
+import platform
+import socket
+import time
+
+import pymongo
+from scipy import stats
+
+from monitor import redactConnString
+
+class ResultsStore():
+    """
+    Results Store
+
+    An append-only file of JSON lines with one record per test of a run. Every record holds the
+    run id, the configuration of the run and the test, and the summary of the test including its
+    raw metrics, so runs can be compared long after their output scrolled by.
+    """
+    def __init__(self, path):
+        self.path = path
+    def append(self, records):
+        """
+        Append
+
+        :param records:
+        :return:
+        """
+        with open(self.path, "a") as f:
+            for record in records:
+                f.write(json.dumps(record, sort_keys=True) + "\n")
+    def load(self):
+        """
+        Load
+
+        :return: all records, oldest first
+        """
+        if not os.path.exists(self.path):
+            return []
+        with open(self.path) as f:
+            return [json.loads(line) for line in f if line.strip()]
+    def runIds(self):
+        """
+        Run Ids
+
+        :return: the ids of all stored runs, oldest first
+        """
+        runIds = []
+        for record in self.load():
+            if record["runId"] not in runIds:
+                runIds.append(record["runId"])
+        return runIds
+    def getRun(self, runId):
+        """
+        Get Run
+
+        :param runId: a stored run id, "latest" for the last run or "previous" for the one before it
+        :return: the records of the run
+        """
+        runIds = self.runIds()
+        if runId in ("latest", "previous"):
+            index = -1 if runId == "latest" else -2
+            if len(runIds) < -index:
+                raise ValueError("{} holds {} runs, there is no {} run".format(self.path, len(runIds), runId))
+            runId = runIds[index]
+        records = [record for record in self.load() if record["runId"] == runId]
+        if not records:
+            raise ValueError("Run {} not found in {}".format(runId, self.path))
+        return records
+
+def newRunId():
+    return "{}-{}".format(time.strftime("%Y%m%d-%H%M%S"), os.getpid())
+
+def runConfig(args):
+    """
+    Run Config
+
+    :param args: the parsed command line arguments of runtest.py
+    :return: the configuration shared by all tests of a run
+    """
+    return {
+        "numRuns"           : int(args.numRuns),
+        "numDocs"           : int(args.numDocs),
+        "numThreads"        : int(args.numThreads),
+        "batchSize"         : int(args.batchSize),
+        "maxBatchBytes"     : int(args.maxBatchBytes) if args.maxBatchBytes is not None else None,
+        "executor"          : args.executor,
+        "threadsPerProcess" : int(args.threadsPerProcess),
+        "asyncMode"         : args.asyncMode,
+        "concurrency"       : int(args.concurrency),
+        "maxPoolSize"       : int(args.maxPoolSize),
+        "rawBson"           : not args.disableRawBson,
+        "datasetDir"        : args.datasetDir,
+        "driverVersion"     : pymongo.version,
+        "pythonVersion"     : platform.python_version(),
+        "clientHost"        : socket.gethostname()
+    }
+
+def runRecords(runId, config, connString, results):
+    """
+    Run Records
+
+    :param runId:
+    :param config: the runConfig of the run
+    :param connString:
+    :param results: the (document provider name, test name, summary) list of runTestPlan
+    :return: a record per test
+    """
+    return [{
+        "runId"     : runId,
+        "time"      : time.time(),
+        "config"    : config,
+        "target"    : redactConnString(connString),
+        "provider"  : providerName,
+        "test"      : testName,
+        "summary"   : summary
+    } for providerName, testName, summary in results]
+
+def _welch(baseline, candidate, alternative):
+    """
+    Welch
+
+    One-sided Welch's t-test of the means of two RunningStats dicts
+
+    :param alternative: "less" if a regression lowers the candidate mean, "greater" if it raises it
+    :return: the p-value, or None with fewer than 2 values on either side
+    """
+    if baseline["count"] < 2 or candidate["count"] < 2:
+        return None
+    if baseline["variance"] == 0 and candidate["variance"] == 0:
+        # Identical values on both sides: the difference is either certain or absent
+        worse = candidate["mean"] < baseline["mean"] if alternative == "less" else candidate["mean"] > baseline["mean"]
+        return 0.0 if worse else 1.0
+    statistic, pValue = stats.ttest_ind_from_stats(candidate["mean"], candidate["variance"] ** 0.5, candidate["count"],
+                                                   baseline["mean"], baseline["variance"] ** 0.5, baseline["count"], equal_var=False)
+    # ttest_ind_from_stats is two-sided, halve it for the side of the regression
+    worse = statistic < 0 if alternative == "less" else statistic > 0
+    return pValue / 2 if worse else 1 - pValue / 2
+
+def compareRuns(baselineRecords, candidateRecords, alpha=0.05, minEffect=0.05):
+    """
+    Compare Runs
+
+    Compares the tests two runs have in common. A test regresses if its per-trial docs/s is lower,
+    or its per-trial mean latency higher, than in the baseline by more than minEffect relative to
+    the baseline, and Welch's t-test over the trials finds the difference significant at alpha.
+    Tests with fewer than 2 trials on either side are judged on minEffect alone. Tests are matched
+    by document provider and test name, and by target too unless both runs used a single target.
+
+    :param baselineRecords:
+    :param candidateRecords:
+    :param alpha: significance level of the tests
+    :param minEffect: smallest relative change that counts as a regression
+    :return: a list of (key, metric, baseline mean, candidate mean, relative change, p-value, regressed)
+    """
+    singleTarget = len(set(record["target"] for record in baselineRecords)) == 1 and len(set(record["target"] for record in candidateRecords)) == 1
+    def key(record):
+        return (record["provider"], record["test"]) if singleTarget else (record["target"], record["provider"], record["test"])
+    baseline = dict((key(record), record) for record in baselineRecords)
+
+    comparisons = []
+    for record in candidateRecords:
+        if key(record) not in baseline:
+            continue
+        for metric, alternative in (("trialDocsPerSec", "less"), ("trialLatency", "greater")):
+            expected = baseline[key(record)]["summary"][metric]
+            actual = record["summary"][metric]
+            if expected["count"] == 0 or actual["count"] == 0 or expected["mean"] == 0:
+                continue
+            change = (actual["mean"] - expected["mean"]) / expected["mean"]
+            pValue = _welch(expected, actual, alternative)
+            worse = change < -minEffect if alternative == "less" else change > minEffect
+            regressed = worse and (pValue is None or pValue < alpha)
+            comparisons.append((key(record), metric, expected["mean"], actual["mean"], change, pValue, regressed))
+    return comparisons
+
+# Label and display scale of the metrics compared by compareRuns
+COMPARISON_METRICS = {
+    "trialDocsPerSec"   : ("docs/s", 1),
+    "trialLatency"      : ("mean latency ms", 1000)
+}
+
+def printComparison(comparisons):
+    """
+    Print Comparison
+
+    :param comparisons: the list of compareRuns
+    :return: the number of regressions
+    """
+    print("{:<60} {:<16} {:>14} {:>14} {:>9} {:>9}".format("test", "metric", "baseline", "candidate", "change", "p-value"))
+    for key, metric, expected, actual, change, pValue, regressed in comparisons:
+        label, scale = COMPARISON_METRICS[metric]
+        print("{:<60} {:<16} {:>14.3f} {:>14.3f} {:>8.1f}% {:>9} {}".format(
+            " / ".join(key), label, expected * scale, actual * scale, change * 100, "{:.4f}".format(pValue) if pValue is not None else "-", "REGRESSION" if regressed else ""))
+    return sum(1 for comparison in comparisons if comparison[-1])
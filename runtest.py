@@ -1,10 +1,25 @@
 import argparse
+import contextlib
+import io
 import logging
+import multiprocessing
+import queue
+import sys
+import traceback
 import threading
 import concurrent.futures
+import itertools
 
-from util import StringValueDocumentProvider, IntegerValueDocumentProvider, NestedDocumentProvider, kb50DocumentProvider, mb1DocumentProvider
-from tests import PerfTest, BulkInsertTest, SingleInsertTest, EqualityQueryTest, RangedQueryTest
+import pymongo
+
+from util import StringValueDocumentProvider, IntegerValueDocumentProvider, NestedDocumentProvider, kb50DocumentProvider, mb1DocumentProvider, clientRegistry, withUriOption, compressorAvailable
+from dataset import prepareDataset
+from offline import runOfflineBenchmark
+from monitor import ServerStatusSampler, NetworkBytesMeter, redactConnString
+from sweep import ParameterSweep, docLatency
+from results import ResultsStore, newRunId, runConfig, runRecords, compareRuns, printComparison
+from metrics import ConvergenceDetector
+from tests import PerfTest, PooledPerfTest, BulkInsertTest, SingleInsertTest, EqualityQueryTest, RangedQueryTest, RangeScanTest, IndexBuildTest, OpenLoopTest, OpenLoopTestTrial, MixedWorkloadTest, AsyncBulkInsertTest, AsyncQueryTest, BulkWriteTest, BulkWriteTestTrial
 
 
 # Default constant variables
@@ -14,6 +29,38 @@ NUM_THREADS_DEFAULT         = 1
 BATCH_SIZE_DEFAULT          = 1000
 DB_NAME_DEFAULT             = "perftest"
 DOCUMENT_PROVIDER_DEFAULT   = "StringValueDocumentProvider"
+MAX_POOL_SIZE_DEFAULT       = 100
+OPEN_LOOP_OP_DEFAULT        = "insert"
+OPEN_LOOP_DURATION_DEFAULT  = 10
+OPEN_LOOP_RUNS_DEFAULT      = 1
+SUSTAINABLE_RATIO           = 0.95
+TARGET_REL_ERROR_DEFAULT    = 0.02
+CONFIDENCE_DEFAULT          = 0.95
+CONCURRENCY_DEFAULT         = 10
+EXECUTOR_DEFAULT            = "processes"
+THREADS_PER_PROCESS_DEFAULT = 1
+WARMUP_TRIALS_DEFAULT       = 5
+TIME_BUDGET_DEFAULT         = 3600
+OFFLINE_TRIALS_DEFAULT      = 5
+PROFILE_TRIAL_DEFAULT       = 1
+PROFILE_DIR_DEFAULT         = "profiles"
+SPIKE_FACTOR_DEFAULT        = 2.0
+RESULTS_FILE_DEFAULT        = "results.jsonl"
+ALPHA_DEFAULT               = 0.05
+MIN_EFFECT_DEFAULT          = 0.05
+SWEEP_BATCH_SIZES_DEFAULT   = "100,1000,10000"
+SWEEP_WRITE_CONCERNS_DEFAULT= "1"
+SWEEP_RUNS_DEFAULT          = 3
+PLATEAU_GAIN_DEFAULT        = 0.05
+KNEE_FACTOR_DEFAULT         = 1.5
+SCAN_BATCH_SIZES_DEFAULT    = "0"
+SCAN_PROJECTIONS_DEFAULT    = "full"
+SCAN_LIMITS_DEFAULT         = "0"
+MATRIX_COMPRESSORS_DEFAULT  = "none,zlib,snappy,zstd"
+MATRIX_WRITE_CONCERNS_DEFAULT= "1,majority,1:j"
+OFFLINE_TOLERANCE_DEFAULT   = 0.1
+MAX_RETRIES_DEFAULT         = 3
+RESULT_POLL_INTERVAL        = 1.0
 
 
 # Other global variables
@@ -23,6 +70,39 @@ scriptName                  = "runtest.py"
 # Misc Methods
 ########################################################################################################################
 
+def runOpenLoopSweep(connString, dbName, numRuns, numThreads, targetRates, duration, operation, documentProvider, args):
+    """
+    Run Open Loop Sweep
+
+    Runs an OpenLoopTest for each target rate and prints the achieved throughput and latency
+    percentiles of every rate. A rate counts as sustainable if the server achieved at least
+    SUSTAINABLE_RATIO of it.
+
+    :return: a list of (target rate, OpenLoopTest)
+    """
+    results = []
+    for targetOpsPerSec in targetRates:
+        print("------------Running Open Loop {} Test at {} ops/s on {} Threads------------".format(operation, targetOpsPerSec, numThreads))
+        openLoopTest = OpenLoopTest(connString, dbName, numRuns, numThreads, targetOpsPerSec, duration, operation, documentProvider)
+        runTest(openLoopTest, args)
+        results.append((targetOpsPerSec, openLoopTest))
+        print("\n")
+
+    print("------------Open Loop Sweep Results------------")
+    print("{:>12} {:>12} {:>10} {:>10} {:>10} {:>10}  {}".format("target/s", "achieved/s", "p50 ms", "p99 ms", "p99.9 ms", "max ms", "sustainable"))
+    sustainableRate = None
+    for targetOpsPerSec, openLoopTest in results:
+        achievedOpsPerSec = openLoopTest.achievedOpsPerSec()
+        latencies = openLoopTest.latencies
+        sustainable = achievedOpsPerSec >= SUSTAINABLE_RATIO * targetOpsPerSec
+        if sustainable:
+            sustainableRate = targetOpsPerSec
+        print("{:>12.1f} {:>12.1f} {:>10.3f} {:>10.3f} {:>10.3f} {:>10.3f}  {}".format(
+            targetOpsPerSec, achievedOpsPerSec, latencies.percentile(50) * 1000, latencies.percentile(99) * 1000,
+            latencies.percentile(99.9) * 1000, latencies.percentile(100) * 1000, "yes" if sustainable else "no"))
+    print("Highest sustainable rate: {}\n".format("{} ops/s".format(sustainableRate) if sustainableRate is not None else "none"))
+    return results
+
 
 
 ########################################################################################################################
@@ -78,9 +158,555 @@ def _configureLogger(logLevel):
 #     }
 
 
-def runTest(perfTest):
+def bulkInsertWorkerCounts(args):
+    """
+    Bulk Insert Worker Counts
+
+    :return: the set of worker counts the bulk insert tests of a run with args may use, from
+             --cumulThreads, --sweep and --layoutSweep as well as numThreads
+    """
+    numThreads = int(args.numThreads)
+    workerCounts = set([numThreads])
+    if args.cumulThreads or args.sweep:
+        threads = 1
+        while threads <= numThreads:
+            workerCounts.add(threads)
+            threads = threads*2
+    if args.layoutSweep:
+        processes = 1
+        while processes <= numThreads:
+            threadsPerProcess = 1
+            while threadsPerProcess <= int(args.threadsPerProcess):
+                workerCounts.add(processes * threadsPerProcess)
+                threadsPerProcess = threadsPerProcess*2
+            processes = processes*2
+    return workerCounts
+
+def prepareDatasets(documentProviders, args):
+    """
+    Prepare Datasets
+
+    Renders the documents every bulk insert worker will need into args.datasetDir. The worker
+    threadN gets the most documents it inserts with any worker count of bulkInsertWorkerCounts()
+    that includes it, so the run must use the same flags as the preparation.
+    """
+    numDocs     = int(args.numDocs)
+    workerCounts = bulkInsertWorkerCounts(args)
+    for documentProvider in documentProviders:
+        print("Preparing dataset for {} in {}".format(documentProvider.__class__.__name__, args.datasetDir))
+        for i in range(max(workerCounts)):
+            numDocsPerWorker = max(int(numDocs / workers) for workers in workerCounts if workers > i)
+            prepareDataset(args.datasetDir, documentProvider, ["thread" + str(i)], numDocsPerWorker)
+
+def getThreadsPerProcess(args, numThreads):
+    """
+    Get Threads Per Process
+
+    :return: the number of worker threads per process of the --executor layout for numThreads workers
+    """
+    if args.executor == "threads":
+        return numThreads
+    if args.executor == "hybrid":
+        return min(int(args.threadsPerProcess), numThreads)
+    return 1
+
+def runTest(perfTest, args, threadsPerProcess=None):
+    """
+    Run Test
+
+    Runs a PerfTest, stopping adaptively once its results converge if --adaptive is set. Pooled
+    tests run their workers in the --executor layout unless threadsPerProcess is given.
+    """
+    if isinstance(perfTest, PooledPerfTest):
+        perfTest.threadsPerProcess = threadsPerProcess or getThreadsPerProcess(args, perfTest.numThreads)
+    if args.adaptive:
+        perfTest.convergence = ConvergenceDetector(
+            targetRelativeError=float(args.targetRelError),
+            confidence=float(args.confidence),
+            warmupTrials=int(args.warmupTrials),
+            timeBudget=float(args.timeBudget))
+    if args.profile is not None:
+        perfTest.profile = args.profile
+        perfTest.profileTrial = int(args.profileTrial)
+        perfTest.profileDir = args.profileDir
+    if args.serverStatusInterval is not None:
+        perfTest.serverSampler = ServerStatusSampler(perfTest.connString, float(args.serverStatusInterval), float(args.spikeFactor))
+        perfTest.serverSamplesDir = args.serverSamplesDir
+    if args.liveInterval is not None:
+        perfTest.liveInterval = float(args.liveInterval)
+        perfTest.liveFile = args.liveFile
     perfTest.runTest()
 
+def createBulkInsertTest(connString, args, numThreads, numDocsPerThread, documentProvider, numRuns=None, batchSize=None, writeConcern=None, indexes=None):
+    """
+    Create Bulk Insert Test
+
+    :return: an AsyncBulkInsertTest with --async and a BulkInsertTest otherwise, with the numRuns
+             and batchSize of the command line unless they are given
+    """
+    numRuns             = numRuns or int(args.numRuns)
+    batchSize           = batchSize or int(args.batchSize)
+    maxBatchBytes       = int(args.maxBatchBytes) if args.maxBatchBytes else None
+    if args.asyncMode:
+        return AsyncBulkInsertTest(connString, args.dbName, numRuns, numThreads, numDocsPerThread, batchSize, documentProvider, int(args.concurrency), args.datasetDir, maxBatchBytes, writeConcern, int(args.maxRetries), indexes)
+    return BulkInsertTest(connString, args.dbName, numRuns, numThreads, numDocsPerThread, batchSize, documentProvider, args.datasetDir, maxBatchBytes, writeConcern, int(args.maxRetries), indexes)
+
+def parseWriteConcern(value):
+    """
+    Parse Write Concern
+
+    :param value: a w value such as 0, 1 or majority, followed by :j for journaled writes
+    :return: the WriteConcern arguments
+    """
+    w, journal = (value.split(":", 1) + [""])[:2]
+    writeConcern = {"w": int(w) if w.isdigit() else w}
+    if journal == "j":
+        writeConcern["j"] = True
+    return writeConcern
+
+def parseMix(value):
+    """
+    Parse Mix
+
+    :param value: colon delimitted insert:eqQuery:rangeQuery weights, trailing ones may be left out
+    :return: the three weights, with 0 for those left out
+    """
+    weights = [float(weight) for weight in value.split(":")]
+    if len(weights) > len(OpenLoopTestTrial.OPERATIONS):
+        raise ValueError("--mix {} has {} weights, expected at most {} (insert:eqQuery:rangeQuery)".format(value, len(weights), len(OpenLoopTestTrial.OPERATIONS)))
+    if min(weights) < 0 or sum(weights) <= 0:
+        raise ValueError("--mix {} needs non-negative weights with a positive sum".format(value))
+    return weights + [0.0] * (len(OpenLoopTestTrial.OPERATIONS) - len(weights))
+
+def runParameterSweep(connString, args, documentProvider):
+    """
+    Run Parameter Sweep
+
+    Runs a ParameterSweep of the bulk insert test over worker counts in powers of 2 up to
+    numThreads and the --sweepBatchSizes, once for every --sweepWriteConcerns. The total number
+    of documents of a trial stays numDocs whatever the worker count.
+
+    :return: a list of (test name, PerfTest.summary) for every point
+    """
+    numDocs = int(args.numDocs)
+    threadCounts = []
+    threads = 1
+    while threads < int(args.numThreads):
+        threadCounts.append(threads)
+        threads = threads*2
+    threadCounts.append(int(args.numThreads))
+    batchSizes = [int(batchSize) for batchSize in args.sweepBatchSizes.split(",")]
+    maxP99 = float(args.sweepMaxP99) / 1000 if args.sweepMaxP99 is not None else None
+
+    results = []
+    for writeConcernStr in args.sweepWriteConcerns.split(","):
+        writeConcern = parseWriteConcern(writeConcernStr)
+
+        def runPoint(numThreads, batchSize):
+            print("------------Running Bulk Insert Test on {} Threads, batch size {}, w={}------------".format(numThreads, batchSize, writeConcernStr))
+            bulkInsertTest = createBulkInsertTest(connString, args, numThreads, int(numDocs / numThreads), documentProvider, int(args.sweepRuns), batchSize, writeConcern)
+            runTest(bulkInsertTest, args)
+            print("\n")
+            return bulkInsertTest.summary()
+        sweep = ParameterSweep(runPoint, threadCounts, batchSizes, float(args.plateauGain), float(args.kneeFactor), maxP99)
+        sweep.run()
+
+        print("------------Sweep Results for {} (w={})------------".format(documentProvider.__class__.__name__, writeConcernStr))
+        print("{:>8} {:>8} {:>14} {:>9} {:>9} {:>12}  {}".format("threads", "batch", "docs/s", "p50 ms", "p99 ms", "p99 ms/doc", "stopped"))
+        for numThreads, batchSize, summary, stop in sweep.points:
+            print("{:>8} {:>8} {:>14.1f} {:>9.3f} {:>9.3f} {:>12.5f}  {}".format(numThreads, batchSize, summary["docsPerSec"], summary["p50"] * 1000, summary["p99"] * 1000,
+                  docLatency((numThreads, batchSize, summary)) * 1000, stop or ""))
+            results.append(("BulkInsert x{} b{} w={}".format(numThreads, batchSize, writeConcernStr), summary))
+        print("Scaling curve: " + ", ".join("{} threads {:.1f} docs/s (batch {})".format(numThreads, summary["docsPerSec"], batchSize) for numThreads, batchSize, summary in sweep.curve))
+        if sweep.threadStop is not None:
+            print("Stopped adding workers at {} threads: {}".format(sweep.curve[-1][0], sweep.threadStop))
+        best = sweep.best()
+        if best is None:
+            print("No configuration within a p99 of {} ms per document\n".format(args.sweepMaxP99))
+        else:
+            print("Best configuration: {} threads, batch size {}, w={}: {:.1f} docs/s, p99 {:.3f} ms ({:.5f} ms/doc)\n".format(best[0], best[1], writeConcernStr, best[2]["docsPerSec"], best[2]["p99"] * 1000, docLatency(best) * 1000))
+    return results
+
+def runLayoutSweep(connString, args, documentProvider):
+    """
+    Run Layout Sweep
+
+    Runs the bulk insert test for every layout of 1 to numThreads processes times 1 to
+    threadsPerProcess threads, both in powers of 2, and prints the docs/s of each layout
+
+    :return: a list of (processes, threads per process, BulkInsertTest)
+    """
+    numDocs = int(args.numDocs)
+    results = []
+    processes = 1
+    while processes <= int(args.numThreads):
+        threadsPerProcess = 1
+        while threadsPerProcess <= int(args.threadsPerProcess):
+            workers = processes * threadsPerProcess
+            print("------------Running Bulk Insert Test on {} Processes x {} Threads------------".format(processes, threadsPerProcess))
+            bulkInsertTest = createBulkInsertTest(connString, args, workers, int(numDocs / workers), documentProvider)
+            runTest(bulkInsertTest, args, threadsPerProcess)
+            results.append((processes, threadsPerProcess, bulkInsertTest))
+            print("\n")
+            threadsPerProcess = threadsPerProcess*2
+        processes = processes*2
+
+    print("------------Layout Sweep Results (docs/s)------------")
+    threadCounts = sorted(set(threadsPerProcess for processes, threadsPerProcess, bulkInsertTest in results))
+    print("{:>10} ".format("procs") + " ".join("{:>14}".format("{} threads".format(t)) for t in threadCounts))
+    for processes in sorted(set(processes for processes, threadsPerProcess, bulkInsertTest in results)):
+        row = dict((t, test) for p, t, test in results if p == processes)
+        print("{:>10} ".format(processes) + " ".join("{:>14.1f}".format(row[t].summary()["docsPerSec"]) for t in threadCounts))
+    best = max(results, key=lambda result: result[2].summary()["docsPerSec"])
+    print("Peak throughput: {:.1f} docs/s with {} processes x {} threads\n".format(best[2].summary()["docsPerSec"], best[0], best[1]))
+    return results
+
+def runRangeScanSweep(connString, args, documentProvider):
+    """
+    Run Range Scan Sweep
+
+    Runs the range scan test for every combination of selectivity, cursor batch size, projection
+    and limit, over the numDocs / numThreads nums of every worker of the bulk insert test, and
+    prints the docs/s and MB/s of each
+
+    :return: a list of (test name, RangeScanTest)
+    """
+    valueRange = int(int(args.numDocs) / int(args.numThreads))
+    results = []
+    for selectivity, batchSize, projection, limit in itertools.product(
+            [float(value) for value in args.scanSelectivity.split(",")], [int(value) for value in args.scanBatchSizes.split(",")],
+            args.scanProjections.split(","), [int(value) for value in args.scanLimits.split(",")]):
+        testName = "RangeScan {}/b{}/{}/l{}".format(selectivity, batchSize, projection, limit)
+        print("------------Running Range Scan Test (selectivity {}, batch size {}, projection {}, limit {})------------".format(selectivity, batchSize, projection, limit))
+        rangeScanTest = RangeScanTest(connString, args.dbName, int(args.numRuns), documentProvider, valueRange, selectivity, batchSize, projection, limit)
+        runTest(rangeScanTest, args)
+        results.append((testName, rangeScanTest))
+        print("\n")
+
+    print("------------Range Scan Results------------")
+    print("{:<40} {:>14} {:>10} {:>12} {:>10}".format("test", "docs/s", "MB/s", "docs/scan", "p99 ms"))
+    for testName, rangeScanTest in results:
+        summary = rangeScanTest.summary()
+        print("{:<40} {:>14.1f} {:>10.3f} {:>12.1f} {:>10.3f}".format(testName, summary["docsPerSec"], summary["bytesPerSec"] / 1048576,
+              rangeScanTest.numDocs / rangeScanTest.latencies.count if rangeScanTest.latencies.count else 0, summary["p99"] * 1000))
+    print("\n")
+    return results
+
+def runIndexBuilds(connString, args, documentProvider):
+    """
+    Run Index Builds
+
+    Times building every index of DocumentProvider.getIndexes() on the collection left by the bulk
+    insert test, --sweepRuns times each
+
+    :return: a list of (test name, IndexBuildTest)
+    """
+    results = []
+    for kind, keys in documentProvider.getIndexes():
+        fields = ",".join(field for field, direction in keys)
+        print("------------Running Index Build Test ({} index on {})------------".format(kind, fields))
+        indexBuildTest = IndexBuildTest(connString, args.dbName, int(args.sweepRuns), documentProvider, keys)
+        runTest(indexBuildTest, args)
+        results.append(("IndexBuild {} {}".format(kind, fields), indexBuildTest))
+        print("\n")
+    return results
+
+def runIndexCountCurve(connString, args, documentProvider):
+    """
+    Run Index Count Curve
+
+    Runs the bulk insert test with 0 to all of the secondary indexes of
+    DocumentProvider.getIndexes(), adding them in order, and prints the docs/s with every index
+    count relative to the docs/s without secondary indexes
+
+    :return: a list of (number of secondary indexes, BulkInsertTest)
+    """
+    numThreads = int(args.numThreads)
+    indexes = documentProvider.getIndexes()
+    results = []
+    for numIndexes in range(0, len(indexes) + 1):
+        print("------------Running Bulk Insert Test with {} Secondary Indexes on {} Threads------------".format(numIndexes, numThreads))
+        bulkInsertTest = createBulkInsertTest(connString, args, numThreads, int(int(args.numDocs) / numThreads), documentProvider, int(args.sweepRuns), indexes=indexes[:numIndexes])
+        runTest(bulkInsertTest, args)
+        results.append((numIndexes, bulkInsertTest))
+        print("\n")
+
+    print("------------Index Count Curve------------")
+    print("{:>8} {:<40} {:>14} {:>10} {:>10}".format("indexes", "last added", "docs/s", "relative", "p99 ms"))
+    baseDocsPerSec = results[0][1].summary()["docsPerSec"]
+    for numIndexes, bulkInsertTest in results:
+        summary = bulkInsertTest.summary()
+        lastAdded = "{} {}".format(indexes[numIndexes - 1][0], ",".join(field for field, direction in indexes[numIndexes - 1][1])) if numIndexes > 0 else "-"
+        print("{:>8} {:<40} {:>14.1f} {:>9.1f}% {:>10.3f}".format(numIndexes, lastAdded, summary["docsPerSec"],
+              summary["docsPerSec"] * 100 / baseDocsPerSec if baseDocsPerSec > 0 else 0, summary["p99"] * 1000))
+    print("\n")
+    return results
+
+def runCompressionMatrix(connString, args, documentProvider):
+    """
+    Run Compression Matrix
+
+    Runs the bulk insert test for every combination of --matrixCompressors and
+    --matrixWriteConcerns, and the equality and ranged query tests for every compressor, with
+    --sweepRuns runs of the bulk insert test. The bytes the server received and sent during every
+    test are read from serverStatus and reported per document. Compressors whose package is not
+    installed are skipped, as are combinations the server rejects, e.g. majority on a standalone.
+
+    :return: a list of (test name, PerfTest.summary) with bytesSentPerDoc and bytesReceivedPerDoc
+    """
+    numThreads = int(args.numThreads)
+    writeConcerns = args.matrixWriteConcerns.split(",")
+    meter = NetworkBytesMeter(connString)
+    points = []
+
+    def measure(perfTest, compressor, writeConcernStr, testName):
+        meter.start()
+        try:
+            runTest(perfTest, args)
+        except pymongo.errors.PyMongoError as e:
+            print("Skipping {} with compressor {}, w={}: {}\n".format(testName, compressor, writeConcernStr, e))
+            return
+        bytesIn, bytesOut = meter.stop()
+        summary = perfTest.summary()
+        summary["bytesSentPerDoc"] = bytesIn / perfTest.numDocs if perfTest.numDocs else 0
+        summary["bytesReceivedPerDoc"] = bytesOut / perfTest.numDocs if perfTest.numDocs else 0
+        points.append((compressor, writeConcernStr, testName, summary))
+        print("\n")
+
+    try:
+        for compressor in args.matrixCompressors.split(","):
+            if compressor != "none" and not compressorAvailable(compressor):
+                print("Skipping compressor {}, its package is not installed\n".format(compressor))
+                continue
+            # Replaces any compressors of the connection string, so none is uncompressed too
+            compressedConnString = withUriOption(connString, "compressors", None if compressor == "none" else compressor)
+            for writeConcernStr in writeConcerns:
+                print("------------Running Bulk Insert Test on {} Threads, compressor {}, w={}------------".format(numThreads, compressor, writeConcernStr))
+                bulkInsertTest = createBulkInsertTest(compressedConnString, args, numThreads, int(int(args.numDocs) / numThreads), documentProvider, int(args.sweepRuns), writeConcern=parseWriteConcern(writeConcernStr))
+                measure(bulkInsertTest, compressor, writeConcernStr, "BulkInsert")
+
+            # Reads do not depend on the write concern
+            for testName, operation, queryTest in (("EqualityQuery", "eqQuery", EqualityQueryTest), ("RangedQuery", "rangeQuery", RangedQueryTest)):
+                print("------------Running {} Test, compressor {}------------".format(testName, compressor))
+                if args.asyncMode:
+                    perfTest = AsyncQueryTest(compressedConnString, args.dbName, int(args.numRuns), numThreads, int(args.concurrency), operation, documentProvider)
+                else:
+                    perfTest = queryTest(compressedConnString, args.dbName, int(args.numRuns), numThreads, documentProvider)
+                measure(perfTest, compressor, "-", testName)
+            # Every compressor connects with its own URI, so its clients are not used again
+            clientRegistry.closeAll()
+    finally:
+        meter.close()
+
+    print("------------Compression Matrix Results------------")
+    print("{:<8} {:<12} {:<14} {:>14} {:>9} {:>9} {:>9} {:>13} {:>13}".format("compr", "w", "test", "docs/s", "p50 ms", "p99 ms", "p99.9 ms", "sent B/doc", "recv B/doc"))
+    for compressor, writeConcernStr, testName, summary in points:
+        print("{:<8} {:<12} {:<14} {:>14.1f} {:>9.3f} {:>9.3f} {:>9.3f} {:>13.1f} {:>13.1f}".format(compressor, writeConcernStr, testName, summary["docsPerSec"],
+              summary["p50"] * 1000, summary["p99"] * 1000, summary["p99.9"] * 1000, summary["bytesSentPerDoc"], summary["bytesReceivedPerDoc"]))
+    print("\n")
+    return [("{} {}{}".format(testName, compressor, " w=" + writeConcernStr if writeConcernStr != "-" else ""), summary)
+            for compressor, writeConcernStr, testName, summary in points]
+
+def runTestPlan(connString, documentProviders, args):
+    """
+    Run Test Plan
+
+    Runs every test of the plan against one connection string
+
+    :return: a list of (document provider name, test name, PerfTest.summary()) for every test
+    """
+    numRuns             = int(args.numRuns)
+    numDocs             = int(args.numDocs)
+    numThreads          = int(args.numThreads)
+
+    results = []
+    for documentProvider in documentProviders:
+        providerName = documentProvider.__class__.__name__
+
+        # try:
+        borderStr       = "###############################################################"
+        titleStr        = "Running tests on db {}".format(connString)
+        titleStr2       = "Using Document Provider {}".format(providerName)
+        bufferStrLen    = int(max(float((len(borderStr) - len(titleStr))/2), 0))
+        bufferStr       = " "*bufferStrLen
+        bufferStr2Len   = int(max(float((len(borderStr) - len(titleStr2))/2), 0))
+        bufferStr2      = " "*bufferStr2Len
+
+        print(borderStr)
+        print(bufferStr + titleStr + bufferStr)
+        print(bufferStr2 + titleStr2 + bufferStr2)
+        print(borderStr)
+
+        print("------------Testing Connection with a Single Insert------------")
+        singleWritePerTest = SingleInsertTest(connString, args.dbName, numThreads, documentProvider)
+        runTest(singleWritePerTest, args)
+        results.append((providerName, "SingleInsert", singleWritePerTest.summary()))
+        print("\n")
+
+        if args.targetOpsPerSec:
+            targetRates = [float(rate) for rate in args.targetOpsPerSec.split(",")]
+            for targetOpsPerSec, openLoopTest in runOpenLoopSweep(connString, args.dbName, int(args.openLoopRuns), numThreads, targetRates, float(args.openLoopDuration), args.openLoopOp, documentProvider, args):
+                results.append((providerName, "OpenLoop {} @ {}/s".format(args.openLoopOp, targetOpsPerSec), openLoopTest.summary()))
+            continue
+
+        if args.matrix:
+            for testName, summary in runCompressionMatrix(connString, args, documentProvider):
+                results.append((providerName, testName, summary))
+            continue
+
+        threads = 1
+        if args.sweep:
+            for testName, summary in runParameterSweep(connString, args, documentProvider):
+                results.append((providerName, testName, summary))
+        elif args.layoutSweep:
+            for processes, threadsPerProcess, bulkInsertTest in runLayoutSweep(connString, args, documentProvider):
+                results.append((providerName, "BulkInsert {}x{}".format(processes, threadsPerProcess), bulkInsertTest.summary()))
+        elif args.cumulThreads:
+            while threads <= numThreads:
+                print("------------Running Bulk Insert Test on {} Threads------------".format(threads))
+                numDocsPerThread = int(numDocs / threads)
+                bulkInsertTest = createBulkInsertTest(connString, args, threads, numDocsPerThread, documentProvider)
+                runTest(bulkInsertTest, args)
+                results.append((providerName, "BulkInsert x{}".format(threads), bulkInsertTest.summary()))
+                print("\n")
+                threads = threads*2
+        else:
+            print("------------Running Bulk Insert Test on {} Threads------------".format(numThreads))
+            numDocsPerThread = int(numDocs / numThreads)
+            bulkInsertTest = createBulkInsertTest(connString, args, numThreads, numDocsPerThread, documentProvider)
+            runTest(bulkInsertTest, args)
+            results.append((providerName, "BulkInsert x{}".format(numThreads), bulkInsertTest.summary()))
+            print("\n")
+
+        print("------------Running Equality Query Test------------")
+        if args.asyncMode:
+            eqQueryTest = AsyncQueryTest(connString, args.dbName, numRuns, numThreads, int(args.concurrency), "eqQuery", documentProvider)
+        else:
+            eqQueryTest = EqualityQueryTest(connString, args.dbName, numRuns, numThreads, documentProvider)
+        runTest(eqQueryTest, args)
+        results.append((providerName, "EqualityQuery", eqQueryTest.summary()))
+        print("\n")
+
+        print("------------Running Ranged Query Test------------")
+        if args.asyncMode:
+            rangedQueryTest = AsyncQueryTest(connString, args.dbName, numRuns, numThreads, int(args.concurrency), "rangeQuery", documentProvider)
+        else:
+            rangedQueryTest = RangedQueryTest(connString, args.dbName, numRuns, numThreads, documentProvider)
+        runTest(rangedQueryTest, args)
+        results.append((providerName, "RangedQuery", rangedQueryTest.summary()))
+        print("\n")
+
+        if args.scanSelectivity:
+            for testName, rangeScanTest in runRangeScanSweep(connString, args, documentProvider):
+                results.append((providerName, testName, rangeScanTest.summary()))
+
+        if args.indexBuild:
+            for testName, indexBuildTest in runIndexBuilds(connString, args, documentProvider):
+                results.append((providerName, testName, indexBuildTest.summary()))
+
+        if args.mix:
+            mix = parseMix(args.mix)
+            print("------------Running Mixed Workload Test ({} insert:eqQuery:rangeQuery) on {} Threads------------".format(args.mix, numThreads))
+            mixedWorkloadTest = MixedWorkloadTest(connString, args.dbName, numRuns, numThreads, int(numDocs / numThreads), mix, documentProvider)
+            runTest(mixedWorkloadTest, args)
+            results.append((providerName, "MixedWorkload {}".format(args.mix), mixedWorkloadTest.summary()))
+            print("\n")
+
+        if args.writeOps:
+            # Run in the order given, so deletes listed last do not starve the updates of documents
+            for operation in args.writeOps.split(","):
+                print("------------Running Bulk Write Test ({}) on {} Threads------------".format(operation, numThreads))
+                bulkWriteTest = BulkWriteTest(connString, args.dbName, numRuns, numThreads, int(numDocs / numThreads), int(args.batchSize), operation, documentProvider, int(numDocs / numThreads))
+                runTest(bulkWriteTest, args)
+                results.append((providerName, "BulkWrite {}".format(operation), bulkWriteTest.summary()))
+                print("\n")
+
+        # Refills the collection, so it runs after every test that reads the one of the bulk insert test
+        if args.indexCurve:
+            for numIndexes, bulkInsertTest in runIndexCountCurve(connString, args, documentProvider):
+                results.append((providerName, "BulkInsert {} indexes".format(numIndexes), bulkInsertTest.summary()))
+
+            # print("------------Running $in Equality Query Test------------")
+        # except Exception as e:
+        #     print("Encountered error {}".format(e))
+    return results
+
+def _runTestPlanProcess(connString, documentProviders, args, resultQueue):
+    # Buffer the output of each target so the logs of concurrent targets do not interleave
+    output = io.StringIO()
+    results = []
+    with contextlib.redirect_stdout(output):
+        try:
+            results = runTestPlan(connString, documentProviders, args)
+        except Exception:
+            traceback.print_exc(file=output)
+    resultQueue.put((connString, output.getvalue(), results))
+
+def runTestPlansConcurrently(connStrings, documentProviders, args):
+    """
+    Run Test Plans Concurrently
+
+    Runs the test plan against every connection string at the same time. Each target runs in its
+    own process with its own worker pools and connections. A target that exits without reporting
+    results is left out of the returned dict instead of blocking the others.
+
+    :return: a dict of connection string to the results of runTestPlan
+    """
+    resultQueue = multiprocessing.Queue()
+    processes = [multiprocessing.Process(target=_runTestPlanProcess, args=(connString, documentProviders, args, resultQueue)) for connString in connStrings]
+    for process in processes:
+        process.start()
+
+    results = {}
+    pending = dict(zip(connStrings, processes))
+    while pending:
+        # A target puts its results before it exits, so one that had already exited when a get
+        # timed out died without reporting, e.g. it was killed or crashed outside the test plan
+        exited = [connString for connString, process in pending.items() if process.exitcode is not None]
+        try:
+            connString, output, targetResults = resultQueue.get(timeout=RESULT_POLL_INTERVAL)
+        except queue.Empty:
+            for connString in exited:
+                print("Target {} exited with code {} without reporting results".format(redactConnString(connString), pending.pop(connString).exitcode))
+            continue
+        print(output)
+        results[connString] = targetResults
+        pending.pop(connString, None)
+    for process in processes:
+        process.join()
+    return results
+
+def printComparisonTable(connStrings, results):
+    """
+    Print Comparison Table
+
+    Prints the throughput and latency percentiles of every test side by side for all targets
+    """
+    print("------------{}------------".format("Comparison of Targets" if len(connStrings) > 1 else "Results"))
+    for i, connString in enumerate(connStrings):
+        print("T{}: {}".format(i + 1, redactConnString(connString)))
+    header = "{:<30} {:<26}".format("provider", "test")
+    for i in range(len(connStrings)):
+        header += " | {:>12} {:>9} {:>9} {:>9}".format("T{} ops/s".format(i + 1), "p50 ms", "p99 ms", "p99.9 ms")
+    print(header)
+
+    rows = []
+    for connString in connStrings:
+        for providerName, testName, summary in results.get(connString, []):
+            if (providerName, testName) not in rows:
+                rows.append((providerName, testName))
+    for providerName, testName in rows:
+        line = "{:<30} {:<26}".format(providerName, testName)
+        for connString in connStrings:
+            summaries = [summary for resultProvider, resultTest, summary in results.get(connString, []) if (resultProvider, resultTest) == (providerName, testName)]
+            if summaries:
+                summary = summaries[0]
+                line += " | {:>12.1f} {:>9.3f} {:>9.3f} {:>9.3f}".format(summary["opsPerSec"], summary["p50"] * 1000, summary["p99"] * 1000, summary["p99.9"] * 1000)
+            else:
+                line += " | {:>12} {:>9} {:>9} {:>9}".format("-", "-", "-", "-")
+        print(line)
+    print("\n")
+
 def main(args):
     """
     Main
@@ -95,12 +721,7 @@ def main(args):
     print("Using command line args: {}\n".format(str(args)))
     # checkOsCompatibility()
 
-    # TODO generate test conditions first THEN inject client. Can we do this in a clever way without too much memory consumption
-    numRuns             = int(args.numRuns)
-    numDocs             = int(args.numDocs)
-    numThreads          = int(args.numThreads)
-
-    batchSize           = int(args.batchSize)
+    clientRegistry.maxPoolSize = int(args.maxPoolSize)
 
     # Get document provider
     documentProviders = []
@@ -111,70 +732,81 @@ def main(args):
     elif args.documentProvider.lower() == NestedDocumentProvider.__name__.lower():
         documentProviders.append(NestedDocumentProvider())
     elif args.documentProvider.lower() == kb50DocumentProvider.__name__.lower():
-        documentProviders.append(kb50DocumentProvider())
+        documentProviders.append(kb50DocumentProvider(not args.disableRawBson))
     elif args.documentProvider.lower() == mb1DocumentProvider.__name__.lower():
-        documentProviders.append(mb1DocumentProvider())
+        documentProviders.append(mb1DocumentProvider(not args.disableRawBson))
     else:
         documentProviders.append(StringValueDocumentProvider(10))
         documentProviders.append(IntegerValueDocumentProvider())
         documentProviders.append(NestedDocumentProvider())
-        documentProviders.append(kb50DocumentProvider())
-        documentProviders.append(mb1DocumentProvider())
-
+        documentProviders.append(kb50DocumentProvider(not args.disableRawBson))
+        documentProviders.append(mb1DocumentProvider(not args.disableRawBson))
+
+    if args.prepare:
+        if args.datasetDir is None:
+            raise ValueError("--prepare requires --datasetDir")
+        prepareDatasets(documentProviders, args)
+        return 0
+
+    if args.offline:
+        return runOfflineBenchmark(documentProviders, int(args.numDocs), int(args.batchSize), int(args.offlineTrials), args.offlineSink,
+                                   args.offlineOutput, args.offlineBaseline, float(args.offlineTolerance))
+
+    if args.compare is not None:
+        return compareStoredRuns(args.resultsFile, args.compare[0], args.compare[1], args)
+
+    if args.dbConnStrings is None:
+        raise ValueError("--dbConnStrings is required unless --prepare, --offline or --compare is set")
+    if args.mix:
+        parseMix(args.mix)
+    if args.scanSelectivity:
+        for projection in args.scanProjections.split(","):
+            if projection not in RangeScanTest.PROJECTIONS:
+                raise ValueError("Unknown --scanProjections projection {}, expected one of {}".format(projection, ", ".join(RangeScanTest.PROJECTIONS)))
+    if args.writeOps:
+        for operation in args.writeOps.split(","):
+            if operation not in BulkWriteTestTrial.OPERATIONS:
+                raise ValueError("Unknown --writeOps operation {}, expected one of {}".format(operation, ", ".join(BulkWriteTestTrial.OPERATIONS)))
+
+    # Fetch the baseline before this run is stored, so "latest" means the last run before this one
+    baselineRecords = None
+    if args.baseline is not None:
+        baselineRecords = ResultsStore(args.resultsFile).getRun(args.baseline)
     connStrings = args.dbConnStrings.split(";")
-    for connString in connStrings:
-        for documentProvider in documentProviders:
-
-            # try:
-            borderStr       = "###############################################################"
-            titleStr        = "Running tests on db {}".format(connString)
-            titleStr2       = "Using Document Provider {}".format(documentProvider.__class__.__name__)
-            bufferStrLen    = int(max(float((len(borderStr) - len(titleStr))/2), 0))
-            bufferStr       = " "*bufferStrLen
-            bufferStr2Len   = int(max(float((len(borderStr) - len(titleStr2))/2), 0))
-            bufferStr2      = " "*bufferStr2Len
-
-            print(borderStr)
-            print(bufferStr + titleStr + bufferStr)
-            print(bufferStr2 + titleStr2 + bufferStr2)
-            print(borderStr)
-
-            print("------------Testing Connection with a Single Insert------------")
-            singleWritePerTest = SingleInsertTest(connString, args.dbName, documentProvider)
-            singleWritePerTest.runTest()
-            print("\n")
+    if args.concurrentTargets and len(connStrings) > 1:
+        results = runTestPlansConcurrently(connStrings, documentProviders, args)
+    else:
+        results = dict((connString, runTestPlan(connString, documentProviders, args)) for connString in connStrings)
 
-            threads = 1
-            if args.cumulThreads:
-                while threads <= numThreads:
-                    print("------------Running Bulk Insert Test on {} Threads------------".format(threads))
-                    numDocsPerThread = int(numDocs / threads)
-                    bulkInsertTest = BulkInsertTest(connString, args.dbName, numRuns, threads, numDocsPerThread, batchSize, documentProvider)
-                    bulkInsertTest.runTest()
-                    print("\n")
-                    threads = threads*2
-            else:
-                print("------------Running Bulk Insert Test on {} Threads------------".format(numThreads))
-                numDocsPerThread = int(numDocs / numThreads)
-                bulkInsertTest = BulkInsertTest(connString, args.dbName, numRuns, numThreads, numDocsPerThread, batchSize, documentProvider)
-                bulkInsertTest.runTest()
-                print("\n")
+    printComparisonTable(connStrings, results)
 
-            print("------------Running Equality Query Test------------")
-            eqQueryTest = EqualityQueryTest(connString, args.dbName, numRuns, documentProvider)
-            eqQueryTest.runTest()
-            print("\n")
+    runId = newRunId()
+    config = runConfig(args)
+    records = [record for connString in connStrings for record in runRecords(runId, config, connString, results.get(connString, []))]
+    if args.resultsFile:
+        ResultsStore(args.resultsFile).append(records)
+        print("Stored results of run {} in {}".format(runId, args.resultsFile))
 
-            print("------------Running Ranged Query Test------------")
-            rangedQueryTest = RangedQueryTest(connString, args.dbName, numRuns, documentProvider)
-            rangedQueryTest.runTest()
-            print("\n")
+    if baselineRecords is not None:
+        print("------------Comparison against run {}------------".format(baselineRecords[0]["runId"]))
+        regressions = printComparison(compareRuns(baselineRecords, records, float(args.alpha), float(args.minEffect)))
+        print("{} regressions".format(regressions))
+        return 1 if regressions else 0
+    return 0
 
-                # print("------------Running $in Equality Query Test------------")
-            # except Exception as e:
-            #     print("Encountered error {}".format(e))
+def compareStoredRuns(resultsFile, baselineRunId, candidateRunId, args):
+    """
+    Compare Stored Runs
 
-            # TODO print test to table
+    :return: 1 if the candidate run regressed against the baseline run, else 0
+    """
+    store = ResultsStore(resultsFile)
+    baselineRecords = store.getRun(baselineRunId)
+    candidateRecords = store.getRun(candidateRunId)
+    print("------------Comparing run {} against run {}------------".format(candidateRecords[0]["runId"], baselineRecords[0]["runId"]))
+    regressions = printComparison(compareRuns(baselineRecords, candidateRecords, float(args.alpha), float(args.minEffect)))
+    print("{} regressions".format(regressions))
+    return 1 if regressions else 0
 
 def setupArgs():
     """
@@ -185,12 +817,69 @@ def setupArgs():
     parser.add_argument('--numRuns',        required=False, action="store",         dest='numRuns',         default=NUM_RUNS_DEFAULT,           help='The number of runs in the test')
     parser.add_argument('--numDocs',        required=False, action="store",         dest='numDocs',         default=NUM_DOCS_PER_RUN_DEFAULT,   help='The number of docs per test run')
     parser.add_argument('--numThreads',     required=False, action="store",         dest='numThreads',      default=NUM_THREADS_DEFAULT,        help='Num of threads to run parallel tests on')
+    parser.add_argument('--executor',       required=False, action="store",         dest='executor',        default=EXECUTOR_DEFAULT,           choices=("processes", "threads", "hybrid"), help='Run the numThreads workers of pooled tests as processes, as threads of one process, or as threadsPerProcess threads per process')
+    parser.add_argument('--threadsPerProcess',required=False,action="store",        dest='threadsPerProcess',default=THREADS_PER_PROCESS_DEFAULT, help='Worker threads per process for the hybrid executor, and the maximum for --layoutSweep')
+    parser.add_argument('--layoutSweep',    required=False, action="store_true",    dest='layoutSweep',     default=False,                      help='Include this flag to run the bulk insert test for 1 to numThreads processes times 1 to threadsPerProcess threads in powers of 2')
+    parser.add_argument('--sweep',          required=False, action="store_true",    dest='sweep',           default=False,                      help='Include this flag to search worker counts up to numThreads, batch sizes and write concerns for the highest bulk insert throughput')
+    parser.add_argument('--sweepBatchSizes',required=False, action="store",         dest='sweepBatchSizes', default=SWEEP_BATCH_SIZES_DEFAULT,  help='Comma delimitted ascending batch sizes of the sweep')
+    parser.add_argument('--sweepWriteConcerns',required=False,action="store",       dest='sweepWriteConcerns',default=SWEEP_WRITE_CONCERNS_DEFAULT, help='Comma delimitted write concerns of the sweep, e.g. 1,majority,majority:j')
+    parser.add_argument('--sweepRuns',      required=False, action="store",         dest='sweepRuns',       default=SWEEP_RUNS_DEFAULT,         help='The number of runs of every sweep point')
+    parser.add_argument('--sweepMaxP99',    required=False, action="store",         dest='sweepMaxP99',     default=None,                       help='The highest p99 latency in ms per document, the p99 of an insert_many divided by its batch size, of a configuration the sweep may report as best')
+    parser.add_argument('--plateauGain',    required=False, action="store",         dest='plateauGain',     default=PLATEAU_GAIN_DEFAULT,       help='The sweep stops expanding a dimension once a step gains less than this relative throughput')
+    parser.add_argument('--kneeFactor',     required=False, action="store",         dest='kneeFactor',      default=KNEE_FACTOR_DEFAULT,        help='The sweep stops expanding a dimension once p99 latency per document grows this many times faster than throughput')
     parser.add_argument('--cumulThreads',   required=False, action="store_true",    dest='cumulThreads',    default=False,                      help='Include this flag if tests should build up from 1 to numThreads in powers of 2')
     parser.add_argument('--batchSize',      required=False, action="store",         dest='batchSize',       default=BATCH_SIZE_DEFAULT,         help='The batch size for inserts')
-    parser.add_argument('--dbConnStrings',  required=True,  action="store",         dest='dbConnStrings',   default=None,                       help='Semi-colon delimitted list of connection strings')
+    parser.add_argument('--maxBatchBytes',  required=False, action="store",         dest='maxBatchBytes',   default=None,                       help='The maximum encoded size in bytes of an insert batch. Defaults to the server maxBsonObjectSize')
+    parser.add_argument('--maxRetries',     required=False, action="store",         dest='maxRetries',      default=MAX_RETRIES_DEFAULT,        help='How many times a document of a bulk insert that failed with a transient error is retried, with exponential backoff')
+    parser.add_argument('--dbConnStrings',  required=False, action="store",         dest='dbConnStrings',   default=None,                       help='Semi-colon delimitted list of connection strings')
     parser.add_argument('--dbName',         required=False, action="store",         dest='dbName',          default=DB_NAME_DEFAULT,            help='Name of the database into which data will be inserted')
     parser.add_argument('--documentProvider',required=False,action="store",         dest='documentProvider',default=DB_NAME_DEFAULT,            help='Type of document to insert/read')
-    # TODO support for async inserts
+    parser.add_argument('--disableRawBson', required=False, action="store_true",    dest='disableRawBson',  default=False,                      help='Include this flag to render template documents from JSON for every insert instead of splicing pre-encoded BSON')
+    parser.add_argument('--maxPoolSize',    required=False, action="store",         dest='maxPoolSize',     default=MAX_POOL_SIZE_DEFAULT,      help='The maximum size of the shared connection pool of each process')
+    parser.add_argument('--targetOpsPerSec',required=False, action="store",         dest='targetOpsPerSec', default=None,                       help='Comma delimitted list of target operation rates. Runs an open loop sweep instead of the closed loop tests')
+    parser.add_argument('--openLoopOp',     required=False, action="store",         dest='openLoopOp',      default=OPEN_LOOP_OP_DEFAULT,       choices=OpenLoopTestTrial.OPERATIONS, help='The operation offered by the open loop test')
+    parser.add_argument('--openLoopDuration',required=False,action="store",         dest='openLoopDuration',default=OPEN_LOOP_DURATION_DEFAULT, help='The duration in seconds of each open loop trial')
+    parser.add_argument('--openLoopRuns',   required=False, action="store",         dest='openLoopRuns',    default=OPEN_LOOP_RUNS_DEFAULT,     help='The number of open loop trials per target rate')
+    parser.add_argument('--mix',            required=False, action="store",         dest='mix',             default=None,                       help='Colon delimitted insert:eqQuery:rangeQuery weights, e.g. 50:50:0, weights left out are 0. Runs a mixed workload test after the query tests')
+    parser.add_argument('--scanSelectivity',required=False, action="store",         dest='scanSelectivity', default=None,                       help='Comma delimitted fractions of the inserted nums matched by the range scan test, e.g. 0.001,0.01,0.1. Runs the range scan test after the query tests')
+    parser.add_argument('--scanBatchSizes', required=False, action="store",         dest='scanBatchSizes',  default=SCAN_BATCH_SIZES_DEFAULT,   help='Comma delimitted cursor batch sizes of the range scan test, 0 for the server default')
+    parser.add_argument('--scanProjections',required=False, action="store",         dest='scanProjections', default=SCAN_PROJECTIONS_DEFAULT,   help='Comma delimitted projections of the range scan test: full for whole documents, index for only the indexed field')
+    parser.add_argument('--scanLimits',     required=False, action="store",         dest='scanLimits',      default=SCAN_LIMITS_DEFAULT,        help='Comma delimitted limits of the range scan test, 0 for no limit')
+    parser.add_argument('--indexBuild',     required=False, action="store_true",    dest='indexBuild',      default=False,                      help='Include this flag to time building every index of the document provider on the bulk insert collection, sweepRuns times each')
+    parser.add_argument('--indexCurve',     required=False, action="store_true",    dest='indexCurve',      default=False,                      help='Include this flag to rerun the bulk insert test with 0 to all secondary indexes of the document provider, sweepRuns runs each')
+    parser.add_argument('--matrix',         required=False, action="store_true",    dest='matrix',          default=False,                      help='Include this flag to run the bulk insert and query tests for every combination of matrixCompressors and matrixWriteConcerns instead of the normal test plan, reporting bytes sent and received per document')
+    parser.add_argument('--matrixCompressors',required=False,action="store",        dest='matrixCompressors',default=MATRIX_COMPRESSORS_DEFAULT, help='Comma delimitted wire compressors of the matrix, none for an uncompressed connection. Compressors whose package is not installed are skipped')
+    parser.add_argument('--matrixWriteConcerns',required=False,action="store",      dest='matrixWriteConcerns',default=MATRIX_WRITE_CONCERNS_DEFAULT, help='Comma delimitted write concerns of the matrix, e.g. 1,majority,1:j')
+    parser.add_argument('--writeOps',       required=False, action="store",         dest='writeOps',        default=None,                       help='Comma delimitted bulk write operations to test in this order after the query tests, of updateOne, updateMany, upsert and deleteOne. Every operation sends numDocs requests, batchSize per bulk_write')
+    parser.add_argument('--concurrentTargets',required=False,action="store_true",   dest='concurrentTargets',default=False,                     help='Include this flag to run the tests against all connection strings at the same time')
+    parser.add_argument('--adaptive',       required=False, action="store_true",    dest='adaptive',        default=False,                      help='Include this flag to discard warm-up trials and stop each test once its run time converges, using numRuns as the maximum')
+    parser.add_argument('--targetRelError', required=False, action="store",         dest='targetRelError',  default=TARGET_REL_ERROR_DEFAULT,   help='The relative half width of the confidence interval at which an adaptive test stops')
+    parser.add_argument('--confidence',     required=False, action="store",         dest='confidence',      default=CONFIDENCE_DEFAULT,         help='The confidence level of the interval used by adaptive tests')
+    parser.add_argument('--warmupTrials',   required=False, action="store",         dest='warmupTrials',    default=WARMUP_TRIALS_DEFAULT,      help='The minimum number of warm-up trials discarded by adaptive tests, at most half the trials of a test. 0 measures from the first trial')
+    parser.add_argument('--timeBudget',     required=False, action="store",         dest='timeBudget',      default=TIME_BUDGET_DEFAULT,        help='The wall clock budget in seconds of each adaptive test')
+    parser.add_argument('--datasetDir',     required=False, action="store",         dest='datasetDir',      default=None,                       help='Directory of pre-generated datasets. Bulk inserts send the memory-mapped documents instead of creating them. Prepare it with the same numDocs, numThreads and sweep flags as the run')
+    parser.add_argument('--prepare',        required=False, action="store_true",    dest='prepare',         default=False,                      help='Include this flag to render the bulk insert documents into --datasetDir and exit')
+    parser.add_argument('--async',          required=False, action="store_true",    dest='asyncMode',       default=False,                      help='Include this flag to run the bulk insert and query tests with an asyncio driver')
+    parser.add_argument('--concurrency',    required=False, action="store",         dest='concurrency',     default=CONCURRENCY_DEFAULT,        help='The number of operations each process keeps in flight with --async')
+    parser.add_argument('--profile',        required=False, action="store",         dest='profile',         default=None,                       choices=("cprofile", "tracemalloc"), help='Run one extra trial of every test under this profiler and write a profile per worker to profileDir. The profiled trial is left out of the results')
+    parser.add_argument('--profileTrial',   required=False, action="store",         dest='profileTrial',    default=PROFILE_TRIAL_DEFAULT,      help='The number of the trial to profile, counting from 0')
+    parser.add_argument('--profileDir',     required=False, action="store",         dest='profileDir',      default=PROFILE_DIR_DEFAULT,        help='Directory the profiles are written to')
+    parser.add_argument('--serverStatusInterval',required=False,action="store",     dest='serverStatusInterval',default=None,                   help='Include this option to sample serverStatus and replica set status every this many seconds during every test')
+    parser.add_argument('--serverSamplesDir',required=False,action="store",         dest='serverSamplesDir',default=None,                       help='Directory the server and client time series of every test are written to')
+    parser.add_argument('--spikeFactor',    required=False, action="store",         dest='spikeFactor',     default=SPIKE_FACTOR_DEFAULT,       help='How many times its median a trial latency or server metric must reach to be reported as a spike')
+    parser.add_argument('--liveInterval',   required=False, action="store",         dest='liveInterval',    default=None,                       help='Include this option to print the throughput and latency of every this many seconds while a test runs, e.g. 1')
+    parser.add_argument('--liveFile',       required=False, action="store",         dest='liveFile',        default=None,                       help='File the live throughput and latency time series of all tests is appended to as JSON lines')
+    parser.add_argument('--resultsFile',    required=False, action="store",         dest='resultsFile',     default=RESULTS_FILE_DEFAULT,       help='JSON lines file the configuration and results of every run are appended to. Pass an empty string to not store results')
+    parser.add_argument('--baseline',       required=False, action="store",         dest='baseline',        default=None,                       help='Id of a stored run, or latest or previous, to compare this run against. Exits with 1 on a regression')
+    parser.add_argument('--compare',        required=False, action="store",         dest='compare',         default=None,   nargs=2,            metavar=('BASELINE', 'CANDIDATE'), help='Compare two stored runs instead of running tests. Exits with 1 if the candidate regressed')
+    parser.add_argument('--alpha',          required=False, action="store",         dest='alpha',           default=ALPHA_DEFAULT,              help='Significance level of the regression tests')
+    parser.add_argument('--minEffect',      required=False, action="store",         dest='minEffect',       default=MIN_EFFECT_DEFAULT,         help='Smallest relative drop in throughput or rise in latency that counts as a regression')
+    parser.add_argument('--offline',        required=False, action="store_true",    dest='offline',         default=False,                      help='Include this flag to measure the client side cost of generating, encoding and batching numDocs documents per provider without a server')
+    parser.add_argument('--offlineSink',    required=False, action="store_true",    dest='offlineSink',     default=False,                      help='Include this flag to also run the offline batches through a fake in-process bulk_write')
+    parser.add_argument('--offlineTrials',  required=False, action="store",         dest='offlineTrials',   default=OFFLINE_TRIALS_DEFAULT,     help='The number of timed trials of the offline benchmark')
+    parser.add_argument('--offlineOutput',  required=False, action="store",         dest='offlineOutput',   default=None,                       help='File to save the offline results to, for use as a baseline')
+    parser.add_argument('--offlineBaseline',required=False, action="store",         dest='offlineBaseline', default=None,                       help='File of earlier offline results. Exits with 1 if a provider renders different documents or a stage is slower by more than offlineTolerance')
+    parser.add_argument('--offlineTolerance',required=False,action="store",         dest='offlineTolerance',default=OFFLINE_TOLERANCE_DEFAULT,  help='The allowed relative drop in docs/s against the offline baseline')
     return parser.parse_args()
 
 
@@ -202,7 +891,7 @@ def runScript():
     not yet been parsed
     """
     args = setupArgs()
-    main(args)
+    sys.exit(main(args))
 
 #-------------------------------
 if __name__ == "__main__":
@@ -0,0 +1,94 @@
+def docLatency(point):
+    """
+    Doc Latency
+
+    The p99 latency of an insert_many grows with its batch size by construction, so points with
+    different batch sizes are compared on the latency per document instead
+
+    :param point: (threads, batch size, PerfTest.summary)
+    :return: the p99 latency of the point divided by its batch size
+    """
+    return point[2]["p99"] / max(point[1], 1)
+
+def scalingStop(previous, current, plateauGain, kneeFactor):
+    """
+    Scaling Stop
+
+    Decides whether a sweep should stop expanding along a dimension after a step from the point
+    previous to the point current
+
+    :param previous: the (threads, batch size, PerfTest.summary) of the previous point, or None for the first point
+    :param current: the (threads, batch size, PerfTest.summary) of the current point
+    :param plateauGain: smallest relative throughput gain that is worth another step
+    :param kneeFactor: how many times faster than throughput the p99 latency per document must grow to count as a knee
+    :return: "plateau", "latency knee" or None to keep expanding
+    """
+    if previous is None or previous[2]["docsPerSec"] <= 0:
+        return None
+    gain = current[2]["docsPerSec"] / previous[2]["docsPerSec"]
+    if docLatency(previous) > 0 and docLatency(current) / docLatency(previous) > kneeFactor * gain:
+        return "latency knee"
+    if gain < 1 + plateauGain:
+        return "plateau"
+    return None
+
+class ParameterSweep():
+    """
+    Parameter Sweep
+
+    Searches worker counts and batch sizes, both in ascending order, for the highest throughput.
+    For every worker count, batch sizes are expanded until throughput plateaus or latency knees,
+    and worker counts are expanded until the best throughput of a worker count plateaus or knees
+    against the one before it. So the search only pays for the grid points that still scale.
+    Latencies are compared per document, see docLatency().
+
+    runPoint is called with (numThreads, batchSize) and returns the PerfTest.summary of the point.
+    """
+    def __init__(self, runPoint, threadCounts, batchSizes, plateauGain=0.05, kneeFactor=1.5, maxP99=None):
+        self.runPoint       = runPoint
+        self.threadCounts   = threadCounts
+        self.batchSizes     = batchSizes
+        self.plateauGain    = plateauGain
+        self.kneeFactor     = kneeFactor
+        self.maxP99         = maxP99
+        self.points         = []
+        self.curve          = []
+        self.threadStop     = None
+    def run(self):
+        """
+        Run
+
+        Fills points with (threads, batch size, summary, reason the batch sizes stopped expanding)
+        and curve with the best (threads, batch size, summary) of every worker count
+
+        :return:
+        """
+        previousBest = None
+        for numThreads in self.threadCounts:
+            best = None
+            previous = None
+            for batchSize in self.batchSizes:
+                point = (numThreads, batchSize, self.runPoint(numThreads, batchSize))
+                stop = scalingStop(previous, point, self.plateauGain, self.kneeFactor)
+                self.points.append(point + (stop,))
+                if best is None or point[2]["docsPerSec"] > best[2]["docsPerSec"]:
+                    best = point
+                if stop is not None:
+                    break
+                previous = point
+            self.curve.append(best)
+            self.threadStop = scalingStop(previousBest, best, self.plateauGain, self.kneeFactor)
+            if self.threadStop is not None:
+                break
+            previousBest = best
+    def best(self):
+        """
+        Best
+
+        :return: the (threads, batch size, summary) with the highest docs/s among the points whose
+                 p99 latency per document is within maxP99, or None if no point qualifies
+        """
+        candidates = [point[:3] for point in self.points if self.maxP99 is None or docLatency(point) <= self.maxP99]
+        if not candidates:
+            return None
+        return max(candidates, key=lambda point: point[2]["docsPerSec"])
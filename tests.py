@@ -1,15 +1,358 @@
+import asyncio
+import bson
+import collections
+import cProfile
+import heapq
+import os
 import pymongo
+import random
+import threading
 import time
-from scipy import stats
-from multiprocessing import Pool
+import tracemalloc
+from bson.codec_options import CodecOptions
+from bson.raw_bson import RawBSONDocument
+from concurrent.futures import ThreadPoolExecutor
+from multiprocessing import Pool, Barrier
 
-from util import DocumentProvider
+from util import DocumentProvider, ConnectionCounter, clientRegistry
+from dataset import datasetPath, MappedDataset
+from metrics import LatencyHistogram, RunningStats, PhaseTimer, LiveCounters, NullCounterSlot
+from monitor import LiveReporter
 
-def get_document(batch, ident):
-    for i in batch:
-        if i._doc["_id"] == ident:
-            return i._doc
+# Per-process state of the persistent pool workers, filled in by _initPoolWorker
+_poolWorker = {}
+# Per-thread state of the pool workers, for objects that cannot be shared by threads
+_poolWorkerThread = threading.local()
+# Seconds a worker waits for the other workers at the start of a trial
+BARRIER_TIMEOUT = 120
 
+def _initPoolWorker(connString, barrier, liveCounters=None, numConnections=1):
+    """
+    Init Pool Worker
+
+    Pool initializer that opens the worker's connections once so they are reused across trials
+
+    :param connString:
+    :param barrier: shared by all workers of the pool to start each trial together
+    :param liveCounters: LiveCounters shared with the parent, or None
+    :param numConnections: the number of worker threads of the process, each of which needs a connection
+    :return:
+    """
+    clientRegistry.warmUp(connString, numConnections)
+    _poolWorker["barrier"] = barrier
+    _poolWorker["liveCounters"] = liveCounters
+
+def _waitForWorkers():
+    """
+    Wait For Workers
+
+    Waits on the barrier of the pool until all workers of the trial are ready to start timing. A
+    worker that died before reaching it would otherwise leave the others waiting forever.
+
+    :return:
+    """
+    barrier = _poolWorker["barrier"]
+    try:
+        barrier.wait(BARRIER_TIMEOUT)
+    except threading.BrokenBarrierError:
+        raise RuntimeError("Not all {} workers started the trial within {}s, a worker may have died".format(barrier.parties, BARRIER_TIMEOUT))
+
+def _runWorkerThreads(trial, testIdxs):
+    """
+    Run Worker Threads
+
+    Runs trial.runTestTrialThread for every testIdx on its own thread of this worker process. The
+    threads are kept for the following trials and share the process' MongoClient.
+
+    :param trial:
+    :param testIdxs:
+    :return: (the results of all threads, _workerConnectionsOpened of this process)
+    """
+    # tracemalloc traces the whole process, so its threads share one profile
+    if trial.profile == "tracemalloc":
+        return trial.runProfiled("pid" + str(os.getpid()), _runThreads, trial, testIdxs), _workerConnectionsOpened(trial.connString)
+    return _runThreads(trial, testIdxs), _workerConnectionsOpened(trial.connString)
+
+def _workerConnectionsOpened(connString):
+    """
+    Worker Connections Opened
+
+    :param connString:
+    :return: (process id, the number of connections this worker process has opened for connString
+              with its MongoClient and asyncio clients)
+    """
+    asyncCounters = _poolWorker.get("asyncConnectionCounters", {}).get(connString, [])
+    return os.getpid(), clientRegistry.connectionsOpened(connString) + sum(counter.connectionsOpened for counter in asyncCounters)
+
+def _runThreads(trial, testIdxs):
+    if len(testIdxs) == 1:
+        return [trial.runTestTrialThreadProfiled(testIdxs[0])]
+    executor = _poolWorker.get("executor")
+    if executor is None or _poolWorker["executorThreads"] < len(testIdxs):
+        if executor is not None:
+            executor.shutdown()
+        executor = ThreadPoolExecutor(max_workers=len(testIdxs))
+        _poolWorker["executor"] = executor
+        _poolWorker["executorThreads"] = len(testIdxs)
+    futures = [executor.submit(trial.runTestTrialThreadProfiled, testIdx) for testIdx in testIdxs]
+    return [future.result() for future in futures]
+
+# Bytes of an insert message kept free for the command and section headers
+MESSAGE_OVERHEAD_BYTES = 16 * 1024
+
+def _getServerLimits(client):
+    """
+    Get Server Limits
+
+    :param client:
+    :return: the maxBsonObjectSize, maxMessageSizeBytes and maxWriteBatchSize of the server,
+             fetched once per process
+    """
+    limits = _poolWorker.setdefault("serverLimits", {})
+    if id(client) not in limits:
+        try:
+            hello = client.admin.command("hello")
+        except pymongo.errors.OperationFailure:
+            hello = client.admin.command("isMaster")
+        limits[id(client)] = {
+            "maxBsonObjectSize"     : hello.get("maxBsonObjectSize", 16 * 1024 * 1024),
+            "maxMessageSizeBytes"   : hello.get("maxMessageSizeBytes", 48000000),
+            "maxWriteBatchSize"     : hello.get("maxWriteBatchSize", 100000)
+        }
+    return limits[id(client)]
+
+def _generateBatches(getDocuments, numDocs, maxCount, maxBytes, phases):
+    """
+    Generate Batches
+
+    Streams the documents 0 to numDocs - 1 into batches of at most maxCount documents and maxBytes
+    encoded bytes. Documents are created in chunks sized to the byte budget and encoded as they
+    arrive, so a worker holds at most about two batches worth of documents.
+
+    :param getDocuments: a function of (start, count) that returns documents
+    :param numDocs:
+    :param maxCount:
+    :param maxBytes:
+    :param phases: PhaseTimer that receives the generate and encode time, excluding the time the
+                   consumer spends on a batch
+    :return: yields (batch of RawBSONDocuments, encoded size of the batch in bytes)
+    """
+    batch = []
+    batchBytes = 0
+    chunkSize = 1
+    start = 0
+    while start < numDocs:
+        phaseStart = time.perf_counter()
+        chunk = getDocuments(start, min(chunkSize, numDocs - start))
+        phases.add("generate", time.perf_counter() - phaseStart)
+        if not chunk:
+            break
+        start += len(chunk)
+        phaseStart = time.perf_counter()
+        for doc in chunk:
+            if not isinstance(doc, RawBSONDocument):
+                doc = RawBSONDocument(bson.encode(doc))
+            docBytes = len(doc.raw)
+            if batch and (len(batch) >= maxCount or batchBytes + docBytes > maxBytes):
+                phases.add("encode", time.perf_counter() - phaseStart)
+                yield batch, batchBytes
+                phaseStart = time.perf_counter()
+                batch = []
+                batchBytes = 0
+            batch.append(doc)
+            batchBytes += docBytes
+        phases.add("encode", time.perf_counter() - phaseStart)
+        chunkSize = max(1, min(maxCount, int(maxBytes / max(docBytes, 1))))
+    if batch:
+        yield batch, batchBytes
+
+# Write error codes of transient failures, whose documents are inserted again
+RETRYABLE_WRITE_ERROR_CODES = frozenset((6, 7, 89, 91, 112, 189, 262, 9001, 10107, 11600, 11602, 13435, 13436))
+
+class RetryQueue():
+    """
+    Retry Queue
+
+    Documents of a worker whose insert failed with a retryable error. Each waits out an
+    exponential backoff of baseBackoff * 2^attempt seconds, capped at maxBackoff, before it can be
+    inserted again in a later batch, and is given up after maxRetries attempts.
+
+    Write errors are resolved to their documents by their index in the batch. A batch that fails
+    as a whole on a network error is not retried: the server may have committed part of it, and
+    the documents carry no _id, so a retry could insert duplicates. The driver already retries
+    such a write once when retryable writes are on.
+
+    counts holds the number of writeErrors, writeConcernErrors, connectionFailures, documents
+    retried, documents failed and retryBatches sent, codes the number of write errors by error code.
+    """
+    def __init__(self, maxRetries=3, baseBackoff=0.01, maxBackoff=1.0):
+        self.maxRetries     = maxRetries
+        self.baseBackoff    = baseBackoff
+        self.maxBackoff     = maxBackoff
+        self.heap           = []
+        self.sequence       = 0
+        self.counts         = collections.Counter()
+        self.codes          = collections.Counter()
+    def __len__(self):
+        return len(self.heap)
+    def add(self, doc, attempt):
+        """
+        Add
+
+        :param doc:
+        :param attempt: the number of times the document was retried before
+        :return:
+        """
+        if attempt >= self.maxRetries:
+            self.counts["failed"] += 1
+            return
+        readyTime = time.time() + min(self.baseBackoff * 2 ** attempt, self.maxBackoff)
+        # The sequence number keeps documents that are ready at the same time in order
+        heapq.heappush(self.heap, (readyTime, self.sequence, attempt + 1, doc))
+        self.sequence += 1
+        self.counts["retried"] += 1
+    def addBulkWriteError(self, batch, attempts, details):
+        """
+        Add Bulk Write Error
+
+        :param batch: the documents of the failed insert_many
+        :param attempts: the number of times each document of the batch was retried before
+        :param details: the details of the BulkWriteError
+        :return:
+        """
+        for error in details.get("writeErrors", []):
+            index = error["index"]
+            self.counts["writeErrors"] += 1
+            self.codes[error.get("code")] += 1
+            if error.get("code") in RETRYABLE_WRITE_ERROR_CODES:
+                self.add(batch[index], attempts[index])
+            else:
+                self.counts["failed"] += 1
+        # The documents were written, only the write concern was not satisfied
+        self.counts["writeConcernErrors"] += len(details.get("writeConcernErrors", []))
+    def addConnectionFailure(self, batch):
+        """
+        Add Connection Failure
+
+        Counts the documents of a batch whose insert_many failed as a whole on a network error as
+        failed, since whether they were written is unknown
+
+        :param batch:
+        :return:
+        """
+        self.counts["connectionFailures"] += 1
+        self.counts["failed"] += len(batch)
+    def takeReady(self, maxCount, maxBytes):
+        """
+        Take Ready
+
+        :param maxCount:
+        :param maxBytes:
+        :return: (batch of the documents whose backoff has passed, within maxCount documents and
+                  maxBytes encoded bytes, and their attempts)
+        """
+        batch = []
+        attempts = []
+        batchBytes = 0
+        now = time.time()
+        while self.heap and self.heap[0][0] <= now and len(batch) < maxCount:
+            docBytes = len(self.heap[0][3].raw)
+            if batch and batchBytes + docBytes > maxBytes:
+                break
+            readyTime, sequence, attempt, doc = heapq.heappop(self.heap)
+            batch.append(doc)
+            attempts.append(attempt)
+            batchBytes += docBytes
+        if batch:
+            self.counts["retryBatches"] += 1
+        return batch, attempts
+    def waitReady(self):
+        """
+        Wait Ready
+
+        Sleeps until the first queued document is ready
+
+        :return: the seconds slept
+        """
+        if not self.heap:
+            return 0.0
+        delay = self.heap[0][0] - time.time()
+        if delay <= 0:
+            return 0.0
+        time.sleep(delay)
+        return delay
+
+def _getAsyncClient(connString, concurrency):
+    """
+    Get Async Client
+
+    Returns the asyncio client of this worker thread, together with the event loop it is bound to. Both
+    are kept for the following trials. Uses pymongo's AsyncMongoClient when available and Motor
+    otherwise.
+
+    :param connString:
+    :param concurrency: the number of operations the client must be able to keep in flight
+    :return: (event loop, client)
+    """
+    # Event loops and the clients bound to them belong to a single thread
+    if not hasattr(_poolWorkerThread, "asyncLoop"):
+        _poolWorkerThread.asyncLoop = asyncio.new_event_loop()
+        _poolWorkerThread.asyncClients = {}
+    loop = _poolWorkerThread.asyncLoop
+    clients = _poolWorkerThread.asyncClients
+    if connString not in clients:
+        try:
+            from pymongo import AsyncMongoClient
+        except ImportError:
+            from motor.motor_asyncio import AsyncIOMotorClient as AsyncMongoClient
+
+        counter = ConnectionCounter()
+        async def connect():
+            client = AsyncMongoClient(connString, maxPoolSize=max(clientRegistry.maxPoolSize, concurrency), event_listeners=[counter])
+            await client.admin.command("ping")
+            return client
+        clients[connString] = loop.run_until_complete(connect())
+        _poolWorker.setdefault("asyncConnectionCounters", {}).setdefault(connString, []).append(counter)
+    return loop, clients[connString]
+
+async def _runConcurrently(operations, concurrency, latencies, phases, liveSlot):
+    """
+    Run Concurrently
+
+    Awaits the operations with up to concurrency of them in flight. Operations are taken from the
+    iterable only when a slot is free, so lazily generated operations stay bounded in memory.
+
+    :param operations: an iterable of functions returning an awaitable
+    :param concurrency:
+    :param latencies: histogram that receives the latency of every operation
+    :param phases: PhaseTimer that receives the error handling time
+    :param liveSlot: LiveCounterSlot that receives every operation and the number of documents it returns
+    :return:
+    """
+    semaphore = asyncio.Semaphore(concurrency)
+    tasks = set()
+
+    async def timed(operation):
+        startTime = time.time()
+        numDocs = 0
+        try:
+            numDocs = await operation()
+        except pymongo.errors.PyMongoError as e:
+            phaseStart = time.perf_counter()
+            print("Encountered error: {}".format(e))
+            phases.add("errors", time.perf_counter() - phaseStart)
+        finally:
+            latency = time.time() - startTime
+            latencies.record(latency)
+            liveSlot.record(numDocs, latency)
+            semaphore.release()
+
+    for operation in operations:
+        await semaphore.acquire()
+        task = asyncio.ensure_future(timed(operation))
+        tasks.add(task)
+        task.add_done_callback(tasks.discard)
+    await asyncio.gather(*tasks)
 
 class PerfTestTrial():
     """
@@ -23,152 +366,819 @@ class PerfTestTrial():
 
         """
         self.runTime = 0
+        self.latencies = LatencyHistogram()
+        self.phases = PhaseTimer()
+        self.numDocs = 0
         self.testName = "BasePerfTest"
         self.connString = connString
         self.dbName     = dbName
+        self.profile    = None
+        self.profilePath = None
+        self.liveCounters = None
     def runTestTrial(self):
         """
         :return:
         """
+    def runProfiled(self, name, function, *args):
+        """
+        Run Profiled
+
+        Runs function under the profiler selected in self.profile, cprofile or tracemalloc, and
+        writes the profile to a file named after profilePath and name. Without a profiler the
+        function is simply called.
+
+        :param name: the part of the file name that tells apart the profiles of a trial
+        :param function:
+        :return: the return value of function
+        """
+        if self.profile == "cprofile":
+            profiler = cProfile.Profile()
+            profiler.enable()
+            try:
+                return function(*args)
+            finally:
+                profiler.disable()
+                profiler.dump_stats("{}-{}.prof".format(self.profilePath, name))
+        if self.profile == "tracemalloc":
+            tracing = tracemalloc.is_tracing()
+            if not tracing:
+                tracemalloc.start()
+            try:
+                return function(*args)
+            finally:
+                tracemalloc.take_snapshot().dump("{}-{}.tracemalloc".format(self.profilePath, name))
+                if not tracing:
+                    tracemalloc.stop()
+        return function(*args)
+    def getLiveSlot(self, testIdx):
+        """
+        Get Live Slot
+
+        :param testIdx: "thread" followed by the index of the worker, or any other name for a trial run by the parent
+        :return: the LiveCounterSlot of the worker, or a NullCounterSlot if the test is not reported live
+        """
+        counters = self.liveCounters if self.liveCounters is not None else _poolWorker.get("liveCounters")
+        if counters is None:
+            return NullCounterSlot()
+        return counters.slot(int(testIdx[len("thread"):]) if testIdx.startswith("thread") else 0)
+
+class PooledPerfTestTrial(PerfTestTrial):
+    """
+    Pooled Perf Test Trial
+
+    A base class for trials that run runTestTrialThread on every worker of a PooledPerfTest pool.
+    numThreads workers run as threadsPerProcess threads in each of the pool's processes.
+    """
+    def __init__(self, connString, dbName, numThreads):
+        super().__init__(connString, dbName)
+        self.numThreads = numThreads
+        self.threadsPerProcess = 1
+        self.pool       = None
+        self.workerConnections = {}
+    def __getstate__(self):
+        # The pool only dispatches work from the parent process and cannot be sent to the workers,
+        # which get the live counters from the pool initializer instead
+        state = self.__dict__.copy()
+        state["pool"] = None
+        state["liveCounters"] = None
+        return state
+    def runTestTrialThread(self, testIdx):
+        """
+        Run Test Trial Thread
+
+        Runs in a worker of the pool and must call _waitForWorkers before timing starts
+
+        :param testIdx:
+        :return: (start time, end time, histogram of operation latencies, PhaseTimer)
+        """
+    def runTestTrialThreadProfiled(self, testIdx):
+        # cProfile only sees the thread it is enabled in, so every worker thread writes its own profile
+        if self.profile == "cprofile":
+            return self.runProfiled(testIdx, self.runTestTrialThread, testIdx)
+        return self.runTestTrialThread(testIdx)
+    def runTestTrialThreads(self):
+        """
+        Run Test Trial Threads
 
-class BulkInsertTestTrial(PerfTestTrial):
+        Runs runTestTrialThread on every worker and adds the timed window, from the barrier release
+        to the last worker finishing, to runTime. The connections opened so far by every worker
+        process are kept in workerConnections by process id.
+
+        :return: the results of all workers
+        """
+        testIdxs = ["thread" + str(i) for i in range(self.numThreads)]
+        futures = [self.pool.apply_async(_runWorkerThreads, (self, testIdxs[i:i + self.threadsPerProcess])) for i in range(0, self.numThreads, self.threadsPerProcess)]
+        # The task of a worker process that died never completes, so rather than waiting on every
+        # future in turn, fail as soon as any worker fails, e.g. on the broken barrier
+        while not all(future.ready() for future in futures):
+            for future in futures:
+                if future.ready() and not future.successful():
+                    future.get()
+            next(future for future in futures if not future.ready()).wait(0.1)
+        processResults = [future.get() for future in futures]
+        threadResults = [result for results, connections in processResults for result in results]
+        self.workerConnections = dict(connections for results, connections in processResults)
+        self.runTime += max(result[1] for result in threadResults) - min(result[0] for result in threadResults)
+        for result in threadResults:
+            self.latencies.merge(result[2])
+            self.phases.merge(result[3])
+        return threadResults
+
+class BulkInsertTestTrial(PooledPerfTestTrial):
     """
     Bulk Insert Test Trial
 
     A performance test that inserts many documents with a given batch size
+
+    If datasetDir is set, the documents are read from the files written by dataset.prepareDataset
+    instead of being created by the document provider during the trial.
+
+    Documents are streamed into batches capped by insertBatchSize documents and by maxBatchBytes
+    encoded bytes, which defaults to the server's maxBsonObjectSize. Neither cap exceeds the
+    server's maxWriteBatchSize and maxMessageSizeBytes.
+
+    Inserts use writeConcern, a dict of WriteConcern arguments that defaults to w=1. Documents
+    that fail with a retryable error are retried up to maxRetries times.
+
+    The collection is created with the index of DocumentProvider.getIndex(), or with indexes, a
+    list of (kind, keys) of DocumentProvider.getIndexes(), if it is given.
     """
-    def __init__(self, connString, dbName, numThreads, numDocsToInsert, insertBatchSize, documentProvider):
-        super().__init__(connString, dbName)
+    def __init__(self, connString, dbName, numThreads, numDocsToInsert, insertBatchSize, documentProvider, datasetDir=None, maxBatchBytes=None, writeConcern=None, maxRetries=3, indexes=None):
+        super().__init__(connString, dbName, numThreads)
         self.testName           = "BulkInsert"
         self.collName           = self.testName.lower() + "." + documentProvider.__class__.__name__.lower()
-        self.numThreads         = numThreads
         self.numDocsToInsert    = numDocsToInsert
         self.insertBatchSize    = insertBatchSize
         self.documentProvider   = documentProvider
+        self.datasetDir         = datasetDir
+        self.maxBatchBytes      = maxBatchBytes
+        self.writeConcern       = writeConcern or {"w": 1}
+        self.maxRetries         = maxRetries
+        self.indexes            = indexes
+        self.batchDocs          = RunningStats()
+        self.batchBytes         = RunningStats()
+        self.errorCounts        = collections.Counter()
+        self.errorCodes         = collections.Counter()
+    def getDocumentSource(self, testIdx):
+        """
+        Get Document Source
+
+        :param testIdx:
+        :return: a function of (start, count) that returns the documents of a batch
+        """
+        if self.datasetDir is None:
+            return lambda start, count: self.documentProvider.createDocuments(testIdx, start, count)
+
+        # Each worker maps its dataset once and keeps it for the following trials
+        path = datasetPath(self.datasetDir, self.documentProvider, testIdx)
+        datasets = _poolWorker.setdefault("datasets", {})
+        if path not in datasets:
+            datasets[path] = MappedDataset(path)
+        if len(datasets[path]) < self.numDocsToInsert:
+            raise ValueError("Dataset {} holds {} documents but {} are needed, prepare it again".format(path, len(datasets[path]), self.numDocsToInsert))
+        return datasets[path].getDocuments
     def runTestTrialThread(self, testIdx):
+        """
+        Run Test Trial Thread
+
+        Runs in a worker of the BulkInsertTest pool. All workers wait on the shared barrier so
+        the inserts of every worker start together.
+
+        Documents that fail with a retryable error are inserted again in later batches of their
+        own, once their backoff has passed. Waiting for the backoff of the last retries is not
+        counted in the timed window.
+
+        :param testIdx:
+        :return: (start time, end time, histogram of insert_many latencies, PhaseTimer,
+                  stats of documents per batch, stats of bytes per batch, error counts, error codes)
+        """
         # Perform inserts
-        batch = []
-        errors = []
-        runTime = 0
-        client = pymongo.MongoClient(self.connString)
+        retryQueue = RetryQueue(self.maxRetries)
+        latencies = LatencyHistogram()
+        phases = PhaseTimer()
+        liveSlot = self.getLiveSlot(testIdx)
+        batchDocs = RunningStats()
+        batchBytes = RunningStats()
+        client = clientRegistry.getClient(self.connString)
         mongoColl = client[self.dbName][self.collName].with_options(
-            write_concern=pymongo.write_concern.WriteConcern(w=1)
+            write_concern=pymongo.write_concern.WriteConcern(**self.writeConcern)
         )
-        for i in range(0, self.numDocsToInsert):
-            batch.append(pymongo.InsertOne(self.documentProvider.createDocument(testIdx, i)))
-
-            if i % self.insertBatchSize == 0:
-                startTime = time.time()
-                try:
-                    mongoColl.bulk_write(batch, ordered=False)
-                except pymongo.errors.BulkWriteError as e:
-                    for x in e.details[u'writeErrors']:
-                        error_id = x[u'op']['_id']
-                        errors.append(get_document(batch, error_id))
-                runTime += (time.time() - startTime)
-                batch = []
+        getDocuments = self.getDocumentSource(testIdx)
+        limits = _getServerLimits(client)
+        maxCount = min(self.insertBatchSize, limits["maxWriteBatchSize"])
+        maxBytes = min(self.maxBatchBytes or limits["maxBsonObjectSize"], limits["maxMessageSizeBytes"] - MESSAGE_OVERHEAD_BYTES)
+        _waitForWorkers()
+        trialStartTime = time.time()
+        for batch, numBytes in _generateBatches(getDocuments, self.numDocsToInsert, maxCount, maxBytes, phases):
+            batchDocs.record(len(batch))
+            batchBytes.record(numBytes)
+            self.insertBatch(mongoColl, batch, [0] * len(batch), retryQueue, latencies, phases, liveSlot)
+            # Retries whose backoff has passed go out between the generated batches
+            while True:
+                retryBatch, attempts = retryQueue.takeReady(maxCount, maxBytes)
+                if not retryBatch:
+                    break
+                self.insertBatch(mongoColl, retryBatch, attempts, retryQueue, latencies, phases, liveSlot)
+        backoffTime = 0.0
+        while retryQueue:
+            backoffTime += retryQueue.waitReady()
+            retryBatch, attempts = retryQueue.takeReady(maxCount, maxBytes)
+            self.insertBatch(mongoColl, retryBatch, attempts, retryQueue, latencies, phases, liveSlot)
+        phases.add("backoff", backoffTime)
+        return (trialStartTime, time.time() - backoffTime, latencies, phases, batchDocs, batchBytes, retryQueue.counts, retryQueue.codes)
+    def insertBatch(self, mongoColl, batch, attempts, retryQueue, latencies, phases, liveSlot):
+        """
+        Insert Batch
+
+        Inserts a batch and queues the documents that failed with a retryable error for a retry
+
+        :param mongoColl:
+        :param batch:
+        :param attempts: the number of times each document of the batch was retried before
+        :param retryQueue:
+        :param latencies:
+        :param phases:
+        :param liveSlot:
+        :return:
+        """
         startTime = time.time()
+        phaseStart = time.perf_counter()
         try:
-            mongoColl.bulk_write(batch, ordered=False)
+            mongoColl.insert_many(batch, ordered=False)
+            phases.add("send", time.perf_counter() - phaseStart)
         except pymongo.errors.BulkWriteError as e:
-            for x in e.details[u'writeErrors']:
-                error_id = x[u'op']['_id']
-                errors.append(get_document(batch, error_id))
-        runTime += (time.time() - startTime)
-        batch = []
-        return runTime
+            errorStart = time.perf_counter()
+            phases.add("send", errorStart - phaseStart)
+            retryQueue.addBulkWriteError(batch, attempts, e.details)
+            phases.add("errors", time.perf_counter() - errorStart)
+        except pymongo.errors.ConnectionFailure:
+            errorStart = time.perf_counter()
+            phases.add("send", errorStart - phaseStart)
+            retryQueue.addConnectionFailure(batch)
+            phases.add("errors", time.perf_counter() - errorStart)
+        latency = time.time() - startTime
+        latencies.record(latency)
+        liveSlot.record(len(batch), latency)
     def runTestTrial(self):
-        mongoClient = pymongo.MongoClient(self.connString)
+        # The collection is set up with acknowledged writes whatever the write concern of the inserts
+        mongoClient = clientRegistry.getClient(self.connString)
         coll = mongoClient[self.dbName][self.collName].with_options(
             write_concern=pymongo.write_concern.WriteConcern(w=1)
         )
 
         # Drop collection if it already exists
         coll.drop()
-        coll.create_index(self.documentProvider.getIndex(), name="myIndex")
+        if self.indexes is None:
+            coll.create_index(self.documentProvider.getIndex(), name="myIndex")
+        else:
+            for kind, keys in self.indexes:
+                coll.create_index(keys)
 
-        startTime = time.time()
-        with Pool(processes=self.numThreads) as pool:
-            bulkInsertFutures = [pool.apply_async(self.runTestTrialThread, ("thread" + str(i),)) for i in range(self.numThreads)]
-            #for bulkInsertFuture in bulkInsertFutures:
-                # print("Thread runtime: {} ".format(bulkInsertFuture.result()))
-            #    bulkInsertFuture.get()
-            pool.close()
-            pool.join()
-        self.runTime += (time.time() - startTime)
-            # print("--------- {} Ran in {} seconds ---------".format(self.testName, str(self.runTime)))
-
-class SingleInsertTestTrial(PerfTestTrial):
+        # The timed window runs from the barrier release to the last worker finishing its inserts
+        for result in self.runTestTrialThreads():
+            self.batchDocs.merge(result[4])
+            self.batchBytes.merge(result[5])
+            self.errorCounts.update(result[6])
+            self.errorCodes.update(result[7])
+        # Documents that were given up on are not counted as inserted
+        self.numDocs += self.numThreads * self.numDocsToInsert - self.errorCounts["failed"]
+
+class RangeScanTestTrial(PerfTestTrial):
     """
-    Single Insert Test Trial
+    Range Scan Test Trial
+
+    Drains the cursor of a bounded range query over count nums from matchNum, in getMore batches
+    of batchSize documents, with an optional projection and limit. Documents are read as
+    RawBSONDocuments, so the trial measures the scan and transfer rather than decoding, and the
+    bytes read are the encoded size of the documents.
     """
-    def __init__(self, connString, dbName, documentProvider):
+    def __init__(self, connString, dbName, documentProvider, matchNum, count, batchSize=0, projection=None, limit=0):
         super().__init__(connString, dbName)
-        self.testName = "SingleInsert"
+        self.testName = "RangeScanTest"
         self.documentProvider = documentProvider
-        self.collName = self.testName.lower() + "." + documentProvider.__class__.__name__.lower()
+        self.collName = "bulkinsert." + documentProvider.__class__.__name__.lower()
+        self.matchNum = matchNum
+        self.count = count
+        self.batchSize = batchSize
+        self.projection = projection
+        self.limit = limit
+        self.numBytes = 0
     def runTestTrial(self):
-        # Drop collection if it already exists
-        mongoClient = pymongo.MongoClient(self.connString)
+        mongoClient = clientRegistry.getClient(self.connString)
         coll = mongoClient[self.dbName][self.collName].with_options(
-            write_concern=pymongo.write_concern.WriteConcern(w=1)
+            codec_options=CodecOptions(document_class=RawBSONDocument)
         )
-        coll.drop()
-        coll.create_index(self.documentProvider.getIndex(), name="myIndex")
 
-        # Perform inserts
         startTime = time.time()
+        phaseStart = time.perf_counter()
+        criteria = self.documentProvider.getBoundedRangeMatchingCriteria("test0", self.matchNum, self.count)
+        sendStart = time.perf_counter()
+        self.phases.add("generate", sendStart - phaseStart)
+        numDocs = 0
         try:
-            coll.insert_one(self.documentProvider.createDocument("test0", 1))
-        except pymongo.errors.WriteError as e:
-            print("Encountered write error: {}".format(e))
-        self.runTime += (time.time() - startTime)
+            for doc in coll.find(criteria, self.projection, batch_size=self.batchSize, limit=self.limit):
+                numDocs += 1
+                self.numBytes += len(doc.raw)
+            self.phases.add("send", time.perf_counter() - sendStart)
+        except pymongo.errors.OperationFailure as e:
+            errorStart = time.perf_counter()
+            self.phases.add("send", errorStart - sendStart)
+            print("Encountered error: {}".format(e))
+            self.phases.add("errors", time.perf_counter() - errorStart)
+        latency = time.time() - startTime
+        self.runTime += latency
+        self.latencies.record(latency)
+        self.getLiveSlot("main").record(numDocs, latency)
+        self.numDocs += numDocs
 
-class EqualityQueryTestTrial(PerfTestTrial):
+class IndexBuildTestTrial(PerfTestTrial):
     """
-    Equality Query Test Trial
+    Index Build Test Trial
+
+    Times a create_index of keys on the collection filled by BulkInsertTest, and drops the index
+    again outside the timed window. Indexes already on keys, such as the one BulkInsertTest
+    creates, are dropped before the build and restored after it, since the server refuses a
+    second index on the same keys. A build that fails is not recorded.
     """
-    def __init__(self, connString, dbName, documentProvider, matchNum):
+    def __init__(self, connString, dbName, documentProvider, keys):
         super().__init__(connString, dbName)
-        self.testName = "EqualityQueryTest"
-        self.documentProvider = documentProvider
-        self.collName = BulkInsertTestTrial.__name__.lower() + "." + documentProvider.__class__.__name__.lower()
-        self.matchNum = matchNum
+        self.testName = "IndexBuildTest"
+        self.collName = "bulkinsert." + documentProvider.__class__.__name__.lower()
+        self.keys = keys
     def runTestTrial(self):
-        mongoClient = pymongo.MongoClient(self.connString)
-        coll = mongoClient[self.dbName][self.collName].with_options(
+        mongoClient = clientRegistry.getClient(self.connString)
+        coll = mongoClient[self.dbName][self.collName]
+        indexName = "indexBuild"
+        # An index left behind by an interrupted run would make create_index return at once
+        if indexName in coll.index_information():
+            coll.drop_index(indexName)
+        sameKeyIndexes = dict((name, info) for name, info in coll.index_information().items()
+                              if name != "_id_" and [(field, direction) for field, direction in info["key"]] == list(self.keys))
+        for name in sameKeyIndexes:
+            coll.drop_index(name)
+        numDocs = coll.estimated_document_count()
+
+        try:
+            startTime = time.time()
+            phaseStart = time.perf_counter()
+            try:
+                coll.create_index(self.keys, name=indexName)
+            except pymongo.errors.OperationFailure as e:
+                errorStart = time.perf_counter()
+                self.phases.add("errors", errorStart - phaseStart)
+                print("Encountered error: {}".format(e))
+                return
+            self.phases.add("send", time.perf_counter() - phaseStart)
+            latency = time.time() - startTime
+            self.runTime += latency
+            self.latencies.record(latency)
+            self.getLiveSlot("main").record(numDocs, latency)
+            self.numDocs += numDocs
+        finally:
+            if indexName in coll.index_information():
+                coll.drop_index(indexName)
+            for name, info in sameKeyIndexes.items():
+                options = dict((option, value) for option, value in info.items() if option not in ("key", "v", "ns"))
+                coll.create_index(info["key"], name=name, **options)
+
+class OperationTestTrial(PooledPerfTestTrial):
+    """
+    Operation Test Trial
+
+    A base class for pooled trials that issue individual inserts, equality queries and ranged
+    queries built by a DocumentProvider. Queries target the collection filled by BulkInsertTest.
+    """
+    OPERATIONS = ("insert", "eqQuery", "rangeQuery")
+
+    def __init__(self, connString, dbName, numThreads, documentProvider, collSize):
+        super().__init__(connString, dbName, numThreads)
+        self.documentProvider   = documentProvider
+        self.collSize           = max(collSize, 1)
+    def buildOperation(self, coll, operation, testIdx, num, phases):
+        """
+        Build Operation
+
+        Creates the document or query criteria of an operation, adding the time taken to the
+        generate and encode phases
+
+        :param coll:
+        :param operation: one of OPERATIONS
+        :param testIdx:
+        :param num:
+        :param phases: PhaseTimer of the worker
+        :return: (the collection method to call, its argument)
+        """
+        phaseStart = time.perf_counter()
+        if operation == "insert":
+            doc = self.documentProvider.createDocument(testIdx, num)
+            encodeStart = time.perf_counter()
+            phases.add("generate", encodeStart - phaseStart)
+            if not isinstance(doc, RawBSONDocument):
+                doc = RawBSONDocument(bson.encode(doc))
+            phases.add("encode", time.perf_counter() - encodeStart)
+            return coll.insert_one, doc
+        if operation == "eqQuery":
+            criteria = self.documentProvider.getEqMatchingCriteria("test0", (num*1000+10) % self.collSize)
+        else:
+            criteria = self.documentProvider.getRangeMatchingCriteria("test0", (num*1000+10) % self.collSize)
+        phases.add("generate", time.perf_counter() - phaseStart)
+        return coll.find_one, criteria
+    def runOperation(self, coll, operation, testIdx, num, phases):
+        send, request = self.buildOperation(coll, operation, testIdx, num, phases)
+        phaseStart = time.perf_counter()
+        try:
+            send(request)
+        finally:
+            phases.add("send", time.perf_counter() - phaseStart)
+    async def runOperationAsync(self, coll, operation, testIdx, num, phases):
+        # Operations overlap, so the caller accounts for the time spent awaiting them
+        send, request = self.buildOperation(coll, operation, testIdx, num, phases)
+        await send(request)
+        return 1
+
+class OpenLoopTestTrial(OperationTestTrial):
+    """
+    Open Loop Test Trial
+
+    Offers operations at a fixed target rate regardless of how fast the server responds. Every
+    operation has an intended send time on a schedule shared by all workers, and its latency is
+    measured from that time, so queueing delay under saturation is not hidden by the load backing off.
+    """
+    def __init__(self, connString, dbName, numThreads, targetOpsPerSec, duration, operation, documentProvider, collSize):
+        super().__init__(connString, dbName, numThreads, documentProvider, collSize)
+        self.testName           = "OpenLoop"
+        self.targetOpsPerSec    = targetOpsPerSec
+        self.duration           = duration
+        self.operation          = operation
+        if operation == "insert":
+            self.collName = self.testName.lower() + "." + documentProvider.__class__.__name__.lower()
+        else:
+            self.collName = "bulkinsert." + documentProvider.__class__.__name__.lower()
+    def runTestTrialThread(self, testIdx):
+        client = clientRegistry.getClient(self.connString)
+        coll = client[self.dbName][self.collName].with_options(
             write_concern=pymongo.write_concern.WriteConcern(w=1)
         )
+        workerIdx = int(testIdx[len("thread"):])
+        interval = self.numThreads / self.targetOpsPerSec
+        numOps = int(self.duration * self.targetOpsPerSec / self.numThreads)
+        latencies = LatencyHistogram()
+        phases = PhaseTimer()
+        liveSlot = self.getLiveSlot(testIdx)
+
+        _waitForWorkers()
+        trialStartTime = time.time()
+        # Workers interleave their slots so the combined schedule is evenly spaced
+        scheduleStartTime = trialStartTime + workerIdx / self.targetOpsPerSec
+        for k in range(0, numOps):
+            intendedTime = scheduleStartTime + k * interval
+            delay = intendedTime - time.time()
+            if delay > 0:
+                time.sleep(delay)
+                phases.add("idle", delay)
+            try:
+                self.runOperation(coll, self.operation, testIdx, k * self.numThreads + workerIdx, phases)
+            except pymongo.errors.PyMongoError as e:
+                phaseStart = time.perf_counter()
+                print("Encountered error: {}".format(e))
+                phases.add("errors", time.perf_counter() - phaseStart)
+            latency = time.time() - intendedTime
+            latencies.record(latency)
+            liveSlot.record(1, latency)
+        return (trialStartTime, time.time(), latencies, phases)
+    def runTestTrial(self):
+        if self.operation == "insert":
+            coll = clientRegistry.getClient(self.connString)[self.dbName][self.collName]
+            coll.drop()
+            coll.create_index(self.documentProvider.getIndex(), name="myIndex")
+
+        self.runTestTrialThreads()
+        self.numDocs += self.latencies.count
+
+class MixedWorkloadTestTrial(OperationTestTrial):
+    """
+    Mixed Workload Test Trial
+
+    Runs inserts, equality queries and ranged queries at the same time against the collection
+    filled by BulkInsertTest. Each worker draws its sequence of operations from the mix weights
+    with a generator seeded by the worker, so every trial offers the same sequence. The nums of
+    every trial follow those of the trial before, so inserts do not repeat the ids of earlier trials.
+    """
+    def __init__(self, connString, dbName, numThreads, numOpsPerThread, mix, trialIdx, documentProvider, collSize):
+        super().__init__(connString, dbName, numThreads, documentProvider, collSize)
+        self.testName           = "MixedWorkload"
+        self.collName           = "bulkinsert." + documentProvider.__class__.__name__.lower()
+        self.numOpsPerThread    = numOpsPerThread
+        self.mix                = mix
+        self.trialIdx           = trialIdx
+        self.opLatencies        = dict((operation, LatencyHistogram()) for operation in self.OPERATIONS)
+    def runTestTrialThread(self, testIdx):
+        """
+        Run Test Trial Thread
+
+        :param testIdx:
+        :return: (start time, end time, histogram of all latencies, PhaseTimer, histograms by operation)
+        """
+        client = clientRegistry.getClient(self.connString)
+        coll = client[self.dbName][self.collName].with_options(
+            write_concern=pymongo.write_concern.WriteConcern(w=1)
+        )
+        operations = random.Random(testIdx).choices(self.OPERATIONS, weights=self.mix, k=self.numOpsPerThread)
+        latencies = LatencyHistogram()
+        opLatencies = dict((operation, LatencyHistogram()) for operation in self.OPERATIONS)
+        phases = PhaseTimer()
+        liveSlot = self.getLiveSlot(testIdx)
+
+        firstNum = self.trialIdx * self.numOpsPerThread
 
+        _waitForWorkers()
+        trialStartTime = time.time()
+        for i, operation in enumerate(operations):
+            startTime = time.time()
+            try:
+                self.runOperation(coll, operation, "mixed" + testIdx, firstNum + i, phases)
+            except pymongo.errors.PyMongoError as e:
+                phaseStart = time.perf_counter()
+                print("Encountered error: {}".format(e))
+                phases.add("errors", time.perf_counter() - phaseStart)
+            latency = time.time() - startTime
+            latencies.record(latency)
+            opLatencies[operation].record(latency)
+            liveSlot.record(1, latency)
+        return (trialStartTime, time.time(), latencies, phases, opLatencies)
+    def runTestTrial(self):
+        for result in self.runTestTrialThreads():
+            for operation, latencies in result[4].items():
+                self.opLatencies[operation].merge(latencies)
+        self.numDocs += self.latencies.count
+
+class SingleOperationTestTrial(OperationTestTrial):
+    """
+    Single Operation Test Trial
+
+    A base class for trials in which every worker sends a single operation. The num of a worker is
+    trialIdx * numThreads plus its index, so every worker of every trial sends a different one.
+    """
+    def __init__(self, connString, dbName, numThreads, operation, trialIdx, documentProvider, collSize):
+        super().__init__(connString, dbName, numThreads, documentProvider, collSize)
+        self.operation  = operation
+        self.trialIdx   = trialIdx
+    def runTestTrialThread(self, testIdx):
+        client = clientRegistry.getClient(self.connString)
+        coll = client[self.dbName][self.collName].with_options(
+            write_concern=pymongo.write_concern.WriteConcern(w=1)
+        )
+        workerIdx = int(testIdx[len("thread"):])
+        latencies = LatencyHistogram()
+        phases = PhaseTimer()
+        liveSlot = self.getLiveSlot(testIdx)
+
+        _waitForWorkers()
         startTime = time.time()
         try:
-            coll.find_one(self.documentProvider.getEqMatchingCriteria("test0", self.matchNum))
+            self.runOperation(coll, self.operation, testIdx, self.trialIdx * self.numThreads + workerIdx, phases)
         except pymongo.errors.WriteError as e:
+            phaseStart = time.perf_counter()
             print("Encountered write error: {}".format(e))
-        self.runTime += (time.time() - startTime)
+            phases.add("errors", time.perf_counter() - phaseStart)
+        latency = time.time() - startTime
+        latencies.record(latency)
+        liveSlot.record(1, latency)
+        return (startTime, time.time(), latencies, phases)
+    def runTestTrial(self):
+        self.runTestTrialThreads()
+        self.numDocs += self.latencies.count
+
+class SingleInsertTestTrial(SingleOperationTestTrial):
+    """
+    Single Insert Test Trial
+    """
+    def __init__(self, connString, dbName, numThreads, trialIdx, documentProvider):
+        super().__init__(connString, dbName, numThreads, "insert", trialIdx, documentProvider, 1)
+        self.testName = "SingleInsert"
+        self.collName = self.testName.lower() + "." + documentProvider.__class__.__name__.lower()
+    def runTestTrial(self):
+        # Drop collection if it already exists
+        coll = clientRegistry.getClient(self.connString)[self.dbName][self.collName]
+        coll.drop()
+        coll.create_index(self.documentProvider.getIndex(), name="myIndex")
+
+        super().runTestTrial()
+
+class EqualityQueryTestTrial(SingleOperationTestTrial):
+    """
+    Equality Query Test Trial
+    """
+    def __init__(self, connString, dbName, numThreads, trialIdx, documentProvider, collSize):
+        super().__init__(connString, dbName, numThreads, "eqQuery", trialIdx, documentProvider, collSize)
+        self.testName = "EqualityQueryTest"
+        self.collName = "bulkinsert." + documentProvider.__class__.__name__.lower()
 
-class RangedQueryTestTrial(PerfTestTrial):
+class RangedQueryTestTrial(SingleOperationTestTrial):
     """
     Ranged Query Test Trial
     """
-    def __init__(self, connString, dbName, documentProvider, matchNum):
-        super().__init__(connString, dbName)
+    def __init__(self, connString, dbName, numThreads, trialIdx, documentProvider, collSize):
+        super().__init__(connString, dbName, numThreads, "rangeQuery", trialIdx, documentProvider, collSize)
         self.testName = "RangedQueryTest"
-        self.documentProvider = documentProvider
-        self.collName = BulkInsertTestTrial.__name__.lower() + "." + documentProvider.__class__.__name__.lower()
-        self.matchNum = matchNum
-    def runTestTrial(self):
-        mongoClient = pymongo.MongoClient(self.connString)
-        coll = mongoClient[self.dbName][self.collName].with_options(
-            write_concern=pymongo.write_concern.WriteConcern(w=1)
+        self.collName = "bulkinsert." + documentProvider.__class__.__name__.lower()
+
+class AsyncBulkInsertTestTrial(BulkInsertTestTrial):
+    """
+    Async Bulk Insert Test Trial
+
+    A BulkInsertTestTrial whose workers use an asyncio driver and keep up to concurrency
+    insert_many calls in flight
+    """
+    def __init__(self, connString, dbName, numThreads, numDocsToInsert, insertBatchSize, documentProvider, concurrency, datasetDir=None, maxBatchBytes=None, writeConcern=None, maxRetries=3, indexes=None):
+        super().__init__(connString, dbName, numThreads, numDocsToInsert, insertBatchSize, documentProvider, datasetDir, maxBatchBytes, writeConcern, maxRetries, indexes)
+        self.testName       = "AsyncBulkInsert"
+        self.concurrency    = concurrency
+    def runTestTrialThread(self, testIdx):
+        retryQueue = RetryQueue(self.maxRetries)
+        latencies = LatencyHistogram()
+        phases = PhaseTimer()
+        batchDocs = RunningStats()
+        batchBytes = RunningStats()
+        liveSlot = self.getLiveSlot(testIdx)
+        loop, client = _getAsyncClient(self.connString, self.concurrency)
+        mongoColl = client[self.dbName][self.collName].with_options(
+            write_concern=pymongo.write_concern.WriteConcern(**self.writeConcern)
         )
+        getDocuments = self.getDocumentSource(testIdx)
+        limits = _getServerLimits(clientRegistry.getClient(self.connString))
+        maxCount = min(self.insertBatchSize, limits["maxWriteBatchSize"])
+        maxBytes = min(self.maxBatchBytes or limits["maxBsonObjectSize"], limits["maxMessageSizeBytes"] - MESSAGE_OVERHEAD_BYTES)
 
-        startTime = time.time()
+        def readyRetries():
+            while True:
+                retryBatch, attempts = retryQueue.takeReady(maxCount, maxBytes)
+                if not retryBatch:
+                    break
+                yield lambda batch=retryBatch, attempts=attempts: self.insertBatch(mongoColl, batch, attempts, retryQueue)
+
+        def insertOperations():
+            for batch, numBytes in _generateBatches(getDocuments, self.numDocsToInsert, maxCount, maxBytes, phases):
+                batchDocs.record(len(batch))
+                batchBytes.record(numBytes)
+                yield lambda batch=batch: self.insertBatch(mongoColl, batch, [0] * len(batch), retryQueue)
+                yield from readyRetries()
+
+        _waitForWorkers()
+        trialStartTime = time.time()
+        loop.run_until_complete(_runConcurrently(insertOperations(), self.concurrency, latencies, phases, liveSlot))
+        # Retries still waiting for their backoff go out in rounds, without the wait in the timed window
+        backoffTime = 0.0
+        while retryQueue:
+            backoffTime += retryQueue.waitReady()
+            loop.run_until_complete(_runConcurrently(readyRetries(), self.concurrency, latencies, phases, liveSlot))
+        trialEndTime = time.time() - backoffTime
+        # Inserts overlap, so the time the loop spends awaiting them is what the other phases leave of the trial
+        phases.add("send", trialEndTime - trialStartTime - phases.total())
+        phases.add("backoff", backoffTime)
+        return (trialStartTime, trialEndTime, latencies, phases, batchDocs, batchBytes, retryQueue.counts, retryQueue.codes)
+    async def insertBatch(self, mongoColl, batch, attempts, retryQueue):
         try:
-            coll.find_one(self.documentProvider.getRangeMatchingCriteria("test0", self.matchNum))
-        except pymongo.errors.WriteError as e:
-            print("Encountered write error: {}".format(e))
-        self.runTime += (time.time() - startTime)
+            await mongoColl.insert_many(batch, ordered=False)
+        except pymongo.errors.BulkWriteError as e:
+            # Write errors such as duplicate keys are tolerated, transient ones retried, as in BulkInsertTestTrial
+            retryQueue.addBulkWriteError(batch, attempts, e.details)
+        except pymongo.errors.ConnectionFailure:
+            retryQueue.addConnectionFailure(batch)
+        return len(batch)
+
+class AsyncQueryTestTrial(OperationTestTrial):
+    """
+    Async Query Test Trial
+
+    Issues concurrency equality or ranged queries from every worker with an asyncio driver, all of
+    them in flight at the same time. With a concurrency of 1 and a single worker this is the same
+    measurement as EqualityQueryTestTrial or RangedQueryTestTrial.
+    """
+    def __init__(self, connString, dbName, numThreads, operation, concurrency, trialIdx, documentProvider, collSize):
+        super().__init__(connString, dbName, numThreads, documentProvider, collSize)
+        self.testName       = "AsyncQuery"
+        self.collName       = "bulkinsert." + documentProvider.__class__.__name__.lower()
+        self.operation      = operation
+        self.concurrency    = concurrency
+        self.trialIdx       = trialIdx
+    def runTestTrialThread(self, testIdx):
+        latencies = LatencyHistogram()
+        phases = PhaseTimer()
+        loop, client = _getAsyncClient(self.connString, self.concurrency)
+        coll = client[self.dbName][self.collName]
+        workerIdx = int(testIdx[len("thread"):])
+        firstNum = (self.trialIdx * self.numThreads + workerIdx) * self.concurrency
+        operations = (lambda num=num: self.runOperationAsync(coll, self.operation, "test0", num, phases) for num in range(firstNum, firstNum + self.concurrency))
+
+        _waitForWorkers()
+        trialStartTime = time.time()
+        loop.run_until_complete(_runConcurrently(operations, self.concurrency, latencies, phases, self.getLiveSlot(testIdx)))
+        trialEndTime = time.time()
+        phases.add("send", trialEndTime - trialStartTime - phases.total())
+        return (trialStartTime, trialEndTime, latencies, phases)
+    def runTestTrial(self):
+        self.runTestTrialThreads()
+        self.numDocs += self.latencies.count
+
+class BulkWriteTestTrial(PooledPerfTestTrial):
+    """
+    Bulk Write Test Trial
+
+    Sends UpdateOne, UpdateMany, upserting UpdateOne or DeleteOne requests, batchSize to a
+    bulk_write, from every worker against the collection filled by BulkInsertTest. Requests match
+    documents with getEqMatchingCriteria() of the DocumentProvider and apply its getUpdate() or
+    getUpsert(). The workers of every trial take consecutive, disjoint ranges of numOpsPerThread
+    nums, wrapping around at valueRange, the nums inserted by each bulk insert worker, so every
+    request matches a document the bulk insert test inserted.
+    """
+    OPERATIONS = ("updateOne", "updateMany", "upsert", "deleteOne")
+
+    def __init__(self, connString, dbName, numThreads, numOpsPerThread, batchSize, operation, trialIdx, documentProvider, valueRange, writeConcern=None):
+        super().__init__(connString, dbName, numThreads)
+        self.testName           = "BulkWrite"
+        self.collName           = "bulkinsert." + documentProvider.__class__.__name__.lower()
+        self.numOpsPerThread    = numOpsPerThread
+        self.batchSize          = batchSize
+        self.operation          = operation
+        self.trialIdx           = trialIdx
+        self.documentProvider   = documentProvider
+        self.valueRange         = max(valueRange, 1)
+        self.writeConcern       = writeConcern or {"w": 1}
+        self.writeCounts        = collections.Counter()
+    def buildRequest(self, testIdx, num):
+        """
+        Build Request
+
+        :param testIdx:
+        :param num:
+        :return: the bulk write request of operation for num
+        """
+        if self.operation == "upsert":
+            criteria, update = self.documentProvider.getUpsert(testIdx, num)
+            return pymongo.UpdateOne(criteria, update, upsert=True)
+        criteria = self.documentProvider.getEqMatchingCriteria(testIdx, num)
+        if self.operation == "updateOne":
+            return pymongo.UpdateOne(criteria, self.documentProvider.getUpdate(testIdx, num))
+        if self.operation == "updateMany":
+            return pymongo.UpdateMany(criteria, self.documentProvider.getUpdate(testIdx, num))
+        return pymongo.DeleteOne(criteria)
+    def runTestTrialThread(self, testIdx):
+        """
+        Run Test Trial Thread
+
+        :param testIdx:
+        :return: (start time, end time, histogram of bulk_write latencies, PhaseTimer, counts of
+                  the documents matched, modified, upserted and deleted and of write errors)
+        """
+        client = clientRegistry.getClient(self.connString)
+        coll = client[self.dbName][self.collName].with_options(
+            write_concern=pymongo.write_concern.WriteConcern(**self.writeConcern)
+        )
+        workerIdx = int(testIdx[len("thread"):])
+        firstNum = (self.trialIdx * self.numThreads + workerIdx) * self.numOpsPerThread
+        latencies = LatencyHistogram()
+        phases = PhaseTimer()
+        writeCounts = collections.Counter()
+        liveSlot = self.getLiveSlot(testIdx)
+
+        _waitForWorkers()
+        trialStartTime = time.time()
+        for start in range(firstNum, firstNum + self.numOpsPerThread, self.batchSize):
+            phaseStart = time.perf_counter()
+            requests = [self.buildRequest(testIdx, num % self.valueRange)
+                        for num in range(start, min(start + self.batchSize, firstNum + self.numOpsPerThread))]
+            phases.add("generate", time.perf_counter() - phaseStart)
+
+            startTime = time.time()
+            phaseStart = time.perf_counter()
+            try:
+                result = coll.bulk_write(requests, ordered=False)
+                phases.add("send", time.perf_counter() - phaseStart)
+                writeCounts.update(matched=result.matched_count, modified=result.modified_count,
+                                   upserted=result.upserted_count, deleted=result.deleted_count)
+                numDeleted = result.deleted_count
+                numErrors = 0
+            except pymongo.errors.BulkWriteError as e:
+                errorStart = time.perf_counter()
+                phases.add("send", errorStart - phaseStart)
+                writeCounts.update(matched=e.details.get("nMatched", 0), modified=e.details.get("nModified", 0),
+                                   upserted=e.details.get("nUpserted", 0), deleted=e.details.get("nRemoved", 0),
+                                   writeErrors=len(e.details.get("writeErrors", [])))
+                numDeleted = e.details.get("nRemoved", 0)
+                numErrors = len(e.details.get("writeErrors", []))
+                phases.add("errors", time.perf_counter() - errorStart)
+            if self.operation == "deleteOne":
+                # Deletes that found nothing left to delete are timed as no-ops
+                writeCounts["unmatchedDeletes"] += len(requests) - numDeleted - numErrors
+            latency = time.time() - startTime
+            latencies.record(latency)
+            liveSlot.record(len(requests), latency)
+        return (trialStartTime, time.time(), latencies, phases, writeCounts)
+    def runTestTrial(self):
+        for result in self.runTestTrialThreads():
+            self.writeCounts.update(result[4])
+        self.numDocs += self.numThreads * self.numOpsPerThread
 
 
 class PerfTest():
@@ -177,78 +1187,518 @@ class PerfTest():
 
     A class that supports multiple test trials with results
 
+    Trials are produced lazily by generateTrials() and their results are streamed into
+    constant-memory aggregators, so the memory used does not grow with the number of trials.
     """
     def __init__(self, connString, dbName, testName, numTrials):
         self.connString = connString
         self.dbName     = dbName
         self.testName   = testName
         self.numTrials  = numTrials
-        self.trials     = []
-        self.trialRunTime = []
+        self.trialRunTime = RunningStats()
+        self.trialDocsPerSec = RunningStats()
+        self.trialLatency = RunningStats()
+        self.latencies  = LatencyHistogram()
+        self.phases     = PhaseTimer()
+        self.numDocs    = 0
+        self.convergence = None
+        self.profile    = None
+        self.profileTrial = 0
+        self.profileDir = None
+        self.serverSampler = None
+        self.serverSamplesDir = None
+        self.liveInterval = None
+        self.liveFile   = None
+        self.liveCounters = None
+    def generateTrials(self):
+        """
+        Generate Trials
+
+        Yields the numTrials trials of the test one at a time
+
+        :return:
+        """
+        return iter(())
     def runTest(self):
-        for i in range(0, self.numTrials):
-            self.trials[i].runTestTrial()
-            self.trialRunTime.append(self.trials[i].runTime)
-        trialStats = stats.describe(self.trialRunTime)
-        print("Test results: {}".format(trialStats))
+        """
+        Run Test
+
+        Runs up to numTrials trials. If a ConvergenceDetector is set in self.convergence, warm-up
+        trials are left out of the results and the test stops as soon as the detector is done. A
+        test that runs out of trials before its warm-up ends reports its warm-up trials instead,
+        flagged as not converged in the summary.
+
+        If self.profile is set to cprofile or tracemalloc, trial number profileTrial is run under
+        that profiler and its profiles are written to profileDir. The profiled trial runs in
+        addition to the numTrials trials and is left out of the results.
+
+        If a monitor.ServerStatusSampler is set in self.serverSampler, it samples the server while
+        the trials run and follows the throughput and latency of the test through the live
+        counters. Its time series is written to serverSamplesDir if that is set.
+
+        If liveInterval is set, the throughput and latency of every liveInterval seconds are
+        printed while the trials run, and appended to liveFile if that is set.
+
+        :return:
+        """
+        clientRegistry.warmUp(self.connString)
+        if self.convergence is not None:
+            self.convergence.start(self.numTrials)
+        if self.serverSampler is not None:
+            self.serverSampler.liveCounters = self.setUpLiveCounters()
+            self.serverSampler.start()
+        liveReporter = None
+        numTrials = self.numTrials
+        warmupTrials = []
+        # Stop the threads polling in the background even if a trial fails, since callers like
+        # the compression matrix carry on with the next test
+        try:
+            if self.liveInterval is not None and self.setUpLiveCounters() is not None:
+                liveReporter = LiveReporter(self.liveCounters, self.testName, self.liveInterval, self.liveFile, self.connString)
+                liveReporter.start()
+            if self.profile is not None:
+                os.makedirs(self.profileDir, exist_ok=True)
+                self.numTrials += 1
+            for trialNum, trial in enumerate(self.generateTrials()):
+                if self.profile is not None and trialNum == self.profileTrial:
+                    trial.profile = self.profile
+                    trial.profilePath = os.path.join(self.profileDir, "{}-{}-trial{}".format(self.testName, time.strftime("%Y%m%d-%H%M%S"), trialNum))
+                    self.runTrial(trial)
+                    print("Wrote {} profiles of trial {} to {}-*".format(self.profile, trialNum, trial.profilePath))
+                    continue
+                self.runTrial(trial)
+                if self.convergence is None or self.convergence.observe(trial.runTime):
+                    self.recordTrial(trial)
+                elif self.convergence.measured.count == 0:
+                    warmupTrials.append(trial)
+                if self.convergence is not None and self.convergence.isDone():
+                    break
+        finally:
+            self.numTrials = numTrials
+            if liveReporter is not None:
+                liveReporter.stop()
+            if self.serverSampler is not None:
+                self.serverSampler.stop()
+        if self.convergence is not None and self.convergence.measured.count == 0:
+            # There is no steady state to report, the warm-up trials are better than no results
+            for trial in warmupTrials:
+                self.recordTrial(trial)
+        print("Test results: {}".format(self.trialRunTime.describe()))
+        if self.convergence is not None:
+            print("Adaptive trials: {}".format(self.convergence.report()))
+            if self.convergence.measured.count == 0:
+                print("Reporting the {} warm-up trials, the results did not converge".format(len(warmupTrials)))
+        self.printThroughput(self.trialRunTime.total)
+        print("Phases: {}".format(self.phases.summary()))
+        if self.serverSampler is not None:
+            for line in self.serverSampler.report():
+                print(line)
+            if self.serverSamplesDir is not None:
+                os.makedirs(self.serverSamplesDir, exist_ok=True)
+                path = os.path.join(self.serverSamplesDir, "{}-{}-{}.jsonl".format(self.testName, time.strftime("%Y%m%d-%H%M%S"), os.getpid()))
+                self.serverSampler.save(path, self.testName)
+                print("Wrote server samples to {}".format(path))
+        print("Connections opened by this process: {}".format(clientRegistry.connectionsOpened(self.connString)))
+
+    def runTrial(self, trial):
+        """
+        Run Trial
 
-class BulkInsertTest(PerfTest):
+        :param trial:
+        :return:
+        """
+        trial.liveCounters = self.liveCounters
+        trial.runProfiled("main", trial.runTestTrial)
+    def numWorkers(self):
+        return 1
+    def setUpLiveCounters(self):
+        """
+        Set Up Live Counters
+
+        :return: the LiveCounters of the test, created with a slot per worker on the first call, or
+                 None if neither liveInterval nor serverSampler is set
+        """
+        if (self.liveInterval is not None or self.serverSampler is not None) and self.liveCounters is None:
+            self.liveCounters = LiveCounters(self.numWorkers())
+        return self.liveCounters
+    def recordTrial(self, trial):
+        """
+        Record Trial
+
+        Adds the results of a finished trial to the results of the test
+
+        :param trial:
+        :return:
+        """
+        self.trialRunTime.record(trial.runTime)
+        if trial.runTime > 0:
+            self.trialDocsPerSec.record(trial.numDocs / trial.runTime)
+        self.trialLatency.record(trial.latencies.mean())
+        self.latencies.merge(trial.latencies)
+        self.phases.merge(trial.phases)
+        self.numDocs += trial.numDocs
+    def summary(self):
+        """
+        Summary
+
+        :return: a dict with the throughput and latency percentiles (in seconds) of all trials, and
+                 the raw metrics behind them: the stats of the per-trial docs/s and mean latency and
+                 the latency histogram buckets
+        """
+        totalRunTime = self.trialRunTime.total
+        return {
+            "opsPerSec"     : self.latencies.count / totalRunTime if totalRunTime > 0 else 0,
+            "docsPerSec"    : self.numDocs / totalRunTime if totalRunTime > 0 else 0,
+            "p50"           : self.latencies.percentile(50),
+            "p99"           : self.latencies.percentile(99),
+            "p99.9"         : self.latencies.percentile(99.9),
+            "max"           : self.latencies.percentile(100),
+            "phases"        : dict(self.phases.seconds),
+            "workers"       : self.numWorkers(),
+            "numTrials"     : self.trialRunTime.count,
+            "trialDocsPerSec": self.trialDocsPerSec.asDict(),
+            "trialLatency"  : self.trialLatency.asDict(),
+            "latencyCounts" : dict(self.latencies.counts),
+            "converged"     : self.convergence.isConverged() if self.convergence is not None else None
+        }
+    def printThroughput(self, totalRunTime):
+        """
+        Print Throughput
+
+        Prints the operation and document throughput and the latency percentiles of all trials
+
+        :param totalRunTime: the time in seconds spent in the timed windows of all trials
+        :return:
+        """
+        opsPerSec = self.latencies.count / totalRunTime if totalRunTime > 0 else 0
+        docsPerSec = self.numDocs / totalRunTime if totalRunTime > 0 else 0
+        print("Throughput: {:.1f} ops/s, {:.1f} docs/s ({} ops, {} docs)".format(opsPerSec, docsPerSec, self.latencies.count, self.numDocs))
+        print("Latency (ms): {}".format(self.latencies.summary()))
+
+class PooledPerfTest(PerfTest):
+    """
+    Pooled Perf Test
+
+    A PerfTest whose trials run numThreads workers on a long-lived pool of pre-forked worker
+    processes. Each process runs threadsPerProcess of the workers as threads, so 1 gives one
+    process per worker and numThreads gives a single process of threads.
+    """
+    def __init__(self, connString, dbName, testName, numTrials, numThreads):
+        super().__init__(connString, dbName, testName, numTrials)
+        self.numThreads = numThreads
+        self.threadsPerProcess = 1
+        self.pool       = None
+        self.workerConnections = {}
+    def numWorkers(self):
+        return self.numThreads
+    def numProcesses(self):
+        threadsPerProcess = min(max(self.threadsPerProcess, 1), self.numThreads)
+        return int((self.numThreads + threadsPerProcess - 1) / threadsPerProcess)
+    def runTest(self):
+        # One pool of pre-forked workers is kept for all trials so process start up and
+        # connection handshakes stay out of the measured run times
+        barrier = Barrier(self.numThreads)
+        # Shared memory must be handed to the workers when they start
+        liveCounters = self.setUpLiveCounters()
+        threadsPerProcess = min(max(self.threadsPerProcess, 1), self.numThreads)
+        with Pool(processes=self.numProcesses(), initializer=_initPoolWorker, initargs=(self.connString, barrier, liveCounters, threadsPerProcess)) as pool:
+            self.pool = pool
+            super().runTest()
+            self.pool = None
+        # Workers connect in the pool initializer, so this stays the same however many trials ran
+        # as long as the workers reuse their connections
+        print("Connections opened by the {} worker processes: {}".format(len(self.workerConnections), sum(self.workerConnections.values())))
+    def runTrial(self, trial):
+        trial.pool = self.pool
+        trial.threadsPerProcess = min(max(self.threadsPerProcess, 1), self.numThreads)
+        # The workers profile themselves, the parent process only dispatches the trial
+        trial.runTestTrial()
+        trial.pool = None
+        self.workerConnections.update(trial.workerConnections)
+
+class BulkInsertTest(PooledPerfTest):
     """
     Bulk Insert Test
 
     A PerfTest class that conducts multiple test trials for Bulk Inserts
 
     """
-    def __init__(self, connString, dbName, numTrials, numThreads, numDocsToInsert, insertBatchSize, documentProvider):
-        super().__init__(connString, dbName, "BulkInsertTest", numTrials)
+    def __init__(self, connString, dbName, numTrials, numThreads, numDocsToInsert, insertBatchSize, documentProvider, datasetDir=None, maxBatchBytes=None, writeConcern=None, maxRetries=3, indexes=None):
+        super().__init__(connString, dbName, "BulkInsertTest", numTrials, numThreads)
         self.numDocsToInsert = numDocsToInsert
         self.insertBatchSize = insertBatchSize
         self.documentProvider = documentProvider
-        for i in range(0, numTrials):
-            self.trials.append(BulkInsertTestTrial(connString, dbName, numThreads, numDocsToInsert, insertBatchSize, documentProvider))
+        self.datasetDir = datasetDir
+        self.maxBatchBytes = maxBatchBytes
+        self.writeConcern = writeConcern
+        self.maxRetries = maxRetries
+        self.indexes = indexes
+        self.batchDocs = RunningStats()
+        self.batchBytes = RunningStats()
+        self.errorCounts = collections.Counter()
+        self.errorCodes = collections.Counter()
+    def generateTrials(self):
+        for i in range(0, self.numTrials):
+            yield BulkInsertTestTrial(self.connString, self.dbName, self.numThreads, self.numDocsToInsert, self.insertBatchSize, self.documentProvider, self.datasetDir, self.maxBatchBytes, self.writeConcern, self.maxRetries, self.indexes)
+    def recordTrial(self, trial):
+        super().recordTrial(trial)
+        self.batchDocs.merge(trial.batchDocs)
+        self.batchBytes.merge(trial.batchBytes)
+        self.errorCounts.update(trial.errorCounts)
+        self.errorCodes.update(trial.errorCodes)
+    def runTest(self):
+        super().runTest()
+        if self.batchDocs.count > 0:
+            print("Effective batch size: mean {:.1f} docs (min {}, max {}), mean {:.3f} MB (max {:.3f} MB) over {} batches".format(
+                self.batchDocs.mean, self.batchDocs.min, self.batchDocs.max, self.batchBytes.mean / 1048576, self.batchBytes.max / 1048576, self.batchDocs.count))
+        if self.errorCounts:
+            print("Write errors: {} ({}), {} docs retried in {} batches, {} docs failed, {} write concern errors, {} batches lost to connection failures".format(
+                self.errorCounts["writeErrors"], ", ".join("code {}: {}".format(code, count) for code, count in sorted(self.errorCodes.items(), key=lambda item: str(item[0]))),
+                self.errorCounts["retried"], self.errorCounts["retryBatches"], self.errorCounts["failed"], self.errorCounts["writeConcernErrors"], self.errorCounts["connectionFailures"]))
+    def summary(self):
+        summary = super().summary()
+        summary["errors"] = dict(self.errorCounts, codes=dict((str(code), count) for code, count in self.errorCodes.items()))
+        return summary
 
 
-class SingleInsertTest(PerfTest):
+class SingleInsertTest(PooledPerfTest):
     """
     Single Insert Test
 
-    A POC test to test and confirm db connectivity
+    A POC test to test and confirm db connectivity, inserting one document on each of numThreads workers
     """
-    def __init__(self, connString, dbName, documentProvider):
-        super().__init__(connString, dbName, "SingleInsertTest", 100)
+    def __init__(self, connString, dbName, numThreads, documentProvider):
+        super().__init__(connString, dbName, "SingleInsertTest", 100, numThreads)
+        self.documentProvider = documentProvider
+    def generateTrials(self):
         for i in range(0, self.numTrials):
-            self.trials.append(SingleInsertTestTrial(connString, dbName, documentProvider))
+            yield SingleInsertTestTrial(self.connString, self.dbName, self.numThreads, i, self.documentProvider)
 
-class EqualityQueryTest(PerfTest):
+class EqualityQueryTest(PooledPerfTest):
     """
     Equality Query Test
 
+    A PerfTest that sends one equality query on each of numThreads workers per trial
     """
-    def __init__(self, connString, dbName, numTrials, documentProvider):
-        super().__init__(connString, dbName, "EqualityQueryTest", numTrials)
-        mongoClient = pymongo.MongoClient(self.connString)
+    def __init__(self, connString, dbName, numTrials, numThreads, documentProvider):
+        super().__init__(connString, dbName, "EqualityQueryTest", numTrials, numThreads)
+        mongoClient = clientRegistry.getClient(self.connString)
         self.collName = "bulkinsert." + documentProvider.__class__.__name__.lower()
-        coll = mongoClient[self.dbName][self.collName].with_options(
-            write_concern=pymongo.write_concern.WriteConcern(w=1)
-        )
-        collSize = coll.count()
-        for i in range(0, numTrials):
-            psuedoRandomNum = (i*1000+10) % collSize
-            self.trials.append(EqualityQueryTestTrial(connString, dbName, documentProvider, psuedoRandomNum))
+        self.collSize = mongoClient[self.dbName][self.collName].estimated_document_count()
+        self.documentProvider = documentProvider
+    def generateTrials(self):
+        for i in range(0, self.numTrials):
+            yield EqualityQueryTestTrial(self.connString, self.dbName, self.numThreads, i, self.documentProvider, self.collSize)
 
-class RangedQueryTest(PerfTest):
+class RangedQueryTest(PooledPerfTest):
     """
-    Equality Query Test
+    Ranged Query Test
 
+    A PerfTest that sends one ranged query on each of numThreads workers per trial
     """
-    def __init__(self, connString, dbName, numTrials, documentProvider):
-        super().__init__(connString, dbName, "RangedQueryTest", numTrials)
-        mongoClient = pymongo.MongoClient(self.connString)
+    def __init__(self, connString, dbName, numTrials, numThreads, documentProvider):
+        super().__init__(connString, dbName, "RangedQueryTest", numTrials, numThreads)
+        mongoClient = clientRegistry.getClient(self.connString)
         self.collName = "bulkinsert." + documentProvider.__class__.__name__.lower()
-        coll = mongoClient[self.dbName][self.collName].with_options(
-            write_concern=pymongo.write_concern.WriteConcern(w=1)
-        )
-        collSize = coll.count()
-        for i in range(0, numTrials):
-            psuedoRandomNum = (i*1000+10) % collSize
-            self.trials.append(RangedQueryTestTrial(connString, dbName, documentProvider, psuedoRandomNum))
\ No newline at end of file
+        self.collSize = mongoClient[self.dbName][self.collName].estimated_document_count()
+        self.documentProvider = documentProvider
+    def generateTrials(self):
+        for i in range(0, self.numTrials):
+            yield RangedQueryTestTrial(self.connString, self.dbName, self.numThreads, i, self.documentProvider, self.collSize)
+
+class RangeScanTest(PerfTest):
+    """
+    Range Scan Test
+
+    A PerfTest that drains range queries matching selectivity of the valueRange nums of the
+    collection filled by BulkInsertTest, and reports the documents and bytes read per second.
+    batchSize 0 and limit 0 leave the cursor batch size and the number of documents to the server.
+    projection "index" returns only the indexed field, which the index covers; "full" returns
+    whole documents.
+    """
+    PROJECTIONS = ("full", "index")
+
+    def __init__(self, connString, dbName, numTrials, documentProvider, valueRange, selectivity, batchSize=0, projection="full", limit=0):
+        super().__init__(connString, dbName, "RangeScanTest", numTrials)
+        self.documentProvider = documentProvider
+        self.valueRange = max(valueRange, 1)
+        self.count = max(int(self.valueRange * selectivity), 1)
+        self.batchSize = batchSize
+        self.projection = { documentProvider.getIndex() : 1, "_id" : 0 } if projection == "index" else None
+        self.limit = limit
+        self.numBytes = 0
+    def generateTrials(self):
+        for i in range(0, self.numTrials):
+            psuedoRandomNum = (i*1000+10) % max(self.valueRange - self.count + 1, 1)
+            yield RangeScanTestTrial(self.connString, self.dbName, self.documentProvider, psuedoRandomNum, self.count, self.batchSize, self.projection, self.limit)
+    def recordTrial(self, trial):
+        super().recordTrial(trial)
+        self.numBytes += trial.numBytes
+    def runTest(self):
+        super().runTest()
+        totalRunTime = self.trialRunTime.total
+        print("Read: {:.3f} MB/s, {:.1f} docs per scan, {:.1f} bytes per doc".format(
+            self.numBytes / totalRunTime / 1048576 if totalRunTime > 0 else 0,
+            self.numDocs / self.latencies.count if self.latencies.count else 0,
+            self.numBytes / self.numDocs if self.numDocs else 0))
+    def summary(self):
+        summary = super().summary()
+        totalRunTime = self.trialRunTime.total
+        summary["bytesPerSec"] = self.numBytes / totalRunTime if totalRunTime > 0 else 0
+        return summary
+
+class IndexBuildTest(PerfTest):
+    """
+    Index Build Test
+
+    A PerfTest that builds an index of keys on the collection filled by BulkInsertTest in every
+    trial, so docs/s is the rate at which the documents of the collection are indexed
+    """
+    def __init__(self, connString, dbName, numTrials, documentProvider, keys):
+        super().__init__(connString, dbName, "IndexBuildTest", numTrials)
+        self.documentProvider = documentProvider
+        self.keys = keys
+    def generateTrials(self):
+        for i in range(0, self.numTrials):
+            yield IndexBuildTestTrial(self.connString, self.dbName, self.documentProvider, self.keys)
+    def recordTrial(self, trial):
+        # A failed build has no timing to record
+        if trial.latencies.count > 0:
+            super().recordTrial(trial)
+
+class OpenLoopTest(PooledPerfTest):
+    """
+    Open Loop Test
+
+    A PerfTest that offers operations at targetOpsPerSec spread across numThreads workers for
+    duration seconds per trial
+    """
+    def __init__(self, connString, dbName, numTrials, numThreads, targetOpsPerSec, duration, operation, documentProvider):
+        super().__init__(connString, dbName, "OpenLoopTest", numTrials, numThreads)
+        self.targetOpsPerSec = targetOpsPerSec
+        self.duration = duration
+        self.operation = operation
+        self.documentProvider = documentProvider
+        self.collSize = 0
+        if operation != "insert":
+            mongoClient = clientRegistry.getClient(self.connString)
+            self.collSize = mongoClient[self.dbName]["bulkinsert." + documentProvider.__class__.__name__.lower()].estimated_document_count()
+    def generateTrials(self):
+        for i in range(0, self.numTrials):
+            yield OpenLoopTestTrial(self.connString, self.dbName, self.numThreads, self.targetOpsPerSec, self.duration, self.operation, self.documentProvider, self.collSize)
+    def achievedOpsPerSec(self):
+        """
+        Achieved Ops Per Sec
+
+        :return: the operation rate the server actually sustained across all trials
+        """
+        totalRunTime = self.trialRunTime.total
+        return self.latencies.count / totalRunTime if totalRunTime > 0 else 0
+
+class MixedWorkloadTest(PooledPerfTest):
+    """
+    Mixed Workload Test
+
+    A PerfTest that runs inserts, equality queries and ranged queries concurrently on numThreads
+    workers, weighted by mix (insert, eqQuery, rangeQuery)
+    """
+    def __init__(self, connString, dbName, numTrials, numThreads, numOpsPerThread, mix, documentProvider):
+        super().__init__(connString, dbName, "MixedWorkloadTest", numTrials, numThreads)
+        self.opLatencies = dict((operation, LatencyHistogram()) for operation in OperationTestTrial.OPERATIONS)
+        self.numOpsPerThread = numOpsPerThread
+        self.mix = mix
+        self.documentProvider = documentProvider
+        mongoClient = clientRegistry.getClient(self.connString)
+        self.collSize = mongoClient[self.dbName]["bulkinsert." + documentProvider.__class__.__name__.lower()].estimated_document_count()
+    def generateTrials(self):
+        for i in range(0, self.numTrials):
+            yield MixedWorkloadTestTrial(self.connString, self.dbName, self.numThreads, self.numOpsPerThread, self.mix, i, self.documentProvider, self.collSize)
+    def recordTrial(self, trial):
+        super().recordTrial(trial)
+        for operation, latencies in trial.opLatencies.items():
+            self.opLatencies[operation].merge(latencies)
+    def runTest(self):
+        super().runTest()
+        totalRunTime = self.trialRunTime.total
+        for operation in OperationTestTrial.OPERATIONS:
+            latencies = self.opLatencies[operation]
+            opsPerSec = latencies.count / totalRunTime if totalRunTime > 0 else 0
+            print("{}: {:.1f} ops/s ({} ops), latency (ms): {}".format(operation, opsPerSec, latencies.count, latencies.summary()))
+
+class AsyncBulkInsertTest(BulkInsertTest):
+    """
+    Async Bulk Insert Test
+
+    A BulkInsertTest whose numThreads workers each keep up to concurrency inserts in flight
+    """
+    def __init__(self, connString, dbName, numTrials, numThreads, numDocsToInsert, insertBatchSize, documentProvider, concurrency, datasetDir=None, maxBatchBytes=None, writeConcern=None, maxRetries=3, indexes=None):
+        super().__init__(connString, dbName, numTrials, numThreads, numDocsToInsert, insertBatchSize, documentProvider, datasetDir, maxBatchBytes, writeConcern, maxRetries, indexes)
+        self.testName = "AsyncBulkInsertTest"
+        self.concurrency = concurrency
+    def generateTrials(self):
+        for i in range(0, self.numTrials):
+            yield AsyncBulkInsertTestTrial(self.connString, self.dbName, self.numThreads, self.numDocsToInsert, self.insertBatchSize, self.documentProvider, self.concurrency, self.datasetDir, self.maxBatchBytes, self.writeConcern, self.maxRetries, self.indexes)
+
+class AsyncQueryTest(PooledPerfTest):
+    """
+    Async Query Test
+
+    A PerfTest that runs equality (eqQuery) or ranged (rangeQuery) queries with an asyncio driver,
+    concurrency queries in flight on each of numThreads workers
+    """
+    def __init__(self, connString, dbName, numTrials, numThreads, concurrency, operation, documentProvider):
+        super().__init__(connString, dbName, "AsyncQueryTest", numTrials, numThreads)
+        self.concurrency = concurrency
+        self.operation = operation
+        self.documentProvider = documentProvider
+        mongoClient = clientRegistry.getClient(self.connString)
+        self.collSize = mongoClient[self.dbName]["bulkinsert." + documentProvider.__class__.__name__.lower()].estimated_document_count()
+    def generateTrials(self):
+        for i in range(0, self.numTrials):
+            yield AsyncQueryTestTrial(self.connString, self.dbName, self.numThreads, self.operation, self.concurrency, i, self.documentProvider, self.collSize)
+
+class BulkWriteTest(PooledPerfTest):
+    """
+    Bulk Write Test
+
+    A PerfTest that sends batchSize updateOne, updateMany, upsert or deleteOne requests per
+    bulk_write on numThreads workers to the collection filled by BulkInsertTest, whose workers
+    each inserted the nums 0 to valueRange - 1. deleteOne runs at most as many trials as it takes
+    to delete every document of the collection once.
+    """
+    def __init__(self, connString, dbName, numTrials, numThreads, numOpsPerThread, batchSize, operation, documentProvider, valueRange, writeConcern=None):
+        super().__init__(connString, dbName, "BulkWriteTest", numTrials, numThreads)
+        self.numOpsPerThread = numOpsPerThread
+        self.batchSize = batchSize
+        self.operation = operation
+        self.documentProvider = documentProvider
+        self.valueRange = valueRange
+        self.writeConcern = writeConcern
+        self.writeCounts = collections.Counter()
+        mongoClient = clientRegistry.getClient(self.connString)
+        self.collSize = mongoClient[self.dbName]["bulkinsert." + documentProvider.__class__.__name__.lower()].estimated_document_count()
+    def generateTrials(self):
+        for i in range(0, self.numTrials):
+            yield BulkWriteTestTrial(self.connString, self.dbName, self.numThreads, self.numOpsPerThread, self.batchSize, self.operation, i, self.documentProvider, self.valueRange, self.writeConcern)
+    def recordTrial(self, trial):
+        super().recordTrial(trial)
+        self.writeCounts.update(trial.writeCounts)
+    def runTest(self):
+        numTrials = self.numTrials
+        if self.operation == "deleteOne":
+            # Deletes after one pass over the collection find nothing left to delete, and the
+            # profiled trial deletes documents too
+            maxTrials = max(int(self.collSize / max(self.numThreads * self.numOpsPerThread, 1)) - (1 if self.profile is not None else 0), 1)
+            if maxTrials < numTrials:
+                print("Running {} of {} trials, enough to delete the {} documents of the collection once".format(maxTrials, numTrials, self.collSize))
+                self.numTrials = maxTrials
+        super().runTest()
+        self.numTrials = numTrials
+        print("Documents: {} matched, {} modified, {} upserted, {} deleted, {} write errors".format(
+            self.writeCounts["matched"], self.writeCounts["modified"], self.writeCounts["upserted"], self.writeCounts["deleted"], self.writeCounts["writeErrors"]))
+        if self.writeCounts["unmatchedDeletes"]:
+            print("{} deletes matched no document".format(self.writeCounts["unmatchedDeletes"]))
+    def summary(self):
+        summary = super().summary()
+        summary["writes"] = dict(self.writeCounts)
+        return summary
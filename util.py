@@ -1,5 +1,14 @@
+import os
+import re
 import string
 import json
+import struct
+import threading
+
+import bson
+import pymongo
+from bson.raw_bson import RawBSONDocument
+from pymongo import monitoring
 
 class DocumentProvider():
     """
@@ -19,6 +28,19 @@ class DocumentProvider():
         :return:
         """
         return { "testIdx" : testIdx, "value" : num }
+    def createDocuments(self, testIdx, start, count):
+        """
+        Create Documents
+
+        Creates the documents for nums start to start + count - 1 in a single call. Subclasses
+        should override this with an implementation that avoids a method call per document.
+
+        :param testIdx:
+        :param start:
+        :param count:
+        :return:
+        """
+        return [self.createDocument(testIdx, num) for num in range(start, start + count)]
     def getEqMatchingCriteria(self, testIdx, num):
         """
         Get Equality Matching Criteria
@@ -33,6 +55,43 @@ class DocumentProvider():
         :return:
         """
         return { "value" : { "$gt" : num } }
+    def getBoundedRangeMatchingCriteria(self, testIdx, num, count):
+        """
+        Get Bounded Range Matching Criteria
+
+        Returns criteria matching the documents of the nums num to num + count - 1
+
+        :param num:
+        :param count:
+        :return:
+        """
+        return { "value" : { "$gte" : num, "$lt" : num + count } }
+    def getUpdate(self, testIdx, num):
+        """
+        Get Update
+
+        Returns the update applied to the documents matched by getEqMatchingCriteria(). The default
+        changes a field that is not indexed, so the document can be updated in place.
+
+        :param testIdx:
+        :param num:
+        :return:
+        """
+        return { "$set" : { "updatedBy" : testIdx }, "$inc" : { "updateCount" : 1 } }
+    def getUpsert(self, testIdx, num):
+        """
+        Get Upsert
+
+        Returns the criteria and update of an upsert. The criteria are on the indexed field, so a
+        num without a matching document inserts one that carries the field.
+
+        :param testIdx:
+        :param num:
+        :return: (criteria, update)
+        """
+        update = self.getUpdate(testIdx, num)
+        update["$setOnInsert"] = { "testIdx" : testIdx }
+        return self.getEqMatchingCriteria(testIdx, num), update
     def getIndex(self):
         """
         Get Index
@@ -42,6 +101,19 @@ class DocumentProvider():
         :return:
         """
         return "value"
+    def getIndexes(self):
+        """
+        Get Indexes
+
+        Returns the secondary indexes of the index benchmarks, in the order they are added by the
+        index count curve, as (kind, keys) with kind one of "single", "compound" or "multikey"
+
+        :return:
+        """
+        return [
+            ("single",   [("value", pymongo.ASCENDING)]),
+            ("compound", [("value", pymongo.ASCENDING), ("testIdx", pymongo.ASCENDING)])
+        ]
 
 
 
@@ -61,6 +133,16 @@ class IntegerValueDocumentProvider(DocumentProvider):
         :return:
         """
         return { "testIdx" : testIdx, "value1" : num, "value2" : num*num }
+    def createDocuments(self, testIdx, start, count):
+        """
+        Create Documents
+
+        :param testIdx:
+        :param start:
+        :param count:
+        :return:
+        """
+        return [{ "testIdx" : testIdx, "value1" : num, "value2" : num*num } for num in range(start, start + count)]
 
     def getEqMatchingCriteria(self, testIdx, num):
         """
@@ -76,7 +158,16 @@ class IntegerValueDocumentProvider(DocumentProvider):
         :param num:
         :return:
         """
-        return { "value 1" : { "$gt" : num } }
+        return { "value1" : { "$gt" : num } }
+    def getBoundedRangeMatchingCriteria(self, testIdx, num, count):
+        """
+        Get Bounded Range Matching Criteria
+
+        :param num:
+        :param count:
+        :return:
+        """
+        return { "value1" : { "$gte" : num, "$lt" : num + count } }
     def getIndex(self):
         """
         Get Index
@@ -86,6 +177,20 @@ class IntegerValueDocumentProvider(DocumentProvider):
         :return:
         """
         return "value1"
+    def getIndexes(self):
+        """
+        Get Indexes
+
+        Documents have no arrays, so there are no multikey indexes
+
+        :return:
+        """
+        return [
+            ("single",   [("value1", pymongo.ASCENDING)]),
+            ("single",   [("value2", pymongo.ASCENDING)]),
+            ("compound", [("value1", pymongo.ASCENDING), ("value2", pymongo.ASCENDING)]),
+            ("compound", [("testIdx", pymongo.ASCENDING), ("value1", pymongo.ASCENDING)])
+        ]
 
 
 
@@ -115,6 +220,23 @@ class StringValueDocumentProvider(DocumentProvider):
         :return:
         """
         return { "testIdx" : testIdx, "value1" : self.getStr(num) }
+    def createDocuments(self, testIdx, start, count):
+        """
+        Create Documents
+
+        getStr(num) is the slice of the repeating alphabet starting at num, so every string in
+        the batch is a slice of one repeated alphabet string at offset num modulo its length.
+
+        :param testIdx:
+        :param start:
+        :param count:
+        :return:
+        """
+        length = self.length
+        alphaBetLength = self.alphaBetLength
+        repeated = self.alphaBet * (int(length / alphaBetLength) + 2)
+        return [{ "testIdx" : testIdx, "value1" : repeated[offset:offset + length] }
+                for offset in (num % alphaBetLength for num in range(start, start + count))]
     def getEqMatchingCriteria(self, testIdx, num):
         """
         Get Equality Matching Criteria
@@ -131,7 +253,22 @@ class StringValueDocumentProvider(DocumentProvider):
         :param num:
         :return:
         """
-        return { "value 1" : { "$gt" : self.getStr(num) } }
+        return { "value1" : { "$gt" : self.getStr(num) } }
+    def getBoundedRangeMatchingCriteria(self, testIdx, num, count):
+        """
+        Get Bounded Range Matching Criteria
+
+        getStr() repeats every alphaBetLength nums and sorts in the order of num % alphaBetLength,
+        so a range of count nums or more from num reaches past the last string
+
+        :param num:
+        :param count:
+        :return:
+        """
+        start = num % self.alphaBetLength
+        if start + count >= self.alphaBetLength:
+            return { "value1" : { "$gte" : self.getStr(start) } }
+        return { "value1" : { "$gte" : self.getStr(start), "$lt" : self.getStr(start + count) } }
     def getIndex(self):
         """
         Get Index
@@ -141,6 +278,18 @@ class StringValueDocumentProvider(DocumentProvider):
         :return:
         """
         return "value1"
+    def getIndexes(self):
+        """
+        Get Indexes
+
+        Documents have no arrays, so there are no multikey indexes
+
+        :return:
+        """
+        return [
+            ("single",   [("value1", pymongo.ASCENDING)]),
+            ("compound", [("testIdx", pymongo.ASCENDING), ("value1", pymongo.ASCENDING)])
+        ]
 
 
 
@@ -171,6 +320,30 @@ class NestedDocumentProvider(DocumentProvider):
             }
         }
         return myDoc
+    def createDocuments(self, testIdx, start, count):
+        """
+        Create Documents
+
+        :param testIdx:
+        :param start:
+        :param count:
+        :return:
+        """
+        return [
+            {
+                "testIdx" : testIdx,
+                "value1"  : {
+                    "nestedValue" : {
+                        "nestedValue1" : num,
+                        "nestedValue2" : num*num
+                    }
+                },
+                "value2"  : {
+                    "nestedValue" : num
+                }
+            }
+            for num in range(start, start + count)
+        ]
     def getEqMatchingCriteria(self, testIdx, num):
         """
         Get Equality Matching Criteria
@@ -189,6 +362,27 @@ class NestedDocumentProvider(DocumentProvider):
         :return:
         """
         return { "value1.nestedValue.nestedValue1" : { "$gt" : num } }
+    def getBoundedRangeMatchingCriteria(self, testIdx, num, count):
+        """
+        Get Bounded Range Matching Criteria
+
+        :param testIdx:
+        :param num:
+        :param count:
+        :return:
+        """
+        return { "value1.nestedValue.nestedValue1" : { "$gte" : num, "$lt" : num + count } }
+    def getUpdate(self, testIdx, num):
+        """
+        Get Update
+
+        Updates a field next to the matched one inside the nested document
+
+        :param testIdx:
+        :param num:
+        :return:
+        """
+        return { "$set" : { "value2.updatedBy" : testIdx }, "$inc" : { "value1.nestedValue.updateCount" : 1 } }
     def getIndex(self):
         """
         Get Index
@@ -198,25 +392,92 @@ class NestedDocumentProvider(DocumentProvider):
         :return:
         """
         return "value1.nestedValue.nestedValue1"
+    def getIndexes(self):
+        """
+        Get Indexes
 
-class kb50DocumentProvider(DocumentProvider):
+        Documents have no arrays, so there are no multikey indexes
+
+        :return:
+        """
+        return [
+            ("single",   [("value1.nestedValue.nestedValue1", pymongo.ASCENDING)]),
+            ("single",   [("value2.nestedValue", pymongo.ASCENDING)]),
+            ("compound", [("value1.nestedValue.nestedValue1", pymongo.ASCENDING), ("value1.nestedValue.nestedValue2", pymongo.ASCENDING)])
+        ]
+
+class TemplateDocumentProvider(DocumentProvider):
     """
-    Integer Value Document Provider
+    Template Document Provider
 
-    A class that deterministically creates documents
+    A class that deterministically creates documents from a JSON template file containing
+    the placeholders $id and $value. $id is replaced with testIdx and num joined by "-", so every
+    document of a worker has its own id.
+
+    By default the template is encoded to BSON once and each document is produced as a
+    RawBSONDocument by splicing the per-document values into the pre-encoded bytes. Pass
+    useRawBson=False to fall back to rendering and parsing the JSON text for every document.
     """
-    def __init__(self):
+    ID_PLACEHOLDER      = "$id"
+    VALUE_PLACEHOLDER   = "$value"
+    VALUE_SENTINEL      = 0x5EB7A11E
+
+    def __init__(self, templateFile, useRawBson=True):
         DocumentProvider.__init__(self)
-        f = open("50kb.json","r")
-        self.doc = f.read()
+        with open(templateFile, "r") as f:
+            self.doc = f.read()
+        self.useRawBson = useRawBson
+        if self.useRawBson:
+            self.useRawBson = self._encodeTemplate()
+    def _encodeTemplate(self):
+        """
+        Encode Template
+
+        Encodes the template to BSON once and remembers the byte offsets of the $id and
+        $value slots. Only top level placeholders can be spliced.
+
+        :return: True if both placeholders were found at the top level of the template
+        """
+        templateDoc = json.loads(self.doc.replace(self.VALUE_PLACEHOLDER, str(self.VALUE_SENTINEL)))
+        segments = []
+        self.idSlot = None
+        self.valueSlot = None
+        for key, value in templateDoc.items():
+            if value == self.ID_PLACEHOLDER:
+                self.idSlot = len(segments)
+                segments.append(b"\x02" + key.encode("utf-8") + b"\x00")
+            elif value == self.VALUE_SENTINEL:
+                self.valueSlot = len(segments)
+                segments.append(key.encode("utf-8") + b"\x00")
+            elif segments and isinstance(segments[-1], bytearray):
+                segments[-1] += bson.encode({key: value})[4:-1]
+            else:
+                segments.append(bytearray(bson.encode({key: value})[4:-1]))
+        if self.idSlot is None or self.valueSlot is None:
+            return False
+        self.segments = [bytes(segment) for segment in segments]
+        return True
     def createDocument(self, testIdx, num):
         """
         Create Document
 
+        :param testIdx:
         :param num:
         :return:
         """
-        return json.loads(self.doc.replace("$id", testIdx).replace("$value", str(num)))
+        docId = "{}-{}".format(testIdx, num)
+        if not self.useRawBson:
+            return json.loads(self.doc.replace(self.ID_PLACEHOLDER, docId).replace(self.VALUE_PLACEHOLDER, str(num)))
+
+        idBytes = docId.encode("utf-8")
+        parts = list(self.segments)
+        parts[self.idSlot] += struct.pack("<i", len(idBytes) + 1) + idBytes + b"\x00"
+        if -2**31 <= num < 2**31:
+            parts[self.valueSlot] = b"\x10" + parts[self.valueSlot] + struct.pack("<i", num)
+        else:
+            parts[self.valueSlot] = b"\x12" + parts[self.valueSlot] + struct.pack("<q", num)
+        body = b"".join(parts)
+        return RawBSONDocument(struct.pack("<i", len(body) + 5) + body + b"\x00")
     def getEqMatchingCriteria(self, testIdx, num):
         """
         Get Equality Matching Criteria
@@ -241,46 +502,185 @@ class kb50DocumentProvider(DocumentProvider):
         :return:
         """
         return "value"
+    def getIndexes(self):
+        """
+        Get Indexes
+
+        The multikey indexes are on the tags and friends arrays of 50kb.json and 1mb.json
+
+        :return:
+        """
+        return [
+            ("single",   [("value", pymongo.ASCENDING)]),
+            ("single",   [("age", pymongo.ASCENDING)]),
+            ("compound", [("eyeColor", pymongo.ASCENDING), ("age", pymongo.ASCENDING)]),
+            ("multikey", [("tags", pymongo.ASCENDING)]),
+            ("multikey", [("friends.name", pymongo.ASCENDING)])
+        ]
 
-class mb1DocumentProvider(DocumentProvider):
+class kb50DocumentProvider(TemplateDocumentProvider):
     """
-    Integer Value Document Provider
+    50KB Document Provider
 
-    A class that deterministically creates documents
+    A class that deterministically creates ~50KB documents from 50kb.json
+    """
+    def __init__(self, useRawBson=True):
+        TemplateDocumentProvider.__init__(self, "50kb.json", useRawBson)
+
+class mb1DocumentProvider(TemplateDocumentProvider):
+    """
+    1MB Document Provider
+
+    A class that deterministically creates ~1MB documents from 1mb.json
+    """
+    def __init__(self, useRawBson=True):
+        TemplateDocumentProvider.__init__(self, "1mb.json", useRawBson)
+
+
+def withUriOption(connString, name, value):
+    """
+    With Uri Option
+
+    :param connString:
+    :param name:
+    :param value: the value of the option, or None to remove it
+    :return: connString with the option name set to value in its query string, replacing any
+             value it had
+    """
+    base, query = (connString.split("?", 1) + [""])[:2]
+    # Option names are case insensitive and options may be separated by & or ;
+    options = [option for option in re.split("[&;]", query) if option and option.split("=", 1)[0].lower() != name.lower()]
+    if value is not None:
+        options.append("{}={}".format(name, value))
+    if not options:
+        return base
+    scheme, hosts = base.split("://", 1)
+    # The query string of a URI without a database must follow a slash
+    if "/" not in hosts:
+        base += "/"
+    return "{}?{}".format(base, "&".join(options))
+
+def compressorAvailable(compressor):
+    """
+    Compressor Available
+
+    :param compressor: a wire protocol compressor, one of zlib, snappy and zstd
+    :return: True if the package the driver needs for compressor is installed
+    """
+    packages = {"zlib": "zlib", "snappy": "snappy", "zstd": "zstandard"}
+    if compressor not in packages:
+        return False
+    try:
+        __import__(packages[compressor])
+    except ImportError:
+        return False
+    return True
+
+class ConnectionCounter(monitoring.ConnectionPoolListener):
+    """
+    Connection Counter
+
+    A connection pool listener that counts the connections opened and closed by a client
     """
     def __init__(self):
-        DocumentProvider.__init__(self)
-        f = open("1mb.json","r")
-        self.doc = f.read()
-    def createDocument(self, testIdx, num):
-        """
-        Create Document
+        self.connectionsOpened = 0
+        self.connectionsClosed = 0
+    def connection_created(self, event):
+        self.connectionsOpened += 1
+    def connection_closed(self, event):
+        self.connectionsClosed += 1
+    def pool_created(self, event):
+        pass
+    def pool_ready(self, event):
+        pass
+    def pool_cleared(self, event):
+        pass
+    def pool_closed(self, event):
+        pass
+    def connection_ready(self, event):
+        pass
+    def connection_check_out_started(self, event):
+        pass
+    def connection_check_out_failed(self, event):
+        pass
+    def connection_checked_out(self, event):
+        pass
+    def connection_checked_in(self, event):
+        pass
+
+class MongoClientRegistry():
+    """
+    Mongo Client Registry
 
-        :param num:
-        :return:
-        """
-        return json.loads(self.doc.replace("$id", testIdx).replace("$value", str(num)))
-    def getEqMatchingCriteria(self, testIdx, num):
-        """
-        Get Equality Matching Criteria
-        :param num:
+    Hands out one MongoClient per connection string and process so every test trial reuses the
+    same connection pool. Clients are keyed by process id as well because a MongoClient must not
+    be shared across a fork.
+    """
+    def __init__(self, maxPoolSize=100):
+        self.maxPoolSize = maxPoolSize
+        self.clients = {}
+        self.counters = {}
+        self.lock = threading.Lock()
+    def getClient(self, connString):
+        """
+        Get Client
+
+        :param connString:
+        :return: the MongoClient of this process for connString
+        """
+        key = (connString, os.getpid())
+        client = self.clients.get(key)
+        if client is None:
+            with self.lock:
+                client = self.clients.get(key)
+                if client is None:
+                    counter = ConnectionCounter()
+                    client = pymongo.MongoClient(connString, maxPoolSize=self.maxPoolSize, event_listeners=[counter])
+                    self.counters[key] = counter
+                    self.clients[key] = client
+        return client
+    def warmUp(self, connString, numConnections=1):
+        """
+        Warm Up
+
+        Opens up to numConnections pooled connections by running concurrent pings, so connection
+        handshakes happen before any timing starts
+
+        :param connString:
+        :param numConnections:
         :return:
         """
-        return { "value" : num }
-
-    def getRangeMatchingCriteria(self, testIdx, num):
+        client = self.getClient(connString)
+        numConnections = min(numConnections, self.maxPoolSize)
+        barrier = threading.Barrier(numConnections)
+        def ping():
+            barrier.wait()
+            client.admin.command("ping")
+        threads = [threading.Thread(target=ping) for i in range(numConnections)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+    def connectionsOpened(self, connString):
         """
+        Connections Opened
 
-        :param num:
-        :return:
+        :param connString:
+        :return: the number of connections opened by this process for connString
         """
-        return { "value" : { "$gt" : num } }
-    def getIndex(self):
+        counter = self.counters.get((connString, os.getpid()))
+        return counter.connectionsOpened if counter is not None else 0
+    def closeAll(self):
         """
-        Get Index
+        Close All
 
-        Returns the index that should be created to satisfy queries implied by getEqMatchingCriteria() and getRangeMatchingCriteria()
-
-        :return:
+        Closes the clients created by this process
         """
-        return "value"
\ No newline at end of file
+        with self.lock:
+            pid = os.getpid()
+            for key in [key for key in self.clients if key[1] == pid]:
+                self.clients.pop(key).close()
+                self.counters.pop(key)
+
+# Registry shared by every test in this process
+clientRegistry = MongoClientRegistry()